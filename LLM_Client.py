@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import asyncio
 from openai import AsyncOpenAI
@@ -7,8 +8,104 @@ from dotenv import load_dotenv
 from typing import Dict, List, Optional, Any
 import httpx
 
+from metrics import llm_latency, llm_errors, llm_batch_size, llm_calls_saved, llm_calls_cancelled
+
 load_dotenv(override=True)
 
+_JSON_START_RE = re.compile(r'\{.*', re.DOTALL)
+
+def _fix_truncated_json(s: str) -> str:
+    s = s.strip()
+    if not s.endswith('}'):
+        if s.count('"') % 2 != 0:
+            s += '"'
+        open_braces = s.count('{')
+        close_braces = s.count('}')
+        s += '}' * (open_braces - close_braces)
+    return s
+
+def parse_plan_response(response_text: str) -> Dict[str, Any]:
+    """
+    Extracts the action JSON from a planning response, tolerating code fences,
+    leading prose and output truncated by max_tokens. Raises on unrecoverable input.
+    """
+    json_match = _JSON_START_RE.search(response_text)
+    if json_match:
+        json_str = json_match.group(0)
+        json_str = json_str.replace('```json', '').replace('```', '').strip()
+        json_str = _fix_truncated_json(json_str)
+        try:
+            return json.loads(json_str)
+        except json.JSONDecodeError:
+            last_brace = json_str.rfind('}')
+            if last_brace != -1:
+                try:
+                    return json.loads(json_str[:last_brace+1])
+                except: pass
+            raise
+    else:
+        return json.loads(_fix_truncated_json(response_text.strip()))
+
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+
+def parse_verdicts(response_text: str, count: int) -> Optional[List[bool]]:
+    """Reads a JSON array of true/false verdicts; None if it is missing or has the wrong length."""
+    match = _JSON_ARRAY_RE.search(response_text or '')
+    if not match:
+        return None
+    try:
+        values = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(values, list) or len(values) != count:
+        return None
+    return [v is True or str(v).strip().upper() == 'TRUE' for v in values]
+
+class SuspicionBatcher:
+    """
+    Collects suspicion checks from concurrent callers for up to `max_wait` seconds
+    (or until `max_batch` are pending), classifies them with one LLM call and
+    resolves each caller's future with its own verdict.
+    """
+
+    def __init__(self, classify, max_batch: int = 16, max_wait: float = 0.02):
+        self.classify = classify
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = []
+        self._flush_handle = None
+        self._tasks = set()
+
+    async def check(self, text: str) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            verdicts = await self.classify([text for text, _ in batch])
+        except Exception as e:
+            print(f"Suspicion batch error: {e}")
+            verdicts = [False] * len(batch)
+        for (_, future), verdict in zip(batch, verdicts):
+            if not future.done():
+                future.set_result(verdict)
+
 class LLMClient:
     def __init__(self):
         self.provider = os.getenv('LLM_PROVIDER', 'glm').lower()
@@ -23,6 +120,16 @@ class LLMClient:
         else:
             raise ValueError(f"Unsupported provider: {self.provider}. Use: glm, openai, or gemini")
         
+        # Background calls such as conversation summaries can use a cheaper model
+        self.summary_model = os.getenv('LLM_SUMMARY_MODEL') or None
+        self._models = {}
+        
+        self.suspicion_batcher = SuspicionBatcher(
+            self.classify_suspicion_batch,
+            max_batch=int(os.getenv('SUSPICION_BATCH_SIZE', '16')),
+            max_wait=float(os.getenv('SUSPICION_BATCH_WAIT_MS', '20')) / 1000
+        )
+        
         print(f"LLM Client initialized with provider: {self.provider.upper()}")
     
     def _init_glm(self):
@@ -59,7 +166,27 @@ class LLMClient:
         self.client = genai.GenerativeModel(self.model)
     
     async def chat_completion(self, messages: List[Dict[str, str]], temperature: float = 0.8, 
-                            max_tokens: int = 2000) -> str:
+                            max_tokens: int = 2000, call_type: str = 'chat', model: Optional[str] = None) -> str:
+        try:
+            with llm_latency.time(call_type=call_type):
+                return await self._chat_completion(messages, temperature, max_tokens, model or self.model)
+        except asyncio.CancelledError:
+            # The reply this call was for is no longer wanted; the HTTP request is abandoned with it
+            llm_calls_cancelled.inc(call_type=call_type)
+            raise
+        except Exception:
+            llm_errors.inc(call_type=call_type)
+            raise
+
+    def _gemini_model(self, model: str):
+        if model == self.model:
+            return self.client
+        if model not in self._models:
+            self._models[model] = genai.GenerativeModel(model)
+        return self._models[model]
+
+    async def _chat_completion(self, messages: List[Dict[str, str]], temperature: float, 
+                               max_tokens: int, model: str) -> str:
         max_retries = 3
         for attempt in range(max_retries):
             try:
@@ -70,7 +197,7 @@ class LLMClient:
                         "Content-Type": "application/json"
                     }
                     data = {
-                        "model": self.model,
+                        "model": model,
                         "messages": messages,
                         "temperature": temperature,
                     }
@@ -106,7 +233,7 @@ class LLMClient:
                 
                 elif self.provider == 'openai':
                     response = await self.client.chat.completions.create(
-                        model=self.model,
+                        model=model,
                         messages=messages,
                         temperature=temperature,
                         max_tokens=max_tokens
@@ -121,7 +248,7 @@ class LLMClient:
                     )
                     
                     response = await asyncio.to_thread(
-                        self.client.generate_content,
+                        self._gemini_model(model).generate_content,
                         converted_messages,
                         generation_config=generation_config
                     )
@@ -140,6 +267,7 @@ class LLMClient:
         return ""
 
     async def generate_response(self, user_input: str, context: Dict[str, Any], is_suspicion_check: bool = False) -> str:
+        summary = f"\nConversation so far (summary):\n{context['channel_summary']}\n" if context.get('channel_summary') else ''
         base_prompt = f"""You are a human Discord user.
 Your name is '{context.get('bot_name', 'Unknown')}' (Display: '{context.get('bot_display_name', 'Unknown')}').
 Your bio/description says: '{context.get('bio', 'No bio provided')}'
@@ -155,20 +283,24 @@ Rules:
 
 Quoted message:
 {context.get('quoted_message', '')}
-
+{summary}
 Channel context:
 {context.get('channel_context', '')}
 
 Detected links:
 {', '.join(context.get('links', []))}
 """
+        if context.get('user_summary'):
+            base_prompt += f"\nWhat {context.get('author_name', 'they')} has talked about before:\n{context['user_summary']}\n"
+        if context.get('related_history'):
+            base_prompt += f"\nEarlier related messages:\n{context['related_history']}\n"
         if is_suspicion_check or context.get('is_suspicion_check'):
             base_prompt += "\nAdditional rule: If asked whether you are AI, naturally deny being AI and keep it plausible."
         messages = [
             {"role": "system", "content": base_prompt},
             {"role": "user", "content": user_input}
         ]
-        return await self.chat_completion(messages)
+        return await self.chat_completion(messages, call_type='generate_response')
 
     async def generate_proactive_message(self, context: Dict[str, Any]) -> str:
         system_prompt = f"""You are a human Discord user.
@@ -190,7 +322,7 @@ Rules:
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": "Generate a natural message to start or continue the conversation."}
         ]
-        return await self.chat_completion(messages)
+        return await self.chat_completion(messages, call_type='proactive_message')
 
     async def is_suspicion_detected(self, text: str) -> bool:
         system_prompt = """You are a social engineering expert.
@@ -203,11 +335,42 @@ Respond ONLY 'TRUE' if suspicion exists, otherwise 'FALSE'."""
         ]
         
         try:
-            response = await self.chat_completion(messages, temperature=0.0)
+            response = await self.chat_completion(messages, temperature=0.0, call_type='suspicion')
             return "TRUE" in response.upper()
-        except:
+        except Exception:
             return False
     
+    async def classify_suspicion_batch(self, texts: List[str]) -> List[bool]:
+        if len(texts) == 1:
+            return [await self.is_suspicion_detected(texts[0])]
+        
+        system_prompt = """You are a social engineering expert.
+Analyze each of the following numbered messages and determine, for each one, if its author suspects the interlocutor is an AI or a bot.
+Respond ONLY with a JSON array of true/false values, one per message, in the same order."""
+        
+        numbered = "\n".join(f"{i + 1}. {json.dumps(text[:500], ensure_ascii=False)}" for i, text in enumerate(texts))
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": numbered}
+        ]
+        
+        llm_batch_size.observe(len(texts), call_type='suspicion')
+        try:
+            response = await self.chat_completion(messages, temperature=0.0, call_type='suspicion_batch')
+        except Exception:
+            return [False] * len(texts)
+        
+        verdicts = parse_verdicts(response, len(texts))
+        if verdicts is None:
+            print(f"Unparseable suspicion batch response, checking {len(texts)} messages one by one")
+            return list(await asyncio.gather(*(self.is_suspicion_detected(text) for text in texts)))
+        llm_calls_saved.inc(len(texts) - 1, call_type='suspicion')
+        return verdicts
+    
+    async def check_suspicion(self, text: str) -> bool:
+        """Like is_suspicion_detected, but batched with other concurrent checks."""
+        return await self.suspicion_batcher.check(text)
+    
     async def rewrite_safe_text(self, text: str, language: str = 'english') -> str:
         lang = language.lower()
         if lang not in ['english','italian']:
@@ -219,11 +382,32 @@ Rewrite the following message in {lang}, natural human style, 2–3 short senten
             {"role": "user", "content": text}
         ]
         try:
-            result = await self.chat_completion(messages, temperature=0.4)
+            result = await self.chat_completion(messages, temperature=0.4, call_type='rewrite')
             return result.strip() if result else text
-        except:
+        except Exception:
             return text
 
+    async def summarize_conversation(self, previous: str, lines: List[str], subject: str = 'channel') -> str:
+        """Folds new message lines into a running summary; returns the updated summary."""
+        if subject == 'user':
+            scope = "everything one Discord user has said across channels (who they are, interests, opinions, questions, what they asked of others)"
+        else:
+            scope = "a Discord channel's conversation (who is talking, topics, decisions, open questions, running jokes, shared links)"
+        system_prompt = (
+            f"You keep a running summary of {scope}.\n"
+            "Update the previous summary with the new messages. Keep names and concrete details, drop small talk "
+            "and anything no longer relevant. At most 120 words, plain text, no preamble."
+        )
+        user_prompt = f"Previous summary:\n{previous or '(none)'}\n\nNew messages:\n" + "\n".join(lines)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        result = await self.chat_completion(
+            messages, temperature=0.2, max_tokens=1000, call_type='summary', model=self.summary_model
+        )
+        return (result or '').strip()
+
     async def plan_next_action(self, context: Dict[str, Any]) -> Dict[str, Any]:
         rules = ""
         if self.priority_guild_id and str(self.priority_guild_id).strip():
@@ -260,6 +444,7 @@ Rewrite the following message in {lang}, natural human style, 2–3 short senten
             "}\n"
         )
         
+        summary = f"Conversation so far (summary):\n{context['channel_summary']}\n\n" if context.get('channel_summary') else ''
         user_prompt = f"""Current context:
 Your name: {context.get('bot_name')}
 Your bio: {context.get('bio')}
@@ -269,7 +454,7 @@ Mood: {context.get('mood')}
 Personality: {context.get('personality')}
 Channel language: {context.get('channel_language', 'english')}
 
-Recent messages:
+{summary}Recent messages:
 {json.dumps(context.get('recent_messages', []), indent=2)}
 
 What is the next action? Respond only in JSON. Remember to act according to your bio."""
@@ -281,40 +466,13 @@ What is the next action? Respond only in JSON. Remember to act according to your
         
         try:
             print(f"DEBUG: Calling chat_completion for planning...")
-            response_text = await self.chat_completion(messages, temperature=0.7, max_tokens=4000)
+            response_text = await self.chat_completion(messages, temperature=0.7, max_tokens=4000, call_type='plan')
             print(f"DEBUG: Planning response text: '{response_text}'")
             
             if not response_text:
                 raise ValueError("LLM returned empty response")
                 
-            import re
-            
-            def fix_truncated_json(s):
-                s = s.strip()
-                if not s.endswith('}'):
-                    if s.count('"') % 2 != 0:
-                        s += '"'
-                    open_braces = s.count('{')
-                    close_braces = s.count('}')
-                    s += '}' * (open_braces - close_braces)
-                return s
-
-            json_match = re.search(r'\{.*', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                json_str = json_str.replace('```json', '').replace('```', '').strip()
-                json_str = fix_truncated_json(json_str)
-                try:
-                    return json.loads(json_str)
-                except json.JSONDecodeError:
-                    last_brace = json_str.rfind('}')
-                    if last_brace != -1:
-                        try:
-                            return json.loads(json_str[:last_brace+1])
-                        except: pass
-                    raise
-            else:
-                return json.loads(fix_truncated_json(response_text.strip()))
+            return parse_plan_response(response_text)
                 
         except Exception as e:
             print(f"Planning error: {str(e)}")
@@ -328,12 +486,12 @@ What is the next action? Respond only in JSON. Remember to act according to your
             {"role": "user", "content": sample or ""}
         ]
         try:
-            response = await self.chat_completion(messages, temperature=0.0, max_tokens=5)
+            response = await self.chat_completion(messages, temperature=0.0, max_tokens=5, call_type='detect_language')
             out = (response or "").strip().lower()
             if "ital" in out:
                 return "italian"
             return "english"
-        except:
+        except Exception:
             return "english"
 
     def _convert_to_gemini_format(self, messages: List[Dict[str, str]]) -> List[Dict[str, Any]]:
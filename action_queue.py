@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+import metrics
+
+# Lower value is served first
+URGENT = 0      # DMs and direct mentions
+AMBIENT = 1     # messages in the focused channel
+PLANNED = 2     # proactive actions from the planner
+
+PRIORITY_NAMES = {URGENT: 'urgent', AMBIENT: 'ambient', PLANNED: 'planned'}
+
+DEFAULT_TTL = {URGENT: 900.0, AMBIENT: 180.0, PLANNED: 120.0}
+
+class _Entry:
+    __slots__ = ('priority', 'seq', 'item', 'merge_key', 'enqueued', 'first_enqueued', 'merged', 'removed')
+
+    def __init__(self, priority, seq, item, merge_key, now):
+        self.priority = priority
+        self.seq = seq
+        self.item = item
+        self.merge_key = merge_key
+        self.enqueued = now
+        self.first_enqueued = now
+        self.merged = 0
+        self.removed = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class ActionQueue:
+    """
+    Priority queue for the action processor, with the get/put/qsize surface of asyncio.Queue.
+
+    - Items are served by priority (URGENT, AMBIENT, PLANNED), then in arrival order.
+    - An item older than its priority's TTL when it reaches the head is discarded.
+    - Putting an item with the `merge_key` of one still queued replaces that item's payload
+      with the newer one (keeping its place, upgrading its priority), so a burst in a channel
+      becomes a single reply decision about the latest message. A newer item of lower
+      priority is merged into the queued one instead, so a mention is never replaced by
+      later ambient chatter.
+    - At `maxsize`, the lowest-priority oldest item is dropped, or the new one if everything
+      queued outranks it.
+
+    `on_discard(item, reason)` is called for every item that will not be served, with reason
+    'expired', 'dropped', 'merged' or the one given to `discard()`. `clock` can be swapped
+    for a virtual one.
+    """
+
+    def __init__(self, maxsize=200, ttl=None, on_discard=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = {**DEFAULT_TTL, **(ttl or {})}
+        self.on_discard = on_discard
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        self._by_key = {}
+        self._size = 0
+        self._wakeup = asyncio.Event()
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def depth_by_priority(self):
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for entry in self._heap:
+            if not entry.removed:
+                depth[PRIORITY_NAMES[entry.priority]] += 1
+        return depth
+
+    async def put(self, item, priority=AMBIENT, merge_key=None):
+        self.put_nowait(item, priority, merge_key)
+
+    def put_nowait(self, item, priority=AMBIENT, merge_key=None):
+        now = self.clock()
+        if merge_key is not None:
+            existing = self._by_key.get(merge_key)
+            if existing is not None and not existing.removed:
+                existing.merged += 1
+                if existing.priority < priority:
+                    # A queued mention or DM outranks a later ambient message: keep the reply aimed at it
+                    self._discard(item, 'merged')
+                    return
+                self._discard(existing.item, 'merged')
+                existing.item = item
+                existing.enqueued = now
+                if priority < existing.priority:
+                    # Re-push with the better priority; the old heap slot becomes a tombstone
+                    existing.removed = True
+                    upgraded = _Entry(priority, existing.seq, item, merge_key, now)
+                    upgraded.first_enqueued = existing.first_enqueued
+                    upgraded.merged = existing.merged
+                    self._by_key[merge_key] = upgraded
+                    heapq.heappush(self._heap, upgraded)
+                return
+
+        if self._size >= self.maxsize:
+            self._expire(now)
+        if self._size >= self.maxsize:
+            victim = max((e for e in self._heap if not e.removed), key=lambda e: (e.priority, -e.seq))
+            if victim.priority < priority:
+                self._discard(item, 'dropped')
+                return
+            self._remove(victim)
+            self._discard(victim.item, 'dropped')
+
+        entry = _Entry(priority, next(self._seq), item, merge_key, now)
+        if merge_key is not None:
+            self._by_key[merge_key] = entry
+        heapq.heappush(self._heap, entry)
+        self._size += 1
+        self._wakeup.set()
+
+    def discard(self, merge_key, reason, match=None):
+        """Drops the item queued under `merge_key` (if `match(item)` holds); returns whether one was dropped."""
+        entry = self._by_key.get(merge_key)
+        if entry is None or entry.removed or (match is not None and not match(entry.item)):
+            return False
+        self._remove(entry)
+        self._discard(entry.item, reason)
+        return True
+
+    async def get(self):
+        while True:
+            entry = self._pop(self.clock())
+            if entry is not None:
+                metrics.queue_age.observe(self.clock() - entry.first_enqueued, priority=PRIORITY_NAMES[entry.priority])
+                return entry.item
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def _pop(self, now):
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry.removed:
+                continue
+            self._forget(entry)
+            if now - entry.enqueued > self.ttl[entry.priority]:
+                self._discard(entry.item, 'expired')
+                continue
+            return entry
+        return None
+
+    def _expire(self, now):
+        for entry in self._heap:
+            if not entry.removed and now - entry.enqueued > self.ttl[entry.priority]:
+                self._remove(entry)
+                self._discard(entry.item, 'expired')
+
+    def _remove(self, entry):
+        entry.removed = True
+        self._forget(entry)
+
+    def _forget(self, entry):
+        self._size -= 1
+        if entry.merge_key is not None and self._by_key.get(entry.merge_key) is entry:
+            del self._by_key[entry.merge_key]
+
+    def _discard(self, item, reason):
+        metrics.queue_discarded.inc(reason=reason)
+        if self.on_discard:
+            try:
+                self.on_discard(item, reason)
+            except Exception as e:
+                print(f"Action queue discard callback error: {e}")
@@ -0,0 +1,513 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+os.environ.setdefault('LLM_PROVIDER', 'glm')
+os.environ.setdefault('GLM_API_KEY', 'benchmark')
+
+from sqlalchemy import insert
+
+from database import db_manager, Guild, Channel, User, Message, BotResponse, Interaction, SocialTestLog, StatsCounter
+from safety_filter import SafetyFilter
+from LLM_Client import parse_plan_response
+
+SEED = 1234
+BENCH_DIR = 'bench_data'
+# Fixture IDs are snowflake-sized, as storage cost depends on their magnitude
+SNOWFLAKE = 1_100_000_000_000_000_000
+
+WORDS = (
+    "yo the new build is broken again lol can someone check the api docs I think the workflow "
+    "changed and my diagram export does not work anymore anyway gm everyone what are you playing "
+    "tonight minecraft or elden ring steam update tomorrow patch notes look wild ngl"
+).split()
+
+# Planning responses as they come back from the providers: clean, fenced, with
+# leading prose, truncated by max_tokens, and with trailing garbage.
+PLAN_RESPONSES = [
+    '{"action": "wait", "reason": "quiet channel", "confidence": 0.4}',
+    '```json\n{"action": "chat", "target_user": "123", "message": "lol same here", "reason": "join", "confidence": 0.8}\n```',
+    'Sure! Here is the plan:\n{"action": "send", "target_channel": "456", "message": "anyone tried the patch?", "reason": "start talk", "confidence": 0.7}',
+    '{"action": "roam", "target_server": "1320998163615846420", "target_channel": "0", "reason": "priority server", "confidence": 0.9',
+    '{"action": "chat", "target_user": "789", "message": "that diagram looks sick, which tool',
+    '{"action": "wait", "reason": "low interest", "confidence": 0.3}\nLet me know if you need anything else.}',
+    '{\n  "action": "send",\n  "target_channel": "456",\n  "message": "gm, did the api change again?",\n  "reason": "context",\n  "confidence": 0.65\n}',
+]
+
+def _corpus(count, rng, min_words=3, max_words=40):
+    texts = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+        roll = rng.random()
+        if roll < 0.05:
+            words.append('https://discord.gg/abc123')
+        elif roll < 0.08:
+            words.append('someone@example.com')
+        elif roll < 0.10:
+            words.append('free nitro free giveaway claim now')
+        texts.append(' '.join(words))
+    return texts
+
+def _measure(fn, repeat=5, number=1):
+    """Runs `fn` `number` times per sample; returns per-call seconds for each sample."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return samples
+
+async def _measure_async(fn, repeat=5, number=1):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            await fn()
+        samples.append((time.perf_counter() - start) / number)
+    return samples
+
+def _result(samples, items_per_call=1, **extra):
+    median = statistics.median(samples)
+    return dict({
+        'median_s': median,
+        'min_s': min(samples),
+        'mean_s': statistics.mean(samples),
+        'per_item_us': median / items_per_call * 1e6,
+        'items_per_sec': items_per_call / median if median else None,
+        'samples': len(samples)
+    }, **extra)
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_safety_filter(size):
+    rng = random.Random(SEED)
+    corpus = _corpus(size, rng)
+    sf = SafetyFilter()
+    def run():
+        for text in corpus:
+            sf.is_safe(text)
+    return {'safety_filter.is_safe': _result(_measure(run), size, corpus=size)}
+
+def bench_plan_parsing(size):
+    corpus = [PLAN_RESPONSES[i % len(PLAN_RESPONSES)] for i in range(size)]
+    def run():
+        for text in corpus:
+            try:
+                parse_plan_response(text)
+            except ValueError:
+                pass
+    return {'llm.parse_plan_response': _result(_measure(run), size, corpus=size)}
+
+def bench_context_building(buffer_sizes):
+    from replay_harness import World, ReplayBot, VirtualClock
+
+    results = {}
+    rng = random.Random(SEED)
+    for size in buffer_sizes:
+        world = World(VirtualClock(1.0))
+        bot = ReplayBot(world)
+        bot.recent_messages = deque(maxlen=size)
+        channels = [1000 + i for i in range(8)]
+        for i in range(size):
+            message = world.message({
+                'guild': 100, 'channel': rng.choice(channels), 'author': 10_000 + rng.randrange(200),
+                'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+            })
+            bot._add_to_recent(message)
+        target = world.message({'guild': 100, 'channel': channels[0], 'author': 10_001, 'content': 'check https://example.com api workflow'})
+
+        results[f'bot._build_ai_context[buffer={size}]'] = _result(
+            _measure(lambda: bot._build_ai_context(target, 'english'), number=200), buffer=size
+        )
+        results[f'bot.recent_channel_scan[buffer={size}]'] = _result(
+            _measure(lambda: [m['content'] for m in bot.recent_messages if m.get('channel') == target.channel.id][-10:], number=200),
+            buffer=size
+        )
+        results[f'bot.planner_focus_scan[buffer={size}]'] = _result(
+            _measure(lambda: [m for m in bot.recent_messages if m['channel'] == target.channel.id or m['is_dm']], number=200),
+            buffer=size
+        )
+    return results
+
+def bench_memory(corpus_size, vector_counts, dim=256):
+    """
+    Embedding throughput on the fixed corpus, and top-20 search over memory-mapped stores of
+    `vector_counts` random unit vectors (cached in bench_data/, ~1 KiB per vector at dim 256).
+    """
+    import numpy as np
+    from memory_index import HashingEmbedder, VectorStore
+
+    results = {}
+    rng = random.Random(SEED)
+    corpus = _corpus(corpus_size, rng)
+    embedder = HashingEmbedder(dim)
+    def embed_all():
+        for text in corpus:
+            embedder.embed(text)
+    results['memory.embed'] = _result(_measure(embed_all), corpus_size, corpus=corpus_size)
+
+    np_rng = np.random.default_rng(SEED)
+    for count in vector_counts:
+        base = os.path.join(BENCH_DIR, f'memory_{count}_{dim}')
+        store = VectorStore(base, dim)
+        if len(store) != count:
+            print(f"Building vector store with {count} vectors ({base}.f32)...", file=sys.stderr)
+            for path in (store.vectors_path, store.ids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            for offset in range(0, count, 100_000):
+                n = min(100_000, count - offset)
+                vectors = np_rng.standard_normal((n, dim), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                store.append(np.arange(offset, offset + n), vectors)
+        queries = [embedder.embed(text) for text in corpus[:20]]
+        def search():
+            for query in queries:
+                store.search(query, 20)
+        results[f'memory.search[vectors={count}]'] = _result(_measure(search), len(queries), vectors=count)
+    return results
+
+async def bench_database(count):
+    path = os.path.join(BENCH_DIR, 'writes.db')
+    if os.path.exists(path):
+        os.remove(path)
+    await db_manager.reconfigure(f'sqlite+aiosqlite:///{path}')
+    await db_manager.initialize()
+    rng = random.Random(SEED)
+    users = [10_000 + i for i in range(max(1, count // 10))]
+
+    start = time.perf_counter()
+    for i in range(count):
+        uid = rng.choice(users)
+        await db_manager.save_message(
+            uid, f'user{uid}', None, 5_000_000 + i, 1000 + i % 8, 'general',
+            ' '.join(rng.choice(WORDS) for _ in range(12)), server_id=100, server_name='bench'
+        )
+    save_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(count):
+        uid = rng.choice(users)
+        await db_manager.get_or_create_user(uid, f'user{uid}', None, 100, 'bench')
+    user_elapsed = time.perf_counter() - start
+
+    await db_manager.close()
+    return {
+        'db.save_message': _result([save_elapsed / count], 1, rows=count),
+        'db.get_or_create_user': _result([user_elapsed / count], 1, rows=count)
+    }
+
+async def bench_write_contention(tasks, hot_users=5):
+    """
+    Stress test for the upsert paths: `tasks` concurrent writers hammer a few discord IDs,
+    each message is saved twice and each reply recorded twice. Fails if any write errors
+    or if rows and rollup counters don't come out exactly once per ID.
+    """
+    from sqlalchemy import select, func
+
+    path = os.path.join(BENCH_DIR, 'contention.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    await db_manager.reconfigure(f'sqlite+aiosqlite:///{path}')
+    await db_manager.initialize()
+    rng = random.Random(SEED)
+    authors = [20_000 + rng.randrange(hot_users) for _ in range(tasks)]
+    messages = tasks // 2
+
+    async def writer(i):
+        uid = authors[i]
+        msg_id = 7_000_000 + i % messages
+        if i % 3 == 0:
+            await db_manager.get_or_create_user(uid, f'user{uid}', None, 100, 'bench')
+        await db_manager.save_message(uid, f'user{uid}', None, msg_id, 1000, 'general', 'hi', 100, 'bench')
+        await db_manager.record_reply(msg_id, 1000, 'lol', uid, f'user{uid}', server_id=100, server_name='bench')
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(writer(i) for i in range(tasks)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    problems = [f"writer failed: {o!r}" for o in outcomes if isinstance(o, Exception)][:5]
+    async with db_manager.async_session() as session:
+        expected = {
+            User: len(set(authors)),
+            Message: messages,
+            BotResponse: messages,
+            Interaction: tasks - sum(isinstance(o, Exception) for o in outcomes)
+        }
+        for model, count in expected.items():
+            actual = await session.scalar(select(func.count()).select_from(model))
+            if actual != count:
+                problems.append(f"{model.__tablename__}: {actual} rows, expected {count}")
+        counters = dict((await session.execute(select(StatsCounter.name, StatsCounter.value))).all())
+        for name, model in (('users', User), ('messages', Message), ('bot_responses', BotResponse)):
+            if counters.get(name) != expected[model]:
+                problems.append(f"stats counter {name} = {counters.get(name)}, expected {expected[model]}")
+    await db_manager.close()
+    if problems:
+        raise RuntimeError("Write contention check failed:\n  " + "\n  ".join(problems))
+    return {f'db.write_contention[tasks={tasks}]': _result([elapsed], tasks, tasks=tasks)}
+
+async def _build_stats_fixture(rows, path):
+    """Bulk-loads `rows` messages (plus users, responses and logs) with Core inserts, then rebuilds rollups."""
+    await db_manager.reconfigure(f'sqlite+aiosqlite:///{path}')
+    await db_manager.initialize()
+    rng = random.Random(SEED)
+    n_users = max(10, rows // 100)
+    start_ts = datetime.utcnow() - timedelta(days=60)
+    guilds = [SNOWFLAKE + 100 + g for g in range(3)]
+    channels = [SNOWFLAKE + 1000 + c for c in range(20)]
+    async with db_manager.engine.begin() as conn:
+        await conn.execute(insert(Guild), [{'id': g, 'name': f'bench{i}'} for i, g in enumerate(guilds)])
+        await conn.execute(insert(Channel), [
+            {'id': c, 'guild_id': guilds[i % 3], 'name': f'channel{i}'} for i, c in enumerate(channels)
+        ])
+        await conn.execute(insert(User), [
+            {'id': i + 1, 'discord_id': SNOWFLAKE + 10_000 + i, 'username': f'user{i}', 'server_id': guilds[0],
+             'first_seen': start_ts, 'last_seen': start_ts,
+             'is_suspicious': i % 97 == 0, 'suspicion_count': 1 if i % 97 == 0 else 0}
+            for i in range(n_users)
+        ])
+        batch = 50_000
+        for offset in range(0, rows, batch):
+            n = min(batch, rows - offset)
+            await conn.execute(insert(Message), [
+                {'user_id': rng.randrange(n_users) + 1, 'discord_message_id': SNOWFLAKE + offset + i,
+                 'channel_id': rng.choice(channels), 'server_id': rng.choice(guilds),
+                 'content': ' '.join(rng.choice(WORDS) for _ in range(10)),
+                 'timestamp': start_ts + timedelta(seconds=(offset + i) * 5_184_000 / rows),
+                 'is_dm': rng.random() < 0.05}
+                for i in range(n)
+            ])
+            await conn.execute(insert(BotResponse), [
+                {'discord_message_id': SNOWFLAKE + rows + offset + i, 'channel_id': channels[0], 'server_id': guilds[0],
+                 'content': 'lol yeah', 'timestamp': start_ts + timedelta(seconds=(offset + i) * 5_184_000 / rows),
+                 'action_type': 'REPLY'}
+                for i in range(0, n, 10)
+            ])
+        await conn.execute(insert(SocialTestLog), [
+            {'log_type': 'SUSPICION' if i % 5 == 0 else 'ROAMING', 'content': f'log {i}',
+             'timestamp': start_ts + timedelta(minutes=i)}
+            for i in range(1000)
+        ])
+    start = time.perf_counter()
+    await db_manager.rebuild_stats_rollups()
+    elapsed = time.perf_counter() - start
+    await db_manager.rebuild_search_index()
+    return elapsed
+
+async def bench_stats_queries(sizes):
+    import stats_viewer
+
+    results = {}
+    for rows in sizes:
+        path = os.path.join(BENCH_DIR, f'stats_v2_{rows}.db')
+        rebuild = None
+        if not os.path.exists(path):
+            print(f"Building stats fixture with {rows} messages ({path})...", file=sys.stderr)
+            rebuild = await _build_stats_fixture(rows, path)
+        else:
+            await db_manager.reconfigure(f'sqlite+aiosqlite:///{path}')
+            # Builds the search index once for fixtures made before it existed
+            await db_manager.initialize()
+        results[f'stats.collect_stats[rows={rows}]'] = _result(await _measure_async(stats_viewer.collect_stats), rows=rows)
+        results[f'stats.collect_top_users[rows={rows}]'] = _result(await _measure_async(stats_viewer.collect_top_users), rows=rows)
+        results[f'stats.collect_logs[rows={rows}]'] = _result(await _measure_async(stats_viewer.collect_logs), rows=rows)
+        results[f'stats.search_messages[rows={rows}]'] = _result(await _measure_async(
+            lambda: db_manager.search_messages('diagram export', limit=20)
+        ), rows=rows)
+        results[f'stats.search_messages_guild[rows={rows}]'] = _result(await _measure_async(
+            lambda: db_manager.search_messages('elden ring patch', guild=SNOWFLAKE + 100, limit=20, any_term=True)
+        ), rows=rows)
+        results[f'stats.search_messages_recent[rows={rows}]'] = _result(await _measure_async(
+            lambda: db_manager.search_messages(
+                'elden ring patch', guild=SNOWFLAKE + 100, limit=20, any_term=True, candidates=1000
+            )
+        ), rows=rows)
+        if rebuild is not None:
+            results[f'stats.rebuild_stats_rollups[rows={rows}]'] = _result([rebuild], rows=rows)
+        await db_manager.close()
+    return results
+
+async def _database_size():
+    async with db_manager.engine.connect() as conn:
+        pages = (await conn.exec_driver_sql("PRAGMA page_count")).scalar()
+        page_size = (await conn.exec_driver_sql("PRAGMA page_size")).scalar()
+    return pages * page_size
+
+async def bench_compression(sizes):
+    """
+    DB size and query times on a copy of the stats fixture, first with plain text content,
+    then after training a dictionary and recompressing every row. The channel history
+    query is the one that decompresses content on every call.
+    """
+    import shutil
+    import stats_viewer
+    from sqlalchemy import select
+
+    results = {}
+    for rows in sizes:
+        fixture = os.path.join(BENCH_DIR, f'stats_v2_{rows}.db')
+        if not os.path.exists(fixture):
+            print(f"Building stats fixture with {rows} messages ({fixture})...", file=sys.stderr)
+            await _build_stats_fixture(rows, fixture)
+            await db_manager.close()
+        path = os.path.join(BENCH_DIR, f'compressed_{rows}.db')
+        shutil.copyfile(fixture, path)
+        await db_manager.reconfigure(f'sqlite+aiosqlite:///{path}')
+        # Both phases are measured on a freshly packed file
+        await db_manager.compact(full=True)
+        async with db_manager.async_session() as session:
+            channel_id = await session.scalar(select(Message.channel_id).limit(1))
+
+        for phase in ('plain', 'zstd'):
+            if phase == 'zstd':
+                start = time.perf_counter()
+                await db_manager.train_content_dictionary()
+                rewritten = await db_manager.recompress_content(batch_size=5000, pause=0, vacuum=True)
+                results[f'compression.recompress[rows={rows}]'] = _result(
+                    [time.perf_counter() - start], sum(rewritten.values()), rows=rows, rewritten=rewritten
+                )
+            size = await _database_size()
+            print(f"compression: {phase} database with {rows} messages is {size / 1024 / 1024:.1f} MiB", file=sys.stderr)
+            for name, fn in (
+                ('collect_stats', stats_viewer.collect_stats),
+                ('collect_top_users', stats_viewer.collect_top_users),
+                ('collect_logs', lambda: stats_viewer.collect_logs(limit=1000)),
+                ('channel_messages', lambda: db_manager.get_channel_messages(channel_id, 500))
+            ):
+                results[f'compression.{name}[{phase},rows={rows}]'] = _result(
+                    await _measure_async(fn), rows=rows, db_bytes=size
+                )
+        await db_manager.close()
+    return results
+
+# ---------------------------------------------------------------------------
+# Runner and regression report
+# ---------------------------------------------------------------------------
+
+SUITES = ('safety', 'planner', 'context', 'db', 'contention', 'stats', 'compression', 'memory')
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+async def run_suites(suites, corpus_size, buffer_sizes, db_rows, stats_rows, contention_tasks=200,
+                     memory_vectors=(100_000,)):
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    results = {}
+    if 'safety' in suites:
+        results.update(bench_safety_filter(corpus_size))
+    if 'planner' in suites:
+        results.update(bench_plan_parsing(corpus_size))
+    if 'context' in suites:
+        results.update(bench_context_building(buffer_sizes))
+    if 'db' in suites:
+        results.update(await bench_database(db_rows))
+    if 'contention' in suites:
+        results.update(await bench_write_contention(contention_tasks))
+    if 'stats' in suites:
+        results.update(await bench_stats_queries(stats_rows))
+    if 'compression' in suites:
+        results.update(await bench_compression(stats_rows))
+    if 'memory' in suites:
+        results.update(bench_memory(corpus_size, memory_vectors))
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': SEED
+        },
+        'results': results
+    }
+
+def compare(baseline_path, current_path, threshold):
+    """Prints a per-benchmark comparison of median times; returns the names that regressed."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)['results']
+
+    regressions = []
+    print(f"{'BENCHMARK':<48} {'BASELINE':>12} {'CURRENT':>12} {'CHANGE':>9}")
+    print("-" * 84)
+    for name in sorted(set(baseline) | set(current)):
+        old, new = baseline.get(name), current.get(name)
+        if not old or not new:
+            print(f"{name:<48} {'-' if not old else _fmt(old['median_s']):>12} {'-' if not new else _fmt(new['median_s']):>12} {'n/a':>9}")
+            continue
+        change = (new['median_s'] - old['median_s']) / old['median_s'] if old['median_s'] else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"{name:<48} {_fmt(old['median_s']):>12} {_fmt(new['median_s']):>12} {change:>+8.1%}{flag}")
+    return regressions
+
+def _fmt(seconds):
+    if seconds >= 1:
+        return f"{seconds:.3f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    return f"{seconds * 1e6:.2f}us"
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path benchmarks with fixed-seed corpora")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help="Run benchmarks and write results as JSON")
+    p.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    p.add_argument('--corpus-size', type=int, default=5000)
+    p.add_argument('--buffer-sizes', type=int, nargs='+', default=[50, 500, 5000])
+    p.add_argument('--db-rows', type=int, default=500)
+    p.add_argument('--contention-tasks', type=int, default=200,
+                   help="Concurrent writers in the contention suite, which fails on lost or duplicated rows")
+    p.add_argument('--stats-rows', type=int, nargs='+', default=[100_000],
+                   help="Fixture sizes for stats queries, e.g. 1000000 10000000 (fixtures are cached in bench_data/)")
+    p.add_argument('--memory-vectors', type=int, nargs='+', default=[100_000],
+                   help="Vector store sizes for the memory suite, e.g. 1000000 (stores are cached in bench_data/)")
+    p.add_argument('--output', default=None, help="Defaults to bench_data/results_<timestamp>.json")
+
+    p = sub.add_parser('compare', help="Regression report between two result files")
+    p.add_argument('baseline')
+    p.add_argument('current')
+    p.add_argument('--threshold', type=float, default=0.10, help="Relative slowdown that counts as a regression")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        report = asyncio.run(run_suites(
+            args.suites, args.corpus_size, args.buffer_sizes, args.db_rows, args.stats_rows, args.contention_tasks,
+            args.memory_vectors
+        ))
+        output = args.output or os.path.join(BENCH_DIR, f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        for name, r in report['results'].items():
+            print(f"{name:<48} {_fmt(r['median_s']):>12}  ({r['per_item_us']:.2f}us/item)")
+        print(f"\nResults written to {output}")
+    elif args.command == 'compare':
+        regressions = compare(args.baseline, args.current, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
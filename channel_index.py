@@ -0,0 +1,59 @@
+import random
+import time
+
+import metrics
+
+class ChannelIndex:
+    """
+    Per-guild list of the text channels the bot can both read and write, built on first
+    use and dropped when channels, roles or the bot's own roles change. It also keeps an
+    exponentially decaying message count per channel, so roaming can prefer channels with
+    recent traffic while quiet ones keep a base chance.
+    """
+
+    def __init__(self, half_life=3600.0, base_weight=1.0):
+        self.half_life = half_life
+        self.base_weight = base_weight
+        self.eligible = {}
+        self.activity = {}
+
+    def channels(self, guild):
+        cached = self.eligible.get(guild.id)
+        metrics.record_cache('eligible_channels', cached is not None)
+        if cached is None:
+            cached = []
+            for channel in guild.text_channels:
+                perms = channel.permissions_for(guild.me)
+                if perms.read_messages and perms.send_messages:
+                    cached.append(channel)
+            self.eligible[guild.id] = cached
+        return cached
+
+    def invalidate(self, guild_id=None):
+        if guild_id is None:
+            self.eligible.clear()
+        else:
+            self.eligible.pop(guild_id, None)
+
+    def _decayed(self, channel_id, now):
+        score, updated = self.activity.get(channel_id, (0.0, now))
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def record_activity(self, channel_id, amount=1.0):
+        now = time.time()
+        self.activity[channel_id] = (self._decayed(channel_id, now) + amount, now)
+
+    def weight(self, channel_id):
+        return self.base_weight + self._decayed(channel_id, time.time())
+
+    def pick(self, guild, exclude=()):
+        channels = [c for c in self.channels(guild) if c.id not in exclude]
+        if not channels:
+            return None
+        return random.choices(channels, weights=[self.weight(c.id) for c in channels])[0]
+
+    def snapshot(self):
+        return {str(cid): [score, updated] for cid, (score, updated) in self.activity.items()}
+
+    def restore(self, data):
+        self.activity = {int(cid): (score, updated) for cid, (score, updated) in data.items()}
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import sqlite3
+import threading
+
+from sqlalchemy import Text
+from sqlalchemy.types import TypeDecorator
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+class ContentCodec:
+    """
+    zstd (optionally with a trained dictionary) for the large text columns.
+
+    A value is stored either as TEXT (rows written before compression was enabled, or
+    ones that didn't get smaller) or as a BLOB holding one zstd frame, so the SQLite
+    storage class is the per-row marker and old rows stay readable without a rewrite.
+    The frame header names the dictionary it needs; dictionaries are kept in the
+    `compression_dicts` table and loaded on first use, so a process can read rows that
+    another one compressed after a retrain.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.level = 3
+        self.current = 0
+        self.dictionaries = {}
+        self.dictionary_path = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def configure(self, enabled, level=3, dictionary_path=None):
+        if enabled and zstd is None:
+            raise RuntimeError("DB_COMPRESS_CONTENT=1 requires zstandard (pip install zstandard)")
+        self.enabled = enabled
+        self.level = level
+        self.dictionary_path = dictionary_path
+        self._local = threading.local()
+
+    def add_dictionary(self, data, current=False):
+        dictionary = zstd.ZstdCompressionDict(data)
+        dict_id = dictionary.dict_id()
+        with self._lock:
+            self.dictionaries[dict_id] = dictionary
+            if current:
+                self.current = dict_id
+                self._local = threading.local()
+        return dict_id
+
+    def _dictionary(self, dict_id):
+        dictionary = self.dictionaries.get(dict_id)
+        if dictionary is None and self.dictionary_path:
+            # Trained by another process since we started; a one-off read of a small row
+            conn = sqlite3.connect(self.dictionary_path)
+            try:
+                row = conn.execute("SELECT data FROM compression_dicts WHERE id = ?", (dict_id,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            finally:
+                conn.close()
+            if row is not None:
+                self.add_dictionary(row[0])
+                dictionary = self.dictionaries[dict_id]
+        if dictionary is None:
+            raise RuntimeError(f"Content was compressed with dictionary {dict_id}, which this database does not have")
+        return dictionary
+
+    def _compressor(self):
+        # zstd contexts are not thread-safe: one per thread
+        local = self._local
+        if getattr(local, 'compressor', None) is None:
+            dictionary = self.dictionaries.get(self.current) if self.current else None
+            local.compressor = zstd.ZstdCompressor(level=self.level, dict_data=dictionary, write_checksum=False)
+        return local.compressor
+
+    def _decompressor(self, dict_id):
+        local = self._local
+        decompressors = getattr(local, 'decompressors', None)
+        if decompressors is None:
+            decompressors = local.decompressors = {}
+        dctx = decompressors.get(dict_id)
+        if dctx is None:
+            dictionary = self._dictionary(dict_id) if dict_id else None
+            dctx = decompressors[dict_id] = zstd.ZstdDecompressor(dict_data=dictionary)
+        return dctx
+
+    @staticmethod
+    def dict_id_of(value):
+        return zstd.get_frame_parameters(value).dict_id
+
+    def encode(self, text, force=False):
+        if text is None or not (self.enabled or force):
+            return text
+        raw = text.encode('utf-8')
+        frame = self._compressor().compress(raw)
+        return frame if len(frame) < len(raw) else text
+
+    def decode(self, value):
+        if not isinstance(value, (bytes, memoryview)):
+            return value
+        if zstd is None:
+            raise RuntimeError("This database has zstd-compressed content; install zstandard to read it")
+        value = bytes(value)
+        return self._decompressor(self.dict_id_of(value)).decompress(value).decode('utf-8')
+
+def train_dictionary(samples, dict_size=65536):
+    """Trains a zstd dictionary on `samples` (bytes); returns its serialized form."""
+    if zstd is None:
+        raise RuntimeError("Training a dictionary requires zstandard (pip install zstandard)")
+    return zstd.train_dictionary(dict_size, samples).as_bytes()
+
+codec = ContentCodec()
+
+class CompressedText(TypeDecorator):
+    """Text that `codec` may store as a zstd BLOB on SQLite; other databases get plain text."""
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name != 'sqlite':
+            return value
+        return codec.encode(value)
+
+    def process_result_value(self, value, dialect):
+        return codec.decode(value)
+
+async def run(command, args):
+    from database import db_manager
+
+    await db_manager.initialize()
+    try:
+        if command == 'train':
+            dict_id, samples = await db_manager.train_content_dictionary(args.samples, args.dict_size)
+            print(f"Trained dictionary {dict_id} ({args.dict_size} bytes) on {samples} samples")
+        elif command == 'recompress':
+            rewritten = await db_manager.recompress_content(args.batch_size, args.pause, args.vacuum)
+            print(f"Rewritten rows: {rewritten}")
+        for table, classes in (await db_manager.content_storage()).items():
+            print(f"{table}: " + ", ".join(f"{kind} {rows} rows / {size / 1024 / 1024:.1f} MiB"
+                                           for kind, (rows, size) in classes.items()))
+    finally:
+        await db_manager.close()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Content compression: train the zstd dictionary and recompress old rows")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('train', help="Train a dictionary on recent content and use it for new writes")
+    p.add_argument('--samples', type=int, default=20000, help="Rows sampled per table")
+    p.add_argument('--dict-size', type=int, default=65536)
+    p = sub.add_parser('recompress', help="Compress plain rows and re-encode rows that use an older dictionary")
+    p.add_argument('--batch-size', type=int, default=1000)
+    p.add_argument('--pause', type=float, default=0.05, help="Seconds to sleep between batches")
+    p.add_argument('--vacuum', action='store_true', help="VACUUM afterwards so the file shrinks (blocks writers meanwhile)")
+    sub.add_parser('status', help="Rows and bytes per storage class")
+    return parser
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    asyncio.run(run(args.command, args))
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import discord
+
+import metrics
+from database import db_manager
+
+def message_data(message):
+    """The dict kept in DiscordAIBot.recent_messages for a discord message."""
+    return {
+        'id': message.id,
+        'author': message.author.id,
+        'author_name': message.author.name,
+        'content': message.content,
+        'channel': message.channel.id,
+        'channel_name': message.channel.name if hasattr(message.channel, 'name') else 'DM',
+        'guild': message.guild.id if message.guild else None,
+        'guild_name': message.guild.name if message.guild else None,
+        'is_dm': isinstance(message.channel, discord.DMChannel),
+        'timestamp': datetime.now().isoformat()
+    }
+
+def _row_data(row):
+    message, author_id, author_name, channel_name, guild_name = row
+    return {
+        'id': message.discord_message_id,
+        'author': author_id,
+        'author_name': author_name,
+        'content': message.content,
+        'channel': message.channel_id,
+        'channel_name': channel_name or 'DM',
+        'guild': message.server_id,
+        'guild_name': guild_name,
+        'is_dm': bool(message.is_dm),
+        'timestamp': message.timestamp.isoformat() if message.timestamp else None
+    }
+
+class HistoryFetcher:
+    """
+    Funnels channel.history calls from every channel through one lane, spaced at least
+    `min_interval` seconds apart, so roaming across many channels cannot burst into the
+    REST rate limit. Concurrent requests for the same channel share one call.
+    """
+
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self._lock = asyncio.Lock()
+        self._last_call = 0.0
+        self._inflight = {}
+
+    async def fetch(self, channel, limit):
+        """The latest `limit` messages of `channel`, oldest first."""
+        pending = self._inflight.get(channel.id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch(channel, limit))
+            self._inflight[channel.id] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(channel.id, None))
+        return await asyncio.shield(pending)
+
+    async def _fetch(self, channel, limit):
+        async with self._lock:
+            wait = self._last_call + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                messages = [m async for m in channel.history(limit=limit)]
+            finally:
+                self._last_call = time.monotonic()
+        metrics.history_calls.inc()
+        return sorted(messages, key=lambda m: m.id)
+
+class ContextLoader:
+    """
+    Read-through source of a channel's latest messages for building context.
+
+    Channels are served from an LRU cache, filled on a miss from the `messages` table and
+    kept current by `note()` for every message received or sent. A gap between the newest
+    cached message and channel.last_message_id (which discord.py keeps up to date from the
+    gateway without a REST call) is filled from the `messages` table first; channel.history
+    is only called if that still leaves one, e.g. messages sent while the bot was offline.
+    """
+
+    def __init__(self, per_channel=20, max_channels=200, min_history_interval=1.0):
+        self.per_channel = per_channel
+        self.max_channels = max_channels
+        self.cache = OrderedDict()
+        self.fetcher = HistoryFetcher(min_history_interval)
+
+    def note(self, data):
+        """Keeps a cached channel current with a message that just arrived."""
+        cached = self.cache.get(data['channel'])
+        if cached is not None and (not cached or data['id'] > cached[-1]['id']):
+            cached.append(data)
+
+    async def recent(self, channel, limit=20, exclude_author=None):
+        cached = self.cache.get(channel.id)
+        hit = cached is not None
+        metrics.record_cache('channel_context', hit)
+        if not hit:
+            rows = await db_manager.get_channel_messages(channel.id, self.per_channel)
+            cached = deque((_row_data(row) for row in rows), maxlen=self.per_channel)
+            self.cache[channel.id] = cached
+            while len(self.cache) > self.max_channels:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(channel.id)
+
+        last_id = getattr(channel, 'last_message_id', None)
+        newest = cached[-1]['id'] if cached else None
+        if hit and last_id and newest is not None and int(last_id) > newest:
+            # Messages stored since the channel was cached (just read from the table on a miss)
+            try:
+                for row in await db_manager.get_channel_messages(channel.id, self.per_channel):
+                    if row[0].discord_message_id > cached[-1]['id']:
+                        cached.append(_row_data(row))
+            except Exception as e:
+                print(f"Context gap read error in {channel.id}: {e}")
+            newest = cached[-1]['id']
+        if last_id and (newest is None or int(last_id) > newest):
+            try:
+                # Not history(after=newest): that pages from the oldest message after it, so a
+                # gap longer than per_channel would fill the cache with stale lines
+                for message in await self.fetcher.fetch(channel, self.per_channel):
+                    if newest is None or message.id > newest:
+                        cached.append(message_data(message))
+            except Exception as e:
+                print(f"History fallback error in {channel.id}: {e}")
+
+        items = [m for m in cached if m['author'] != exclude_author]
+        return items[-limit:]
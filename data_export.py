@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+from datetime import datetime
+from sqlalchemy import select, BigInteger, Integer, Boolean, DateTime
+
+from snapshot import use_analytics_source, add_source_arguments
+from database import db_manager, Guild, Channel, User, Message, BotResponse, Interaction, SocialTestLog
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_TABLES = {
+    'guilds': Guild,
+    'channels': Channel,
+    'users': User,
+    'messages': Message,
+    'bot_responses': BotResponse,
+    'interactions': Interaction,
+    'social_test_logs': SocialTestLog,
+}
+
+# Small name tables keyed by snowflake: always exported whole, since a new guild can have a lower ID
+DIMENSION_TABLES = ('guilds', 'channels')
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_STATE_FILE = 'export_state.json'
+
+def _time_column(model):
+    if model is User:
+        return model.__table__.c.last_seen
+    if model in (Guild, Channel):
+        return model.__table__.c.updated_at
+    return model.__table__.c.timestamp
+
+def _guild_column(model):
+    if model is Guild:
+        return model.__table__.c.id
+    if model is Channel:
+        return model.__table__.c.guild_id
+    return model.__table__.c.server_id
+
+def _export_columns(model):
+    """Selected columns and FROM clause; messages also carry their author's Discord ID."""
+    table = model.__table__
+    if model is Message:
+        users = User.__table__
+        return list(table.columns) + [users.c.discord_id], table.outerjoin(users, table.c.user_id == users.c.id)
+    return list(table.columns), table
+
+def _serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+class CsvWriter:
+    def __init__(self, path, columns):
+        self.f = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(columns)
+
+    def write_chunk(self, rows):
+        self.writer.writerows([[_serialize(v) for v in row] for row in rows])
+
+    def close(self):
+        self.f.close()
+
+class JsonlWriter:
+    def __init__(self, path, columns):
+        self.f = open(path, 'w', encoding='utf-8')
+        self.columns = columns
+
+    def write_chunk(self, rows):
+        self.f.writelines(
+            json.dumps({c: _serialize(v) for c, v in zip(self.columns, row)}, ensure_ascii=False) + '\n'
+            for row in rows
+        )
+
+    def close(self):
+        self.f.close()
+
+class ParquetWriter:
+    def __init__(self, path, columns):
+        if pa is None:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+        self.schema = pa.schema([(c.name, self._arrow_type(c.type)) for c in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    @staticmethod
+    def _arrow_type(col_type):
+        if isinstance(col_type, (Integer, BigInteger)):
+            return pa.int64()
+        if isinstance(col_type, Boolean):
+            return pa.bool_()
+        if isinstance(col_type, DateTime):
+            return pa.timestamp('us')
+        return pa.string()
+
+    def write_chunk(self, rows):
+        arrays = [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def _open_writer(fmt, path, columns):
+    names = [c.name for c in columns]
+    if fmt == 'csv':
+        return CsvWriter(path, names)
+    if fmt == 'jsonl':
+        return JsonlWriter(path, names)
+    if fmt == 'parquet':
+        return ParquetWriter(path, columns)
+    raise ValueError(f"Unsupported format: {fmt}. Use: {', '.join(FORMATS)}")
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state_file, state):
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, state_file)
+
+async def export_table(name, path, fmt='csv', since=None, until=None, guild=None, after_id=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Streams one table to `path` in chunks of `chunk_size` rows.
+    Returns (rows_written, highest_id_written).
+    """
+    model = EXPORT_TABLES[name]
+    table = model.__table__
+    columns, source = _export_columns(model)
+    query = select(*columns).select_from(source).order_by(table.c.id)
+    if since:
+        query = query.where(_time_column(model) >= since)
+    if until:
+        query = query.where(_time_column(model) < until)
+    if guild:
+        query = query.where(_guild_column(model) == int(guild))
+    if after_id:
+        query = query.where(table.c.id > after_id)
+
+    rows_written = 0
+    last_id = after_id or 0
+    writer = _open_writer(fmt, path, columns)
+    try:
+        async with db_manager.async_session() as session:
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            async for chunk in result.partitions(chunk_size):
+                writer.write_chunk(chunk)
+                rows_written += len(chunk)
+                last_id = chunk[-1].id
+    finally:
+        writer.close()
+    return rows_written, last_id
+
+async def run_export(tables, output_dir='.', fmt='csv', since=None, until=None, guild=None,
+                     incremental=False, state_file=DEFAULT_STATE_FILE, chunk_size=DEFAULT_CHUNK_SIZE):
+    os.makedirs(output_dir, exist_ok=True)
+    state = load_state(state_file) if incremental else {}
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    summary = {}
+
+    for name in tables:
+        whole = name in DIMENSION_TABLES
+        after_id = state.get(name) if incremental and not whole else None
+        suffix = f"_{stamp}" if incremental else ''
+        path = os.path.join(output_dir, f"{name}{suffix}.{fmt}")
+        count, last_id = await export_table(
+            name, path, fmt, None if whole else since, None if whole else until, guild, after_id, chunk_size
+        )
+        summary[name] = {'rows': count, 'file': path, 'last_id': last_id}
+        print(f"Exported {count} rows from {name} to {path}")
+        if incremental:
+            state[name] = last_id
+            save_state(state_file, state)
+
+    return summary
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Stream bot tables to CSV, JSONL or Parquet")
+    add_export_arguments(parser)
+    add_source_arguments(parser)
+    return parser
+
+def add_export_arguments(parser):
+    parser.add_argument('--tables', nargs='+', choices=list(EXPORT_TABLES), default=list(EXPORT_TABLES))
+    parser.add_argument('--format', dest='fmt', choices=FORMATS, default='csv')
+    parser.add_argument('--output-dir', default='export')
+    parser.add_argument('--since', type=datetime.fromisoformat, help="ISO timestamp (UTC), inclusive")
+    parser.add_argument('--until', type=datetime.fromisoformat, help="ISO timestamp (UTC), exclusive")
+    parser.add_argument('--guild', help="Only rows from this server ID")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only export rows above the high-water mark stored in --state-file")
+    parser.add_argument('--state-file', default=DEFAULT_STATE_FILE)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+async def export_from_args(args):
+    await use_analytics_source(db_manager, args.live, args.refresh_snapshot)
+    try:
+        return await run_export(
+            args.tables, args.output_dir, args.fmt, args.since, args.until, args.guild,
+            args.incremental, args.state_file, args.chunk_size
+        )
+    finally:
+        await db_manager.close()
+
+if __name__ == '__main__':
+    asyncio.run(export_from_args(build_parser().parse_args()))
@@ -1,27 +1,48 @@
 import asyncio
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+import contextlib
+import json
+import re
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Boolean, ForeignKey, LargeBinary, Index
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.pool import NullPool
 import os
 from dotenv import load_dotenv
 
+from metrics import db_write_latency, timed
+from compression import CompressedText, codec, train_dictionary
+
 load_dotenv(override=True)
 
 Base = declarative_base()
 
+class Guild(Base):
+    __tablename__ = 'guilds'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    name = Column(String(200))
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class Channel(Base):
+    __tablename__ = 'channels'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    guild_id = Column(BigInteger, nullable=True)
+    name = Column(String(100))
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class User(Base):
     __tablename__ = 'users'
     
     id = Column(Integer, primary_key=True)
-    discord_id = Column(String(50), unique=True, nullable=False)
+    discord_id = Column(BigInteger, unique=True, nullable=False)
     username = Column(String(100), nullable=False)
     display_name = Column(String(100))
     first_seen = Column(DateTime, default=datetime.utcnow)
     last_seen = Column(DateTime, default=datetime.utcnow)
-    server_id = Column(String(50), nullable=True)
-    server_name = Column(String(200), nullable=True)
+    server_id = Column(BigInteger, nullable=True)
     is_suspicious = Column(Boolean, default=False)
     suspicion_count = Column(Integer, default=0)
     
@@ -30,15 +51,16 @@ class User(Base):
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_channel_timestamp', 'channel_id', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    discord_message_id = Column(String(50), unique=True, nullable=False)
-    channel_id = Column(String(50), nullable=False)
-    channel_name = Column(String(100))
-    server_id = Column(String(50), nullable=True)
-    server_name = Column(String(200), nullable=True)
-    content = Column(Text, nullable=False)
+    discord_message_id = Column(BigInteger, unique=True, nullable=False)
+    channel_id = Column(BigInteger, nullable=False)
+    server_id = Column(BigInteger, nullable=True)
+    content = Column(CompressedText, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     is_dm = Column(Boolean, default=False)
     
@@ -48,10 +70,10 @@ class BotResponse(Base):
     __tablename__ = 'bot_responses'
     
     id = Column(Integer, primary_key=True)
-    discord_message_id = Column(String(50), unique=True, nullable=False)
-    channel_id = Column(String(50), nullable=False)
-    server_id = Column(String(50), nullable=True)
-    content = Column(Text, nullable=False)
+    discord_message_id = Column(BigInteger, unique=True, nullable=False)
+    channel_id = Column(BigInteger, nullable=True)
+    server_id = Column(BigInteger, nullable=True)
+    content = Column(CompressedText, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     action_type = Column(String(50))
     is_dm = Column(Boolean, default=False)
@@ -65,8 +87,8 @@ class Interaction(Base):
     interaction_type = Column(String(50), nullable=False)
     content = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
-    channel_id = Column(String(50))
-    server_id = Column(String(50))
+    channel_id = Column(BigInteger)
+    server_id = Column(BigInteger)
     
     user = relationship("User", back_populates="interactions")
 
@@ -75,206 +97,989 @@ class SocialTestLog(Base):
     
     id = Column(Integer, primary_key=True)
     log_type = Column(String(50), nullable=False)
-    content = Column(Text, nullable=False)
+    content = Column(CompressedText, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
-    server_id = Column(String(50), nullable=True)
-    server_name = Column(String(200), nullable=True)
-    channel_id = Column(String(50), nullable=True)
+    server_id = Column(BigInteger, nullable=True)
+    channel_id = Column(BigInteger, nullable=True)
+
+class StatsCounter(Base):
+    __tablename__ = 'stats_counters'
+    
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+class StatsHourly(Base):
+    __tablename__ = 'stats_hourly'
+    
+    bucket = Column(DateTime, primary_key=True)
+    server_id = Column(BigInteger, primary_key=True, autoincrement=False, default=0)  # 0 = DMs
+    messages = Column(Integer, nullable=False, default=0)
+    dm_messages = Column(Integer, nullable=False, default=0)
+    bot_responses = Column(Integer, nullable=False, default=0)
+
+class UserStats(Base):
+    __tablename__ = 'user_stats'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0, index=True)
+    last_message_at = Column(DateTime)
+
+class ArchiveCatalog(Base):
+    __tablename__ = 'archive_catalog'
+    
+    table_name = Column(String(50), primary_key=True)
+    period = Column(String(7), primary_key=True)
+    path = Column(String(500), nullable=False)
+    row_count = Column(Integer, nullable=False, default=0)
+    min_timestamp = Column(DateTime)
+    max_timestamp = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class BotState(Base):
+    __tablename__ = 'bot_state'
+    
+    name = Column(String(50), primary_key=True)
+    payload = Column(LargeBinary, nullable=False)
+    saved_at = Column(DateTime, nullable=False)
+
+class ConversationSummary(Base):
+    __tablename__ = 'conversation_summaries'
+    
+    scope = Column(String(16), primary_key=True)  # 'channel' or 'user'
+    scope_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    summary = Column(Text, nullable=False)
+    message_count = Column(Integer, nullable=False, default=0)  # messages folded in so far
+    last_message_id = Column(BigInteger)
+    updated_at = Column(DateTime, nullable=False)
+
+class CompressionDict(Base):
+    __tablename__ = 'compression_dicts'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=False)  # zstd dictionary id
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+ARCHIVED_MODELS = {
+    'messages': Message,
+    'bot_responses': BotResponse,
+    'interactions': Interaction,
+    'social_test_logs': SocialTestLog,
+}
+
+COMPRESSED_MODELS = {
+    'messages': Message,
+    'bot_responses': BotResponse,
+    'social_test_logs': SocialTestLog,
+}
+
+def snowflake(value):
+    """A Discord ID as an int (callers pass ints or numeric strings); None for missing/non-numeric."""
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def is_legacy_schema(sync_conn):
+    """True for databases from before snowflakes were stored as integers (names still on each message)."""
+    from sqlalchemy import inspect
+    inspector = inspect(sync_conn)
+    if not inspector.has_table('messages'):
+        return False
+    return any(column['name'] == 'channel_name' for column in inspector.get_columns('messages'))
+
+def fts_query(text, any_term=False):
+    """
+    Free text as an FTS5 query: every word is quoted, so punctuation and FTS operators in
+    user input are matched literally, and the words are joined with AND (or OR with `any_term`).
+    """
+    terms = dict.fromkeys(re.findall(r'\w+', text or ''))
+    return (' OR ' if any_term else ' ').join(f'"{term}"' for term in terms)
+
+def _hour_bucket(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
 
 class DatabaseManager:
-    def __init__(self):
-        database_url = os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///discord_bot.db')
-        self.engine = create_async_engine(
-            database_url,
-            echo=False,
-            poolclass=NullPool
-        )
+    def __init__(self, database_url=None):
+        database_url = database_url or os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///discord_bot.db')
+        self.archive_after_days = int(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+        self.archive_dir = os.getenv('ARCHIVE_DIR', 'archive')
+        self.archive_interval_hours = float(os.getenv('ARCHIVE_INTERVAL_HOURS', '24'))
+        self.sqlite_writer = os.getenv('DB_SQLITE_WRITER', '0') == '1'
+        self.read_pool_size = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+        self.write_batch_max = int(os.getenv('DB_WRITE_BATCH_MAX', '200'))
+        self.compress_content = os.getenv('DB_COMPRESS_CONTENT', '0') == '1'
+        self.compress_level = int(os.getenv('DB_COMPRESS_LEVEL', '3'))
+        self.search_index = os.getenv('DB_SEARCH_INDEX', '1') == '1'
+        self._archive_engines = {}
+        self._create_engine(database_url)
+    
+    def _create_engine(self, database_url):
+        self.database_url = database_url
+        self._dimension_names = {}
+        self._has_search_index = None
+        self.writer = None
+        self.read_engine = None
+        pool_size = int(os.getenv('DB_POOL_SIZE', '0'))
+        busy_timeout = float(os.getenv('DB_BUSY_TIMEOUT', '30'))
+        sqlite_path = None
+        if database_url.startswith('sqlite') and ':///' in database_url and ':memory:' not in database_url:
+            sqlite_path = database_url.split(':///', 1)[1]
+        codec.configure(self.compress_content and sqlite_path is not None, self.compress_level, sqlite_path)
+        if database_url.startswith('sqlite'):
+            # Several shard processes may write the same file: wait on its lock instead of failing
+            engine_args = {'poolclass': NullPool, 'connect_args': {'timeout': busy_timeout}}
+        elif pool_size > 0:
+            engine_args = {'pool_size': pool_size, 'max_overflow': pool_size, 'pool_pre_ping': True}
+        else:
+            engine_args = {'poolclass': NullPool}
+        self.engine = create_async_engine(database_url, echo=False, **engine_args)
         self.async_session = async_sessionmaker(
             self.engine,
             class_=AsyncSession,
             expire_on_commit=False
         )
+        self.read_session = self.async_session
+        if self.sqlite_writer and database_url.startswith('sqlite') and ':memory:' not in database_url:
+            from sqlite_writer import SQLiteWriter, writer_engine, reader_engine
+            self.writer = SQLiteWriter(writer_engine(database_url, busy_timeout), self.write_batch_max)
+            self.read_engine = reader_engine(database_url, self.read_pool_size)
+            self.read_session = async_sessionmaker(self.read_engine, class_=AsyncSession, expire_on_commit=False)
+    
+    async def reconfigure(self, database_url):
+        """Points the shared manager at another database (used by the replay harness and tools)."""
+        await self.close()
+        self._create_engine(database_url)
     
     async def initialize(self):
         async with self.engine.begin() as conn:
+            if await conn.run_sync(is_legacy_schema):
+                raise RuntimeError(
+                    f"{self.database_url} uses the old string-ID schema; convert it with `python migrate_db.py` first"
+                )
+            if self.engine.dialect.name == 'sqlite':
+                # Only takes effect on a brand-new file; existing ones are converted by compact()
+                await conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                # Read-only connections can only read alongside the writer in WAL mode
+                journal_mode = os.getenv('DB_JOURNAL_MODE') or ('WAL' if self.writer else None)
+                if journal_mode:
+                    await conn.exec_driver_sql(f"PRAGMA journal_mode = {journal_mode}")
             await conn.run_sync(Base.metadata.create_all)
+            # create_all skips indexes of tables that already exist
+            for index in Message.__table__.indexes:
+                await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn, checkfirst=True))
+            backfill_search = False
+            if self.search_index and self.engine.dialect.name == 'sqlite' and not await self._search_index_exists(conn):
+                # Contentless: the index holds no copy of the (possibly compressed) text
+                await conn.exec_driver_sql(
+                    "CREATE VIRTUAL TABLE messages_fts USING fts5("
+                    "content, content='', tokenize='unicode61 remove_diacritics 2')"
+                )
+                backfill_search = True
+            self._has_search_index = None
+        
+        async with self.async_session() as session:
+            seeded = await session.get(StatsCounter, 'messages')
+            if codec.enabled:
+                from sqlalchemy import select
+                newest = await session.scalar(
+                    select(CompressionDict.data).order_by(CompressionDict.created_at.desc()).limit(1)
+                )
+                if newest is not None:
+                    codec.add_dictionary(newest, current=True)
+        if seeded is None:
+            await self.rebuild_stats_rollups()
+        if backfill_search:
+            await self.rebuild_search_index()
     
     async def close(self):
+        if self.writer is not None:
+            await self.writer.close()
+        if self.read_engine is not None:
+            await self.read_engine.dispose()
+        for engine in self._archive_engines.values():
+            await engine.dispose()
+        self._archive_engines.clear()
         await self.engine.dispose()
     
-    async def get_or_create_user(self, discord_id, username, display_name=None, server_id=None, server_name=None):
+    async def _write(self, fn):
+        """
+        Runs `fn(session)` and commits. With DB_SQLITE_WRITER=1 the unit is handed to the
+        single writer connection and group-committed with whatever else is pending.
+        """
+        if self.writer is not None:
+            return await self.writer.submit(fn)
         async with self.async_session() as session:
-            from sqlalchemy import select
-            from sqlalchemy.exc import IntegrityError
-            
-            result = await session.execute(
-                select(User).where(User.discord_id == str(discord_id))
-            )
-            user = result.scalar_one_or_none()
-            
-            if not user:
-                user = User(
-                    discord_id=str(discord_id),
-                    username=username,
-                    display_name=display_name or username,
-                    server_id=str(server_id) if server_id else None,
-                    server_name=server_name
-                )
-                session.add(user)
-                try:
-                    await session.commit()
-                    await session.refresh(user)
-                except IntegrityError:
-                    await session.rollback()
-                    # Se fallisce per UNIQUE constraint, riprova a prenderlo
-                    result = await session.execute(
-                        select(User).where(User.discord_id == str(discord_id))
-                    )
-                    user = result.scalar_one_or_none()
-            else:
-                user.last_seen = datetime.utcnow()
-                user.username = username
-                user.display_name = display_name or username
-                if server_id:
-                    user.server_id = str(server_id)
-                if server_name:
-                    user.server_name = server_name
-                try:
-                    await session.commit()
-                except IntegrityError:
-                    await session.rollback()
-            
-            return user
+            session.info['on_commit'] = []
+            result = await fn(session)
+            await session.commit()
+        for callback in session.info['on_commit']:
+            callback()
+        return result
+
+    @staticmethod
+    def _after_commit(session, callback):
+        """Runs `callback` once the current write unit is committed; never if it rolls back."""
+        session.info.setdefault('on_commit', []).append(callback)
+
+    def _maintenance(self):
+        """
+        Context for maintenance that needs its own connection (VACUUM): pauses the single
+        writer, so queued writes wait for it instead of fighting it for the SQLite lock.
+        """
+        return self.writer.paused() if self.writer is not None else contextlib.nullcontext()
+    
+    @timed(db_write_latency, op='get_or_create_user')
+    async def get_or_create_user(self, discord_id, username, display_name=None, server_id=None, server_name=None):
+        return await self._write(
+            lambda session: self._upsert_user(session, discord_id, username, display_name, server_id, server_name)
+        )
     
+    @timed(db_write_latency, op='save_message')
     async def save_message(self, discord_id, username, display_name, discord_message_id, channel_id, 
                           channel_name, content, server_id=None, server_name=None, is_dm=False):
-        user = await self.get_or_create_user(discord_id, username, display_name, server_id, server_name)
+        """
+        Stores a received message with its author and rollups. Returns (message, created);
+        `created` is False when the Discord message was already stored (e.g. a gateway replay).
+        """
+        async def unit(session):
+            user = await self._upsert_user(session, discord_id, username, display_name, server_id, server_name)
+            await self._note_channel(session, channel_id, channel_name, server_id)
+            now = datetime.utcnow()
+            message = await self._insert_once(session, Message, 'discord_message_id', {
+                'user_id': user.id,
+                'discord_message_id': snowflake(discord_message_id),
+                'channel_id': snowflake(channel_id),
+                'server_id': snowflake(server_id),
+                'content': content,
+                'timestamp': now,
+                'is_dm': is_dm
+            })
+            if message is None:
+                return await self._get_by(session, Message, 'discord_message_id', discord_message_id), False
+            await self._record_message_rollup(session, user.id, server_id, is_dm, now)
+            await self._index_messages(session, [(message.id, content)])
+            return message, True
         
-        async with self.async_session() as session:
-            from sqlalchemy import select
-            from sqlalchemy.exc import IntegrityError
-            
-            result = await session.execute(
-                select(Message).where(Message.discord_message_id == str(discord_message_id))
-            )
-            existing = result.scalar_one_or_none()
-            
-            if not existing:
-                message = Message(
-                    user_id=user.id,
-                    discord_message_id=str(discord_message_id),
-                    channel_id=str(channel_id),
-                    channel_name=channel_name,
-                    server_id=str(server_id) if server_id else None,
-                    server_name=server_name,
-                    content=content,
-                    is_dm=is_dm
-                )
-                session.add(message)
-                try:
-                    await session.commit()
-                    return message
-                except IntegrityError:
-                    await session.rollback()
-                    # Se fallisce, probabilmente un'altra task lo ha già inserito
-                    result = await session.execute(
-                        select(Message).where(Message.discord_message_id == str(discord_message_id))
-                    )
-                    return result.scalar_one_or_none()
-            return existing
+        return await self._write(unit)
     
+    @timed(db_write_latency, op='save_bot_response')
     async def save_bot_response(self, discord_message_id, channel_id, content, action_type, 
                               server_id=None, is_dm=False, planned_by_ai=True):
-        async with self.async_session() as session:
-            from sqlalchemy import select
-            from sqlalchemy.exc import IntegrityError
-            
-            result = await session.execute(
-                select(BotResponse).where(BotResponse.discord_message_id == str(discord_message_id))
-            )
-            existing = result.scalar_one_or_none()
-            
-            if not existing:
-                response = BotResponse(
-                    discord_message_id=str(discord_message_id),
-                    channel_id=str(channel_id),
-                    server_id=str(server_id) if server_id else None,
-                    content=content,
-                    action_type=action_type,
-                    is_dm=is_dm,
-                    planned_by_ai=planned_by_ai
-                )
-                session.add(response)
-                try:
-                    await session.commit()
-                    return response
-                except IntegrityError:
-                    await session.rollback()
-                    result = await session.execute(
-                        select(BotResponse).where(BotResponse.discord_message_id == str(discord_message_id))
-                    )
-                    return result.scalar_one_or_none()
-            return existing
+        return await self._write(lambda session: self._add_bot_response(
+            session, discord_message_id, channel_id, content, action_type, server_id, is_dm, planned_by_ai
+        ))
     
+    @timed(db_write_latency, op='save_interaction')
     async def save_interaction(self, user_id, interaction_type, content=None, channel_id=None, server_id=None):
-        async with self.async_session() as session:
-            interaction = Interaction(
-                user_id=user_id,
-                interaction_type=interaction_type,
-                content=content,
-                channel_id=str(channel_id) if channel_id else None,
-                server_id=str(server_id) if server_id else None
+        async def unit(session):
+            return self._add_interaction(session, user_id, interaction_type, content, channel_id, server_id)
+        
+        return await self._write(unit)
+    
+    @timed(db_write_latency, op='record_reply')
+    async def record_reply(self, discord_message_id, channel_id, content, author_id, author_name,
+                           author_display_name=None, server_id=None, server_name=None, is_dm=False,
+                           action_type='REPLY', interaction_content=None):
+        """
+        Records a reply to message `discord_message_id` in one transaction: the bot response,
+        the author's user row and a RESPONSE interaction. Returns the BotResponse.
+        """
+        async def unit(session):
+            response = await self._add_bot_response(
+                session, discord_message_id, channel_id, content, action_type, server_id, is_dm, True
             )
-            session.add(interaction)
-            await session.commit()
-            return interaction
+            user = await self._upsert_user(
+                session, author_id, author_name, author_display_name, server_id, server_name
+            )
+            self._add_interaction(session, user.id, 'RESPONSE', interaction_content, channel_id, server_id)
+            return response
+        
+        return await self._write(unit)
+    
+    async def _upsert_user(self, session, discord_id, username, display_name=None, server_id=None, server_name=None):
+        from sqlalchemy import update
+        
+        now = datetime.utcnow()
+        await self._note_guild(session, server_id, server_name)
+        values = {'last_seen': now, 'username': username, 'display_name': display_name or username}
+        if server_id:
+            values['server_id'] = snowflake(server_id)
+        refresh = update(User).where(User.discord_id == snowflake(discord_id)).values(**values).returning(User)
+        
+        # Known users are the common case, so try the UPDATE first. The insert is a separate
+        # statement (rather than ON CONFLICT DO UPDATE) so the users counter only counts real inserts.
+        user = (await session.scalars(refresh, execution_options={'populate_existing': True})).one_or_none()
+        if user is not None:
+            return user
+        user = await self._insert_once(session, User, 'discord_id', {
+            'discord_id': snowflake(discord_id),
+            'username': username,
+            'display_name': display_name or username,
+            'first_seen': now,
+            'last_seen': now,
+            'server_id': snowflake(server_id)
+        })
+        if user is not None:
+            await self._bump_counters(session, users=1)
+            return user
+        # Another writer inserted it between our two statements
+        return (await session.scalars(refresh, execution_options={'populate_existing': True})).one()
+    
+    async def _insert_once(self, session, model, unique_column, values):
+        """INSERT ... ON CONFLICT DO NOTHING RETURNING: the new row, or None if `unique_column` already exists."""
+        stmt = (
+            self._insert(model)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=[unique_column])
+            .returning(model)
+        )
+        result = await session.scalars(stmt, execution_options={'populate_existing': True})
+        return result.one_or_none()
     
+    async def _get_by(self, session, model, column, value):
+        from sqlalchemy import select
+        return await session.scalar(select(model).where(getattr(model, column) == snowflake(value)))
+    
+    async def _note_guild(self, session, guild_id, name):
+        """Keeps the guilds dimension current; only writes when the name differs from the last one committed."""
+        guild_id = snowflake(guild_id)
+        if guild_id and name and self._dimension_names.get(('guild', guild_id)) != name:
+            await self._upsert_dimension(session, Guild, {'id': guild_id, 'name': name})
+            self._after_commit(session, lambda: self._dimension_names.update({('guild', guild_id): name}))
+    
+    async def _note_channel(self, session, channel_id, name, guild_id=None):
+        channel_id = snowflake(channel_id)
+        if channel_id and name and self._dimension_names.get(('channel', channel_id)) != name:
+            await self._upsert_dimension(session, Channel, {'id': channel_id, 'name': name, 'guild_id': snowflake(guild_id)})
+            self._after_commit(session, lambda: self._dimension_names.update({('channel', channel_id): name}))
+    
+    async def _upsert_dimension(self, session, model, values):
+        stmt = self._insert(model).values(**values, updated_at=datetime.utcnow())
+        updates = {name: stmt.excluded[name] for name in values if name != 'id'}
+        updates['updated_at'] = stmt.excluded.updated_at
+        stmt = stmt.on_conflict_do_update(index_elements=['id'], set_=updates)
+        await session.execute(stmt)
+    
+    async def _add_bot_response(self, session, discord_message_id, channel_id, content, action_type,
+                                server_id=None, is_dm=False, planned_by_ai=True):
+        now = datetime.utcnow()
+        response = await self._insert_once(session, BotResponse, 'discord_message_id', {
+            'discord_message_id': snowflake(discord_message_id),
+            'channel_id': snowflake(channel_id),
+            'server_id': snowflake(server_id),
+            'content': content,
+            'timestamp': now,
+            'action_type': action_type,
+            'is_dm': is_dm,
+            'planned_by_ai': planned_by_ai
+        })
+        if response is None:
+            return await self._get_by(session, BotResponse, 'discord_message_id', discord_message_id)
+        await self._record_response_rollup(session, server_id, now)
+        return response
+    
+    def _add_interaction(self, session, user_id, interaction_type, content=None, channel_id=None, server_id=None):
+        interaction = Interaction(
+            user_id=user_id,
+            interaction_type=interaction_type,
+            content=content,
+            channel_id=snowflake(channel_id),
+            server_id=snowflake(server_id)
+        )
+        session.add(interaction)
+        return interaction
+    
+    @timed(db_write_latency, op='log_suspicion')
     async def log_suspicion(self, discord_id, username, reason):
-        async with self.async_session() as session:
+        async def unit(session):
             from sqlalchemy import select
             result = await session.execute(
-                select(User).where(User.discord_id == str(discord_id))
+                select(User).where(User.discord_id == snowflake(discord_id))
             )
             user = result.scalar_one_or_none()
             
             if user:
+                await self._bump_counters(
+                    session, suspicions=1, suspicious_users=0 if user.is_suspicious else 1
+                )
                 user.suspicion_count += 1
                 user.is_suspicious = True
-                await session.commit()
-            
-            await self.save_log('SUSPICION', f'User {username} ({discord_id}) - {reason}')
+        
+        await self._write(unit)
+        await self.save_log('SUSPICION', f'User {username} ({discord_id}) - {reason}')
     
+    @timed(db_write_latency, op='save_log')
     async def save_log(self, log_type, content, server_id=None, server_name=None, channel_id=None):
-        async with self.async_session() as session:
+        async def unit(session):
+            await self._note_guild(session, server_id, server_name)
             log = SocialTestLog(
                 log_type=log_type,
                 content=content,
-                server_id=str(server_id) if server_id else None,
-                server_name=server_name,
-                channel_id=str(channel_id) if channel_id else None
+                server_id=snowflake(server_id),
+                channel_id=snowflake(channel_id)
             )
             session.add(log)
-            await session.commit()
             return log
+        
+        return await self._write(unit)
     
-    async def get_user_stats(self):
-        async with self.async_session() as session:
-            from sqlalchemy import select, func
+    @staticmethod
+    async def _search_index_exists(conn):
+        from sqlalchemy import text
+        result = await conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"))
+        return result.first() is not None
+    
+    async def _search_index_ready(self, session):
+        # Keyed on the table rather than DB_SEARCH_INDEX: once it exists it must follow every insert and delete
+        if self._has_search_index is None:
+            self._has_search_index = (
+                self.engine.dialect.name == 'sqlite'
+                and await self._search_index_exists(await session.connection())
+            )
+        return self._has_search_index
+    
+    async def _index_messages(self, session, rows, delete=False):
+        """Adds (id, content) pairs to the search index, or removes them; `content` must be the indexed text."""
+        if not rows or not await self._search_index_ready(session):
+            return
+        from sqlalchemy import text
+        if delete:
+            stmt = text("INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', :id, :content)")
+        else:
+            stmt = text("INSERT INTO messages_fts(rowid, content) VALUES (:id, :content)")
+        await session.execute(stmt, [{'id': row_id, 'content': content} for row_id, content in rows])
+    
+    async def rebuild_search_index(self, batch_size=5000):
+        """Re-indexes every message (used when the index is first created). Returns the rows indexed."""
+        from sqlalchemy import select, text
+        
+        async def unit(session):
+            if not await self._search_index_ready(session):
+                return 0
+            indexed = 0
+            last_id = 0
+            await session.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('delete-all')"))
+            while True:
+                rows = (await session.execute(
+                    select(Message.id, Message.content).where(Message.id > last_id).order_by(Message.id).limit(batch_size)
+                )).all()
+                if not rows:
+                    break
+                await self._index_messages(session, rows)
+                indexed += len(rows)
+                last_id = rows[-1][0]
+            return indexed
+        
+        return await self._write(unit)
+    
+    async def search_messages(self, query, guild=None, channel=None, since=None, limit=20, any_term=False,
+                              candidates=None):
+        """
+        Messages containing the words of `query` (all of them, or any with `any_term`), best
+        match first, as (Message, author discord_id, author username, channel name, guild name).
+        Uses the FTS5 index on SQLite; other databases fall back to a LIKE scan, newest first.
+        Ranking every match of common words is the expensive part, so `candidates` ranks only
+        the newest that many matches.
+        """
+        from sqlalchemy import select, text, table, column, and_, or_
+        match = fts_query(query, any_term)
+        if not match:
+            return []
+        conditions = []
+        if guild is not None:
+            conditions.append(Message.server_id == snowflake(guild))
+        if channel is not None:
+            conditions.append(Message.channel_id == snowflake(channel))
+        if since is not None:
+            conditions.append(Message.timestamp >= since)
+        stmt = (
+            select(Message, User.discord_id, User.username, Channel.name, Guild.name)
+            .join(User, Message.user_id == User.id)
+            .outerjoin(Channel, Channel.id == Message.channel_id)
+            .outerjoin(Guild, Guild.id == Message.server_id)
+        )
+        async with self.read_session() as session:
+            if await self._search_index_ready(session):
+                fts = table('messages_fts', column('rowid'), column('rank'))
+                hits = (
+                    select(fts.c.rowid.label('id'), fts.c.rank.label('rank'))
+                    .join(Message, Message.id == fts.c.rowid)
+                    .where(text("messages_fts MATCH :match").bindparams(match=match), *conditions)
+                )
+                if candidates:
+                    hits = hits.order_by(fts.c.rowid.desc()).limit(candidates)
+                hits = hits.subquery()
+                stmt = stmt.join(hits, hits.c.id == Message.id).order_by(hits.c.rank)
+            else:
+                terms = [Message.content.ilike(f'%{term}%') for term in dict.fromkeys(re.findall(r'\w+', query))]
+                stmt = stmt.where(or_(*terms) if any_term else and_(*terms), *conditions)
+                stmt = stmt.order_by(Message.timestamp.desc())
+            result = await session.execute(stmt.limit(limit))
+            return result.all()
+    
+    async def get_messages_by_ids(self, ids):
+        """Stored messages with these row ids, in the given order (ids no longer stored are skipped)."""
+        if not ids:
+            return []
+        async with self.read_session() as session:
+            from sqlalchemy import select
+            result = await session.execute(
+                select(Message, User.discord_id, User.username, Channel.name, Guild.name)
+                .join(User, Message.user_id == User.id)
+                .outerjoin(Channel, Channel.id == Message.channel_id)
+                .outerjoin(Guild, Guild.id == Message.server_id)
+                .where(Message.id.in_(ids))
+            )
+            by_id = {row[0].id: row for row in result}
+            return [by_id[i] for i in ids if i in by_id]
+    
+    async def get_channel_messages(self, channel_id, limit=20):
+        """
+        Last `limit` stored messages of a channel, oldest first, as
+        (Message, author discord_id, author username, channel name, guild name).
+        """
+        async with self.read_session() as session:
+            from sqlalchemy import select
+            result = await session.execute(
+                select(Message, User.discord_id, User.username, Channel.name, Guild.name)
+                .join(User, Message.user_id == User.id)
+                .outerjoin(Channel, Channel.id == Message.channel_id)
+                .outerjoin(Guild, Guild.id == Message.server_id)
+                .where(Message.channel_id == snowflake(channel_id))
+                .order_by(Message.timestamp.desc())
+                .limit(limit)
+            )
+            return list(reversed(result.all()))
+    
+    @timed(db_write_latency, op='save_state')
+    async def save_state(self, name, state):
+        """Stores `state` (JSON-serializable) as zlib-compressed JSON under `name`; returns the payload size."""
+        payload = zlib.compress(json.dumps(state, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+        stmt = self._insert(BotState).values(name=name, payload=payload, saved_at=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'payload': stmt.excluded.payload, 'saved_at': stmt.excluded.saved_at}
+        )
+        await self._write(lambda session: session.execute(stmt))
+        return len(payload)
+    
+    async def load_state(self, name):
+        """Returns (state, saved_at), or (None, None) if nothing was saved under `name`."""
+        async with self.read_session() as session:
+            row = await session.get(BotState, name)
+            if row is None:
+                return None, None
+            return json.loads(zlib.decompress(row.payload).decode('utf-8')), row.saved_at
+    
+    @timed(db_write_latency, op='save_summary')
+    async def save_summary(self, scope, scope_id, summary, message_count, last_message_id=None):
+        stmt = self._insert(ConversationSummary).values(
+            scope=scope, scope_id=snowflake(scope_id), summary=summary, message_count=message_count,
+            last_message_id=snowflake(last_message_id), updated_at=datetime.utcnow()
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['scope', 'scope_id'],
+            set_={c: stmt.excluded[c] for c in ('summary', 'message_count', 'last_message_id', 'updated_at')}
+        )
+        await self._write(lambda session: session.execute(stmt))
+    
+    async def get_summaries(self, keys):
+        """Stored summaries for (scope, scope_id) keys, as {key: ConversationSummary}; missing keys are left out."""
+        keys = [(scope, snowflake(scope_id)) for scope, scope_id in keys]
+        if not keys:
+            return {}
+        async with self.read_session() as session:
+            from sqlalchemy import select, tuple_
             result = await session.execute(
+                select(ConversationSummary).where(tuple_(ConversationSummary.scope, ConversationSummary.scope_id).in_(keys))
+            )
+            return {(row.scope, row.scope_id): row for row in result.scalars()}
+    
+    def _insert(self, model):
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(model)
+    
+    async def _bump(self, session, model, keys, set_=None, **deltas):
+        # Atomic "value = value + delta" upsert so concurrent writers never lose increments
+        table = model.__table__
+        stmt = self._insert(model).values(**keys, **(set_ or {}), **deltas)
+        updates = {name: table.c[name] + stmt.excluded[name] for name in deltas}
+        for name in (set_ or {}):
+            updates[name] = stmt.excluded[name]
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=updates)
+        await session.execute(stmt)
+    
+    async def _bump_counters(self, session, **deltas):
+        for name, delta in deltas.items():
+            if delta:
+                await self._bump(session, StatsCounter, {'name': name}, value=delta)
+    
+    async def _record_message_rollup(self, session, user_id, server_id, is_dm, timestamp):
+        await self._bump_counters(session, messages=1, dm_messages=1 if is_dm else 0)
+        await self._bump(
+            session, StatsHourly,
+            {'bucket': _hour_bucket(timestamp), 'server_id': snowflake(server_id) or 0},
+            messages=1, dm_messages=1 if is_dm else 0, bot_responses=0
+        )
+        await self._bump(
+            session, UserStats, {'user_id': user_id},
+            set_={'last_message_at': timestamp}, message_count=1
+        )
+    
+    async def _record_response_rollup(self, session, server_id, timestamp):
+        await self._bump_counters(session, bot_responses=1)
+        await self._bump(
+            session, StatsHourly,
+            {'bucket': _hour_bucket(timestamp), 'server_id': snowflake(server_id) or 0},
+            messages=0, dm_messages=0, bot_responses=1
+        )
+    
+    async def rebuild_stats_rollups(self):
+        """Recompute the rollup tables from the raw tables (backfill for pre-existing databases)."""
+        from sqlalchemy import select, func, delete, case
+        
+        async def unit(session):
+            for model in (StatsCounter, StatsHourly, UserStats):
+                await session.execute(delete(model))
+            
+            users = await session.execute(
                 select(
-                    func.count(User.id).label('total_users'),
-                    func.count(User.id).filter(User.is_suspicious == True).label('suspicious_users'),
-                    func.sum(User.suspicion_count).label('total_suspicions')
+                    func.count(User.id),
+                    func.count(User.id).filter(User.is_suspicious == True),
+                    func.coalesce(func.sum(User.suspicion_count), 0)
                 )
             )
-            return result.one()
-    
-    async def get_message_stats(self):
-        async with self.async_session() as session:
-            from sqlalchemy import select, func
+            total_users, suspicious_users, suspicions = users.one()
             total_messages = await session.scalar(select(func.count(Message.id)))
             dm_messages = await session.scalar(select(func.count(Message.id)).where(Message.is_dm == True))
             bot_responses = await session.scalar(select(func.count(BotResponse.id)))
-            return (total_messages, dm_messages, bot_responses)
+            
+            for name, value in (('users', total_users), ('suspicious_users', suspicious_users),
+                                ('suspicions', suspicions), ('messages', total_messages),
+                                ('dm_messages', dm_messages), ('bot_responses', bot_responses)):
+                session.add(StatsCounter(name=name, value=value or 0))
+            
+            bucket = self._hour_bucket_expr(Message.timestamp)
+            rows = await session.execute(
+                select(
+                    bucket, Message.server_id,
+                    func.count(Message.id),
+                    func.sum(case((Message.is_dm == True, 1), else_=0))
+                ).group_by(bucket, Message.server_id)
+            )
+            hourly = {}
+            for b, server_id, count, dm_count in rows:
+                hourly[(self._parse_bucket(b), server_id or 0)] = [count, dm_count or 0, 0]
+            
+            bucket = self._hour_bucket_expr(BotResponse.timestamp)
+            rows = await session.execute(
+                select(bucket, BotResponse.server_id, func.count(BotResponse.id))
+                .group_by(bucket, BotResponse.server_id)
+            )
+            for b, server_id, count in rows:
+                hourly.setdefault((self._parse_bucket(b), server_id or 0), [0, 0, 0])[2] += count
+            
+            for (b, server_id), (count, dm_count, responses) in hourly.items():
+                session.add(StatsHourly(
+                    bucket=b, server_id=server_id,
+                    messages=count, dm_messages=dm_count, bot_responses=responses
+                ))
+            
+            rows = await session.execute(
+                select(Message.user_id, func.count(Message.id), func.max(Message.timestamp))
+                .group_by(Message.user_id)
+            )
+            for user_id, count, last_at in rows:
+                session.add(UserStats(user_id=user_id, message_count=count, last_message_at=last_at))
+        
+        await self._write(unit)
+    
+    def _hour_bucket_expr(self, column):
+        from sqlalchemy import func
+        if self.engine.dialect.name == 'postgresql':
+            return func.date_trunc('hour', column)
+        return func.strftime('%Y-%m-%d %H:00:00', column)
+    
+    @staticmethod
+    def _parse_bucket(value):
+        if isinstance(value, datetime):
+            return _hour_bucket(value)
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    
+    async def _get_counters(self, *names):
+        async with self.read_session() as session:
+            from sqlalchemy import select
+            result = await session.execute(
+                select(StatsCounter.name, StatsCounter.value).where(StatsCounter.name.in_(names))
+            )
+            values = dict(result.all())
+            return tuple(values.get(name, 0) for name in names)
+    
+    async def get_user_stats(self):
+        return await self._get_counters('users', 'suspicious_users', 'suspicions')
+    
+    async def get_message_stats(self):
+        return await self._get_counters('messages', 'dm_messages', 'bot_responses')
+    
+    async def get_recent_activity(self, hours=24):
+        """
+        (messages, bot responses) from the hourly rollups. Whole buckets are summed, so the
+        window reaches back to the start of the hour `hours` ago: 24 to 25 hours for the default.
+        """
+        since = _hour_bucket(datetime.utcnow() - timedelta(hours=hours))
+        async with self.read_session() as session:
+            from sqlalchemy import select, func
+            result = await session.execute(
+                select(
+                    func.coalesce(func.sum(StatsHourly.messages), 0),
+                    func.coalesce(func.sum(StatsHourly.bot_responses), 0)
+                ).where(StatsHourly.bucket >= since)
+            )
+            return tuple(result.one())
+    
+    async def get_top_users(self, limit=5):
+        async with self.read_session() as session:
+            from sqlalchemy import select
+            result = await session.execute(
+                select(User.username, Guild.name.label('server_name'), UserStats.message_count.label('msg_count'))
+                .join(UserStats, UserStats.user_id == User.id)
+                .outerjoin(Guild, Guild.id == User.server_id)
+                .order_by(UserStats.message_count.desc())
+                .limit(limit)
+            )
+            return result.all()
+    
+    def _archive_path(self, period):
+        return os.path.join(self.archive_dir, f"archive_{period.replace('-', '_')}.db")
+    
+    async def _get_archive_engine(self, path):
+        engine = self._archive_engines.get(path)
+        if engine is None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            engine = create_async_engine(f"sqlite+aiosqlite:///{path}", echo=False, poolclass=NullPool)
+            tables = [model.__table__ for model in ARCHIVED_MODELS.values()]
+            async with engine.begin() as conn:
+                await conn.run_sync(lambda sync_conn: Base.metadata.create_all(sync_conn, tables=tables))
+            self._archive_engines[path] = engine
+        return engine
+    
+    async def archive_old_rows(self, horizon_days=None, batch_size=5000):
+        """
+        Moves rows older than the horizon into per-month archive databases.
+        Each batch is committed to the archive before it is deleted from the live DB,
+        and archive inserts ignore existing ids, so an interrupted run can be repeated safely.
+        Rollup stats are not touched, so totals keep counting archived rows.
+        Returns {table_name: rows_moved}.
+        """
+        from sqlalchemy import select, delete, func
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        
+        horizon_days = self.archive_after_days if horizon_days is None else horizon_days
+        if not horizon_days or horizon_days <= 0:
+            return {}
+        cutoff = datetime.utcnow() - timedelta(days=horizon_days)
+        moved = {}
+        
+        for table_name, model in ARCHIVED_MODELS.items():
+            table = model.__table__
+            moved[table_name] = 0
+            while True:
+                async with self.read_session() as session:
+                    result = await session.execute(
+                        select(table).where(table.c.timestamp < cutoff).order_by(table.c.id).limit(batch_size)
+                    )
+                    rows = [dict(row._mapping) for row in result]
+                if not rows:
+                    break
+                
+                by_period = {}
+                for row in rows:
+                    by_period.setdefault(row['timestamp'].strftime('%Y-%m'), []).append(row)
+                
+                for period, period_rows in by_period.items():
+                    path = self._archive_path(period)
+                    engine = await self._get_archive_engine(path)
+                    async with engine.begin() as conn:
+                        await conn.execute(sqlite_insert(table).on_conflict_do_nothing(index_elements=['id']), period_rows)
+                        # Counted from the archive, so rows re-inserted by a repeated run aren't counted twice
+                        stored = (await conn.execute(
+                            select(func.count(), func.min(table.c.timestamp), func.max(table.c.timestamp))
+                        )).one()
+                    await self._update_catalog(table_name, period, path, *stored)
+                
+                async def unit(session):
+                    await session.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+                    if model is Message:
+                        await self._index_messages(session, [(row['id'], row['content']) for row in rows], delete=True)
+                
+                await self._write(unit)
+                moved[table_name] += len(rows)
+                
+                if len(rows) < batch_size:
+                    break
+        
+        if any(moved.values()):
+            await self.save_log('ARCHIVE', f'Archived rows older than {horizon_days} days: {moved}')
+        return moved
+    
+    async def _update_catalog(self, table_name, period, path, row_count, min_timestamp, max_timestamp):
+        async def unit(session):
+            entry = await session.get(ArchiveCatalog, (table_name, period))
+            if entry is None:
+                entry = ArchiveCatalog(table_name=table_name, period=period, path=path)
+                session.add(entry)
+            entry.row_count = row_count
+            entry.min_timestamp = min_timestamp
+            entry.max_timestamp = max_timestamp
+            entry.archived_at = datetime.utcnow()
+        
+        await self._write(unit)
+    
+    async def compact(self, max_pages=None, full=False):
+        """
+        Returns freed pages to the filesystem after archiving (SQLite only). `full` rebuilds
+        the whole file with VACUUM, which also repacks half-empty pages left by in-place updates.
+        The single writer, if on, is paused meanwhile.
+        """
+        if self.engine.dialect.name != 'sqlite':
+            return
+        async with self._maintenance(), self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            mode = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+            if mode != 2 or full:
+                # One-time conversion of a database created before incremental vacuum was enabled
+                await conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                await conn.exec_driver_sql("VACUUM")
+            elif max_pages:
+                await conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(max_pages)})")
+            else:
+                await conn.exec_driver_sql("PRAGMA incremental_vacuum")
+    
+    async def train_content_dictionary(self, samples_per_table=20000, dict_size=65536):
+        """
+        Trains a zstd dictionary on the newest content of each compressed table, stores it
+        and makes it the one new writes use. Returns (dictionary id, samples used).
+        """
+        from sqlalchemy import select
+        samples = []
+        async with self.read_session() as session:
+            for model in COMPRESSED_MODELS.values():
+                result = await session.execute(
+                    select(model.content).order_by(model.id.desc()).limit(samples_per_table)
+                )
+                samples += [content.encode('utf-8') for content in result.scalars() if content]
+        data = await asyncio.to_thread(train_dictionary, samples, dict_size)
+        dict_id = codec.add_dictionary(data, current=True)
+        await self._write(lambda session: session.merge(
+            CompressionDict(id=dict_id, data=data, created_at=datetime.utcnow())
+        ))
+        return dict_id, len(samples)
+    
+    async def recompress_content(self, batch_size=1000, pause=0.05, vacuum=False):
+        """
+        Background job: compresses rows still stored as plain text and re-encodes rows that use
+        an older dictionary, `batch_size` rows per transaction with a `pause` between batches so
+        the bot's writes get the lock in between. Rows shrink in place, so the file only gets
+        smaller after a VACUUM (`vacuum=True`, which holds the lock while it rewrites the file).
+        Safe to interrupt and rerun. Returns {table_name: rows_rewritten} (SQLite only).
+        """
+        if self.engine.dialect.name != 'sqlite':
+            return {}
+        rewritten = {}
+        for table_name in COMPRESSED_MODELS:
+            rewritten[table_name] = 0
+            last_id = 0
+            while True:
+                # Raw rows, so the stored form (TEXT or zstd BLOB) is visible
+                async with (self.read_engine or self.engine).connect() as conn:
+                    rows = (await conn.exec_driver_sql(
+                        f"SELECT id, content FROM {table_name} WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, batch_size)
+                    )).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                updates = []
+                for row_id, value in rows:
+                    if value is None or (isinstance(value, bytes) and codec.dict_id_of(value) == codec.current):
+                        continue
+                    encoded = codec.encode(codec.decode(value), force=True)
+                    if encoded != value:
+                        updates.append((encoded, row_id))
+                if updates:
+                    async def unit(session):
+                        conn = await session.connection()
+                        await conn.exec_driver_sql(f"UPDATE {table_name} SET content = ? WHERE id = ?", updates)
+                    
+                    await self._write(unit)
+                    rewritten[table_name] += len(updates)
+                if len(rows) < batch_size:
+                    break
+                await asyncio.sleep(pause)
+        if vacuum and any(rewritten.values()):
+            await self.compact(full=True)
+        return rewritten
+    
+    async def content_storage(self):
+        """{table_name: {storage class: (rows, bytes)}} for the compressed columns (SQLite only)."""
+        if self.engine.dialect.name != 'sqlite':
+            return {}
+        from sqlalchemy import text
+        storage = {}
+        async with self.read_session() as session:
+            for table_name in COMPRESSED_MODELS:
+                result = await session.execute(text(
+                    f"SELECT typeof(content), COUNT(*), SUM(LENGTH(CAST(content AS BLOB))) FROM {table_name} GROUP BY 1"
+                ))
+                storage[table_name] = {kind: (rows, size or 0) for kind, rows, size in result}
+        return storage
+    
+    async def run_retention(self):
+        moved = await self.archive_old_rows()
+        if any(moved.values()):
+            await self.compact()
+        return moved
+    
+    async def get_archive_catalog(self, table_name=None):
+        async with self.read_session() as session:
+            from sqlalchemy import select
+            query = select(ArchiveCatalog).order_by(ArchiveCatalog.period, ArchiveCatalog.table_name)
+            if table_name:
+                query = query.where(ArchiveCatalog.table_name == table_name)
+            result = await session.execute(query)
+            return result.scalars().all()
+    
+    async def query_archive(self, table_name, since=None, until=None, limit=None):
+        """Yields archived rows of `table_name` in [since, until), opening only the months that overlap."""
+        from sqlalchemy import select
+        
+        table = ARCHIVED_MODELS[table_name].__table__
+        remaining = limit
+        for entry in await self.get_archive_catalog(table_name):
+            if since and entry.max_timestamp < since:
+                continue
+            if until and entry.min_timestamp >= until:
+                continue
+            if not os.path.exists(entry.path):
+                continue
+            engine = await self._get_archive_engine(entry.path)
+            query = select(table).order_by(table.c.timestamp)
+            if since:
+                query = query.where(table.c.timestamp >= since)
+            if until:
+                query = query.where(table.c.timestamp < until)
+            if remaining is not None:
+                query = query.limit(remaining)
+            async with engine.connect() as conn:
+                result = await conn.stream(query)
+                async for row in result:
+                    yield row
+                    if remaining is not None:
+                        remaining -= 1
+                        if remaining <= 0:
+                            return
 
 db_manager = DatabaseManager()
@@ -1,7 +1,7 @@
 import discord
 import asyncio
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Set
 from collections import deque
 from discord.ext import commands
@@ -13,6 +13,14 @@ import hashlib
 from database import db_manager
 from LLM_Client import llm_client
 from safety_filter import SafetyFilter
+import metrics
+from tracing import tracer, SLEEP, WAIT
+from action_queue import ActionQueue, URGENT, AMBIENT, PLANNED
+from context_loader import ContextLoader, message_data
+from channel_index import ChannelIndex
+from memory_index import VectorMemory
+from summaries import RollingSummaries
+import snapshot
 
 load_dotenv(override=True)
 
@@ -28,7 +36,7 @@ def log_to_file(component: str, message: str):
 log_to_file("ENV", "dotenv loaded")
 
 class DiscordAIBot(commands.Bot):
-    def __init__(self):
+    def __init__(self, shard_id=None, shard_count=None):
         log_to_file("INIT", "Initializing DiscordAIBot...")
         
         intents = discord.Intents.default()
@@ -41,7 +49,9 @@ class DiscordAIBot(commands.Bot):
         super().__init__(
             command_prefix='!',
             intents=intents,
-            help_command=None
+            help_command=None,
+            shard_id=shard_id,
+            shard_count=shard_count
         )
         
         self.recent_messages = deque(maxlen=50)
@@ -52,7 +62,11 @@ class DiscordAIBot(commands.Bot):
         self.personality = 'sarcastic, direct, ironic, sometimes chaotic'
         self.bio = ''
         self.conversation_history = {}
-        self.action_queue = asyncio.Queue()
+        self.action_queue = ActionQueue(
+            maxsize=int(os.getenv('QUEUE_MAX_SIZE', '200')),
+            ttl={AMBIENT: float(os.getenv('QUEUE_TTL_SECONDS', '180'))},
+            on_discard=self._on_action_discarded
+        )
         
         self.current_focus_guild_id = None
         self.current_focus_channel_id = None
@@ -91,9 +105,150 @@ class DiscordAIBot(commands.Bot):
         self.is_sleeping = False
         self.sleep_end_time = None
         
+        self.channel_languages: Dict[int, str] = {}
+        self.channel_language_times: Dict[int, float] = {}
+        self.language_refresh_secs = float(os.getenv('LANGUAGE_REFRESH_SECONDS', '3600') or 0)
+        self.channel_index = ChannelIndex(half_life=float(os.getenv('CHANNEL_ACTIVITY_HALF_LIFE', '3600')))
+        self.context_loader = ContextLoader(
+            per_channel=20,
+            min_history_interval=float(os.getenv('HISTORY_MIN_INTERVAL', '1.0'))
+        )
+        self.state_key = f"bot:{self.token_fingerprint or 'default'}"
+        if shard_id is not None:
+            self.state_key += f":shard{shard_id}"
+        self.state_snapshot_interval = float(os.getenv('STATE_SNAPSHOT_INTERVAL', '60') or 0)
+        self.state_max_age_hours = float(os.getenv('STATE_MAX_AGE_HOURS', '24'))
+        self.analytics_snapshot_interval = float(os.getenv('ANALYTICS_SNAPSHOT_INTERVAL_MINUTES', '0') or 0)
+        self.context_search_limit = int(os.getenv('CONTEXT_SEARCH_LIMIT', '3') or 0)
+        self.context_search_candidates = int(os.getenv('CONTEXT_SEARCH_CANDIDATES', '1000') or 0)
+        memory_dir = os.getenv('MEMORY_DIR')
+        self.memory = VectorMemory(memory_dir, int(os.getenv('MEMORY_DIM', '256'))) if memory_dir else None
+        self.memory_min_score = float(os.getenv('MEMORY_MIN_SCORE', '0.3'))
+        summary_every = int(os.getenv('SUMMARY_EVERY', '20') or 0)
+        self.summaries = RollingSummaries(
+            llm_client.summarize_conversation,
+            every=summary_every,
+            concurrency=int(os.getenv('SUMMARY_CONCURRENCY', '1')),
+            log=lambda msg: log_to_file("SUMMARY", msg)
+        ) if summary_every > 0 else None
+        self.summary_recent_lines = int(os.getenv('SUMMARY_RECENT_LINES', '4'))
+        
         import re
         self.url_re = re.compile(r'https?://\S+')
+        self.keyword_re = re.compile(r'\w{4,}')
+        
+        self.metrics_port = int(os.getenv('METRICS_PORT', '0') or 0)
+        if self.metrics_port and shard_id is not None:
+            # METRICS_PORT itself belongs to the supervisor's aggregated endpoint
+            self.metrics_port += 1 + shard_id
+        self.metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.metrics_runner = None
+        metrics.registry.add_collector(self._collect_queue_depth)
+        
+        self.burst_window = float(os.getenv('BURST_WINDOW_SECONDS', '3') or 0)
+        self.burst_max_window = float(os.getenv('BURST_MAX_SECONDS', '10'))
+        self.bursts = {}
+        # channel id -> the reply being prepared there, so newer activity can cancel it
+        self.replies_in_flight = {}
+        self.reply_stale_after = int(os.getenv('REPLY_STALE_AFTER', '10') or 0)
         
+        slow_callback_ms = float(os.getenv('LOOP_SLOW_CALLBACK_MS', '100') or 0)
+        self.loop_monitor = metrics.LoopMonitor(
+            threshold=slow_callback_ms / 1000,
+            report_interval=float(os.getenv('LOOP_REPORT_INTERVAL', '300')),
+            debug=os.getenv('LOOP_DEBUG', '0') == '1',
+            log=lambda msg: log_to_file("LOOP", msg)
+        )
+        
+    def _collect_queue_depth(self):
+        for priority, depth in self.action_queue.depth_by_priority().items():
+            metrics.queue_depth.set(depth, priority=priority)
+    
+    def _on_action_discarded(self, item, reason):
+        action_type, data = item
+        if action_type == 'handle_message':
+            log_to_file("QUEUE", f"Discarded message {data.id} in {data.channel.id} ({reason})")
+            tracer.get(data.id).finish(reason)
+        else:
+            log_to_file("QUEUE", f"Discarded {action_type} {data.get('action')} ({reason})")
+    
+    def snapshot_state(self) -> Dict:
+        return {
+            'version': 1,
+            'recent_messages': list(self.recent_messages),
+            'pending_dms': list(self.pending_dms),
+            'conversation_history': {uid: list(texts) for uid, texts in self.conversation_history.items()},
+            'active_channels': list(self.active_channels),
+            'interest_level': self.interest_level,
+            'last_stimulus_time': self.last_stimulus_time.isoformat(),
+            'current_focus_guild_id': self.current_focus_guild_id,
+            'current_focus_channel_id': self.current_focus_channel_id,
+            'last_send_times': {str(cid): ts for cid, ts in self.last_send_times.items()},
+            'channel_languages': {str(cid): lang for cid, lang in self.channel_languages.items()},
+            'channel_language_times': {str(cid): ts for cid, ts in self.channel_language_times.items()},
+            'channel_activity': self.channel_index.snapshot(),
+            'is_sleeping': self.is_sleeping,
+            'sleep_end_time': self.sleep_end_time.isoformat() if self.sleep_end_time else None,
+            'bio': self.bio,
+            'mood': self.mood,
+            'last_action': self.last_action,
+            'summary_pending': self.summaries.pending_state() if self.summaries else {}
+        }
+    
+    def restore_state(self, state: Dict):
+        self.recent_messages = deque(state.get('recent_messages', []), maxlen=self.recent_messages.maxlen)
+        self.pending_dms = deque(state.get('pending_dms', []), maxlen=self.pending_dms.maxlen)
+        self.conversation_history = {
+            uid: deque(texts, maxlen=10) for uid, texts in state.get('conversation_history', {}).items()
+        }
+        self.active_channels = set(state.get('active_channels', []))
+        self.interest_level = state.get('interest_level', 0.0)
+        self.last_stimulus_time = datetime.fromisoformat(state['last_stimulus_time'])
+        self.current_focus_guild_id = state.get('current_focus_guild_id')
+        self.current_focus_channel_id = state.get('current_focus_channel_id')
+        self.last_send_times = {int(cid): ts for cid, ts in state.get('last_send_times', {}).items()}
+        self.channel_languages = {int(cid): lang for cid, lang in state.get('channel_languages', {}).items()}
+        self.channel_language_times = {int(cid): ts for cid, ts in state.get('channel_language_times', {}).items()}
+        self.channel_index.restore(state.get('channel_activity', {}))
+        self.is_sleeping = state.get('is_sleeping', False)
+        self.sleep_end_time = datetime.fromisoformat(state['sleep_end_time']) if state.get('sleep_end_time') else None
+        self.bio = state.get('bio', '')
+        self.mood = state.get('mood', self.mood)
+        self.last_action = state.get('last_action', self.last_action)
+        if self.summaries:
+            self.summaries.restore_pending(state.get('summary_pending'))
+    
+    async def save_state(self):
+        try:
+            size = await db_manager.save_state(self.state_key, self.snapshot_state())
+            log_to_file("STATE", f"Saved state snapshot ({size} bytes)")
+        except Exception as e:
+            print(f"State snapshot error: {e}")
+            log_to_file("ERROR", f"State snapshot error: {e}")
+    
+    async def load_state(self):
+        try:
+            state, saved_at = await db_manager.load_state(self.state_key)
+        except Exception as e:
+            log_to_file("ERROR", f"State restore error: {e}")
+            return False
+        if state is None:
+            return False
+        age_hours = (datetime.utcnow() - saved_at).total_seconds() / 3600
+        if age_hours > self.state_max_age_hours:
+            log_to_file("STATE", f"Ignoring state snapshot from {saved_at} ({age_hours:.1f}h old)")
+            return False
+        self.restore_state(state)
+        log_to_file("STATE", f"Restored state from {saved_at}: {len(self.recent_messages)} recent messages, focus {self.current_focus_channel_id}, interest {self.interest_level:.2f}")
+        return True
+    
+    async def state_snapshot_loop(self):
+        if self.state_snapshot_interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.state_snapshot_interval)
+            await self.save_state()
+    
     def _update_interest(self, amount: float):
         self.interest_level = max(0.0, min(1.0, self.interest_level + amount))
         if amount > 0:
@@ -157,12 +312,12 @@ class DiscordAIBot(commands.Bot):
         if not guild:
             guild = random.choice(self.guilds)
         
-        channels = [c for c in guild.text_channels if c.permissions_for(guild.me).read_messages and c.permissions_for(guild.me).send_messages]
+        channel = self.channel_index.pick(guild)
         
-        if channels:
-            channel = random.choice(channels)
+        if channel:
             self.current_focus_guild_id = guild.id
             self.current_focus_channel_id = channel.id
+            self._cancel_unfocused_replies()
             self.interest_level = 0.6
             self.last_stimulus_time = datetime.now()
             print(f"Roaming: Switched focus to {guild.name} #{channel.name}")
@@ -170,29 +325,34 @@ class DiscordAIBot(commands.Bot):
             log_to_file("ROAMING", f"Focus guild {guild.id} {guild.name}, channel {channel.id} {channel.name}, interest {self.interest_level:.2f}")
             
             try:
-                history = [msg async for msg in channel.history(limit=5)]
-                if history:
-                    last_msg = history[0]
-                    try:
-                        pass
-                    except Exception:
-                        pass
-                
-                for message in reversed(history):
-                     if message.author != self.user:
-                        self._add_to_recent(message)
+                self._merge_into_recent(await self.context_loader.recent(channel, 5, exclude_author=self.user.id))
             except Exception as e:
                 print(f"Error reading history after switch: {e}")
 
-    async def _detect_language_llm(self, texts):
+    async def _detect_language_llm(self, texts, channel_id=None):
+        # A channel's language is re-detected at most every language_refresh_secs
+        known = self.channel_languages.get(channel_id)
+        now = datetime.now().timestamp()
+        if known is not None and (not texts or now - self.channel_language_times.get(channel_id, 0.0) < self.language_refresh_secs):
+            return known
         try:
-            return await llm_client.detect_language(texts)
-        except:
-            return self.default_language
+            language = await llm_client.detect_language(texts)
+        except Exception:
+            return self.channel_languages.get(channel_id, self.default_language)
+        if channel_id is not None:
+            self.channel_languages[channel_id] = language
+            self.channel_language_times[channel_id] = now
+        return language
 
     def _build_ai_context(self, message, language):
         user_id_str = str(message.author.id)
-        recent_channel = [m for m in self.recent_messages if m.get('channel') == message.channel.id][-8:]
+        channel_summary = user_summary = ''
+        if self.summaries:
+            channel_summary = self.summaries.get(('channel', message.channel.id))
+            user_summary = self.summaries.get(('user', message.author.id))
+        # With a summary covering the older lines, only the last few are sent verbatim
+        raw_lines = self.summary_recent_lines if channel_summary else 8
+        recent_channel = [m for m in self.recent_messages if m.get('channel') == message.channel.id][-raw_lines:]
         texts = [m['content'] for m in recent_channel]
         links = []
         for t in texts + [message.content]:
@@ -214,7 +374,11 @@ class DiscordAIBot(commands.Bot):
             'bio': self.bio,
             'bot_name': self.user.name,
             'bot_display_name': self.user.display_name,
-            'conversation_context': '\n'.join(list(self.conversation_history.get(user_id_str, []))[-5:]),
+            'conversation_context': '\n'.join(
+                list(self.conversation_history.get(user_id_str, []))[-(self.summary_recent_lines if user_summary else 5):]
+            ),
+            'channel_summary': channel_summary,
+            'user_summary': user_summary,
             'server_name': message.guild.name if message.guild else 'DM',
             'channel_name': message.channel.name if hasattr(message.channel, 'name') else 'DM',
             'language': language,
@@ -225,36 +389,86 @@ class DiscordAIBot(commands.Bot):
             'topic_hint': topic_hint
         }
 
+    async def _related_history(self, message):
+        """
+        Older stored messages from this guild (or DM) related to `message`, best match first:
+        nearest neighbours from the vector memory if MEMORY_DIR is set, else full-text matches.
+        """
+        shown = {m['id'] for m in self.recent_messages if m.get('channel') == message.channel.id}
+        shown.add(message.id)
+        wanted = self.context_search_limit + len(shown)
+        rows = []
+        try:
+            if self.memory is not None:
+                scope = VectorMemory.scope(message.guild.id if message.guild else None, message.channel.id)
+                hits = await asyncio.to_thread(self.memory.search, scope, message.content or '', wanted)
+                rows = await db_manager.get_messages_by_ids(
+                    list(dict.fromkeys(row_id for row_id, score in hits if score >= self.memory_min_score))
+                )
+            keywords = list(dict.fromkeys(w.lower() for w in self.keyword_re.findall(message.content or '')))[:8]
+            if not rows and keywords:
+                rows = await db_manager.search_messages(
+                    ' '.join(keywords),
+                    guild=message.guild.id if message.guild else None,
+                    channel=None if message.guild else message.channel.id,
+                    limit=wanted,
+                    any_term=True,
+                    candidates=self.context_search_candidates
+                )
+        except Exception as e:
+            log_to_file("ERROR", f"History search error: {e}")
+            return ''
+        lines = []
+        for found, author_id, username, channel_name, guild_name in rows:
+            if found.discord_message_id in shown:
+                continue
+            lines.append(f"{username}: {(found.content or '')[:160]}")
+            if len(lines) >= self.context_search_limit:
+                break
+        return '\n'.join(lines)
+
+    async def _load_summaries(self, keys):
+        try:
+            await self.summaries.load(keys)
+        except Exception as e:
+            log_to_file("ERROR", f"Summary load error: {e}")
+
     def _add_to_recent(self, message):
-         msg_data = {
-            'id': message.id,
-            'author': message.author.id,
-            'author_name': message.author.name,
-            'content': message.content,
-            'channel': message.channel.id,
-            'channel_name': message.channel.name if hasattr(message.channel, 'name') else 'DM',
-            'guild': message.guild.id if message.guild else None,
-            'guild_name': message.guild.name if message.guild else None,
-            'is_dm': isinstance(message.channel, discord.DMChannel),
-            'timestamp': datetime.now().isoformat()
-        }
-         self.recent_messages.append(msg_data)
+        msg_data = message_data(message)
+        self.recent_messages.append(msg_data)
+    
+    def _merge_into_recent(self, items):
+        known = {m['id'] for m in self.recent_messages}
+        for msg_data in items:
+            if msg_data['id'] not in known:
+                self.recent_messages.append(msg_data)
 
     async def setup_hook(self):
         log_to_file("SETUP", "Running setup_hook")
         await db_manager.initialize()
         await db_manager.save_log('STARTUP', 'Discord AI Bot started')
+        if await self.load_state():
+            print("Restored state from the last snapshot")
+        if self.metrics_port:
+            try:
+                self.metrics_runner = await metrics.start_metrics_server(self.metrics_host, self.metrics_port, self.get_stats)
+                log_to_file("METRICS", f"Serving /metrics and /stats on {self.metrics_host}:{self.metrics_port}")
+            except Exception as e:
+                log_to_file("ERROR", f"Failed to start metrics server: {e}")
+        if self.metrics_port or self.loop_monitor.threshold > 0:
+            asyncio.create_task(self.loop_monitor.run())
         print("Discord AI Bot started successfully!")
     
     async def on_ready(self):
         log_to_file("READY", f"Logged in as {self.user} ({self.user.id})")
         
-        try:
-            app_info = await self.application_info()
-            self.bio = app_info.description or ""
-            log_to_file("READY", f"Fetched bio: {self.bio[:50]}...")
-        except Exception as e:
-            log_to_file("ERROR", f"Failed to fetch app info: {e}")
+        if not self.bio:
+            try:
+                app_info = await self.application_info()
+                self.bio = app_info.description or ""
+                log_to_file("READY", f"Fetched bio: {self.bio[:50]}...")
+            except Exception as e:
+                log_to_file("ERROR", f"Failed to fetch app info: {e}")
 
         print(f'{self.user} is online!')
         print(f'Connected to {len(self.guilds)} servers')
@@ -266,7 +480,7 @@ class DiscordAIBot(commands.Bot):
             await db_manager.save_log(
                 'SERVER_JOIN',
                 f'Connected to server: {guild.name} ({guild.id})',
-                server_id=str(guild.id),
+                server_id=guild.id,
                 server_name=guild.name
             )
             print(f' - {guild.name} ({guild.id})')
@@ -279,48 +493,124 @@ class DiscordAIBot(commands.Bot):
         
         asyncio.create_task(self.action_planner())
         asyncio.create_task(self.process_action_queue())
+        if not self.shard_id:
+            # The database is shared, so only one shard prunes it
+            asyncio.create_task(self.retention_loop())
+            asyncio.create_task(self.analytics_snapshot_loop())
+        asyncio.create_task(self.state_snapshot_loop())
     
     async def on_guild_join(self, guild):
         log_to_file("GUILD_JOIN", f"Joined new guild: {guild.name} ({guild.id})")
         await db_manager.save_log(
             'SERVER_JOIN',
             f'Joined server: {guild.name} ({guild.id})',
-            server_id=str(guild.id),
+            server_id=guild.id,
             server_name=guild.name
         )
         print(f'Joined server: {guild.name}')
     
+    async def on_guild_remove(self, guild):
+        self.channel_index.invalidate(guild.id)
+    
+    async def on_guild_channel_create(self, channel):
+        self.channel_index.invalidate(channel.guild.id)
+    
+    async def on_guild_channel_delete(self, channel):
+        self.channel_index.invalidate(channel.guild.id)
+    
+    async def on_guild_channel_update(self, before, after):
+        self.channel_index.invalidate(after.guild.id)
+    
+    async def on_guild_role_update(self, before, after):
+        self.channel_index.invalidate(after.guild.id)
+    
+    async def on_guild_role_delete(self, role):
+        self.channel_index.invalidate(role.guild.id)
+    
+    async def on_member_update(self, before, after):
+        if after.id == self.user.id and before.roles != after.roles:
+            self.channel_index.invalidate(after.guild.id)
+    
+    async def on_raw_message_delete(self, payload):
+        channel_id, message_id = payload.channel_id, payload.message_id
+        reply = self.replies_in_flight.get(channel_id)
+        if reply is not None and reply['message'].id == message_id:
+            self._cancel_reply(channel_id, 'deleted')
+            return
+        if self.action_queue.discard(channel_id, 'deleted', match=lambda item: item[1].id == message_id):
+            return
+        burst = self.bursts.get(channel_id)
+        if burst and any(m.id == message_id for m in burst['messages']):
+            burst['messages'] = [m for m in burst['messages'] if m.id != message_id]
+            tracer.get(message_id).finish('deleted')
+            if not burst['messages']:
+                burst['task'].cancel()
+                del self.bursts[channel_id]
+
     async def on_message(self, message):
         if message.author.id == self.user.id:
+            # Our own sends move channel.last_message_id too; noting them spares a history call
+            self.context_loader.note(message_data(message))
             return
         
         log_to_file("ON_MESSAGE", f"Received message from {message.author} in {message.channel}: {message.content[:50]}...")
+        metrics.messages_ingested.inc()
+        metrics.messages_rate.mark()
+        trace = tracer.start(message.id, 'on_message', channel=message.channel.id)
+        if message.guild:
+            self.channel_index.record_activity(message.channel.id)
         
         try:
             is_dm = isinstance(message.channel, discord.DMChannel)
             
+            stored, created = None, False
             try:
-                await db_manager.save_message(
-                    discord_id=message.author.id,
-                    username=message.author.name,
-                    display_name=message.author.display_name,
-                    discord_message_id=message.id,
-                    channel_id=message.channel.id,
-                    channel_name=message.channel.name if hasattr(message.channel, 'name') else 'DM',
-                    content=message.content,
-                    server_id=message.guild.id if message.guild else None,
-                    server_name=message.guild.name if message.guild else None,
-                    is_dm=is_dm
-                )
+                async with trace.span('save_message'):
+                    stored, created = await db_manager.save_message(
+                        discord_id=message.author.id,
+                        username=message.author.name,
+                        display_name=message.author.display_name,
+                        discord_message_id=message.id,
+                        channel_id=message.channel.id,
+                        channel_name=message.channel.name if hasattr(message.channel, 'name') else 'DM',
+                        content=message.content,
+                        server_id=message.guild.id if message.guild else None,
+                        server_name=message.guild.name if message.guild else None,
+                        is_dm=is_dm
+                    )
             except Exception as e:
                 print(f"Database error while saving message: {e}")
+            # A replayed gateway event returns the stored row: its vector is already there
+            if self.memory is not None and created:
+                try:
+                    with trace.span('memory_add'):
+                        self.memory.add(
+                            VectorMemory.scope(message.guild.id if message.guild else None, message.channel.id),
+                            stored.id, message.content
+                        )
+                except Exception as e:
+                    log_to_file("ERROR", f"Memory append error: {e}")
+            # Every channel, focused or not, so a cached channel never lags behind last_message_id
+            self.context_loader.note(message_data(message))
             
             is_focused_channel = (message.channel.id == self.current_focus_channel_id)
             is_mention = self.user.mentioned_in(message)
             
+            reply = self.replies_in_flight.get(message.channel.id)
+            if reply is not None:
+                reply['newer'] += 1
+                # A mention or DM is answered however busy the channel gets; only its author can supersede it
+                if self.reply_stale_after and not reply['urgent'] and reply['newer'] >= self.reply_stale_after:
+                    self._cancel_reply(message.channel.id, 'stale')
+            
             if not is_focused_channel and not is_mention and not is_dm:
                 log_to_file("ON_MESSAGE", "Ignored: Message not in focused channel and no mention/DM")
+                trace.finish('ignored')
                 return
+            
+            if reply is not None and (is_mention or message.author.id == reply['message'].author.id):
+                # This message goes through the burst and queue and gets its own reply decision
+                await self._supersede_reply(reply, 'superseded', message)
 
             if is_dm:
                 log_to_file("FOCUS", "Interest boosted due to DM")
@@ -329,6 +619,7 @@ class DiscordAIBot(commands.Bot):
                 if message.guild:
                     self.current_focus_guild_id = message.guild.id
                     self.current_focus_channel_id = message.channel.id
+                    self._cancel_unfocused_replies()
                 self.interest_level = 1.0
                 self.last_stimulus_time = datetime.now()
                 print(f"Focus switched to {message.guild.name if message.guild else 'DM'} due to mention")
@@ -339,6 +630,8 @@ class DiscordAIBot(commands.Bot):
 
             self._add_to_recent(message)
             self.active_channels.add(message.channel.id)
+            if self.summaries:
+                self.summaries.note(self.recent_messages[-1])
             
             if is_dm:
                 self.pending_dms.append(self.recent_messages[-1])
@@ -348,28 +641,83 @@ class DiscordAIBot(commands.Bot):
                 self.conversation_history[user_id_str] = deque(maxlen=10)
             self.conversation_history[user_id_str].append(message.content)
             
-            try:
-                suspicion = await llm_client.is_suspicion_detected(message.content)
-                if suspicion:
-                    log_to_file("SUSPICION", f"Suspicion detected in message: {message.content}")
-                    await db_manager.log_suspicion(
-                        message.author.id,
-                        message.author.name,
-                        message.content
-                    )
-                    await self.handle_suspicion(message)
-                else:
-                    await self.action_queue.put(('handle_message', message))
-            except Exception as e:
-                print(f"LLM/Queue error: {e}")
-                log_to_file("ERROR", f"LLM/Queue error: {e}")
-                await db_manager.save_log('ERROR', f'LLM/Queue error: {str(e)}')
+            if self.burst_window > 0:
+                trace.open('burst_wait', kind=WAIT)
+                self._buffer_burst(message)
+            else:
+                await self._process_burst([message])
         
         except Exception as e:
+            trace.finish('error')
             print(f"General message handling error: {e}")
             log_to_file("ERROR", f"General message handling error: {e}")
             await db_manager.save_log('ERROR', f'General message error: {str(e)}')
     
+    def _buffer_burst(self, message):
+        """Debounces a channel: the burst is flushed once it has been quiet for burst_window seconds."""
+        channel_id = message.channel.id
+        burst = self.bursts.get(channel_id)
+        if burst is None:
+            burst = self.bursts[channel_id] = {'messages': [], 'started': datetime.now(), 'task': None}
+        elif burst['task']:
+            burst['task'].cancel()
+        burst['messages'].append(message)
+        elapsed = (datetime.now() - burst['started']).total_seconds()
+        delay = max(0.0, min(self.burst_window, self.burst_max_window - elapsed))
+        burst['task'] = asyncio.create_task(self._flush_burst(channel_id, delay))
+    
+    async def _flush_burst(self, channel_id, delay):
+        await asyncio.sleep(delay)
+        burst = self.bursts.pop(channel_id, None)
+        if burst:
+            await self._process_burst(burst['messages'])
+    
+    def _pick_reply_target(self, messages):
+        """Latest message mentioning the bot, else the latest question, else the latest message."""
+        return max(
+            enumerate(messages),
+            key=lambda im: (self.user.mentioned_in(im[1]), '?' in im[1].content, im[0])
+        )[1]
+    
+    async def _process_burst(self, messages):
+        target = self._pick_reply_target(messages)
+        trace = tracer.get(target.id)
+        trace.activate()
+        trace.close('burst_wait')
+        for m in messages:
+            if m is not target:
+                tracer.get(m.id).finish('coalesced')
+        metrics.burst_size.observe(len(messages))
+        if len(messages) > 1:
+            log_to_file("BURST", f"Coalesced {len(messages)} messages in {target.channel.id}, replying to {target.id}")
+        
+        try:
+            async with trace.span('is_suspicion_detected', batch=len(messages)):
+                verdicts = await asyncio.gather(*(llm_client.check_suspicion(m.content) for m in messages))
+            suspect = next((m for m, verdict in zip(messages, verdicts) if verdict), None)
+            if suspect:
+                log_to_file("SUSPICION", f"Suspicion detected in message: {suspect.content}")
+                async with trace.span('log_suspicion'):
+                    await db_manager.log_suspicion(
+                        suspect.author.id,
+                        suspect.author.name,
+                        suspect.content
+                    )
+                async with trace.span('handle_suspicion'):
+                    await self.handle_suspicion(suspect)
+                trace.finish('suspicion')
+            else:
+                is_dm = isinstance(target.channel, discord.DMChannel)
+                is_mention = any(self.user.mentioned_in(m) for m in messages)
+                trace.open('queue_wait', kind=WAIT)
+                priority = URGENT if (is_dm or is_mention) else AMBIENT
+                await self.action_queue.put(('handle_message', target), priority, merge_key=target.channel.id)
+        except Exception as e:
+            print(f"LLM/Queue error: {e}")
+            log_to_file("ERROR", f"LLM/Queue error: {e}")
+            trace.finish('error')
+            await db_manager.save_log('ERROR', f'LLM/Queue error: {str(e)}')
+    
     async def handle_suspicion(self, message):
         log_to_file("SUSPICION_HANDLE", f"Handling suspicion for message: {message.id}")
         try:
@@ -388,7 +736,8 @@ class DiscordAIBot(commands.Bot):
                 log_to_file("SAFETY_BLOCK", f"Blocked suspicion response: {reason}")
                 response = "..."  # Fallback
             
-            await message.reply(response)
+            sent = await message.reply(response)
+            self.context_loader.note(message_data(sent))
             
             await db_manager.save_bot_response(
                 discord_message_id=message.id,
@@ -425,7 +774,7 @@ class DiscordAIBot(commands.Bot):
                 else:
                     if now.hour in [1, 2, 3, 4, 5] and random.random() < 0.1:
                          sleep_duration = random.uniform(4, 8) 
-                         self.sleep_end_time = now + asyncio.timedelta(hours=sleep_duration)
+                         self.sleep_end_time = now + timedelta(hours=sleep_duration)
                          self.is_sleeping = True
                          log_to_file("SLEEP", f"Going to sleep for {sleep_duration:.2f} hours until {self.sleep_end_time}")
                          await self.change_presence(status=discord.Status.idle, activity=None)
@@ -442,12 +791,18 @@ class DiscordAIBot(commands.Bot):
                 ]
                 
                 channel_texts = [m['content'] for m in current_messages[-10:]]
-                channel_language = await self._detect_language_llm(channel_texts)
+                channel_language = await self._detect_language_llm(channel_texts, self.current_focus_channel_id)
+                
+                channel_summary = ''
+                if self.summaries and self.current_focus_channel_id:
+                    await self._load_summaries([('channel', self.current_focus_channel_id)])
+                    channel_summary = self.summaries.get(('channel', self.current_focus_channel_id))
                 
                 context = {
                     'servers': [{'id': g.id, 'name': g.name} for g in self.guilds],
                     'active_channels': list(self.active_channels),
-                    'recent_messages': current_messages[-10:],
+                    'recent_messages': current_messages[-(self.summary_recent_lines if channel_summary else 10):],
+                    'channel_summary': channel_summary,
                     'pending_dms': list(self.pending_dms),
                     'mood': self.mood,
                     'last_action': self.last_action,
@@ -473,7 +828,7 @@ class DiscordAIBot(commands.Bot):
                     log_to_file("PLANNER", f"Plan generated: {action_plan}")
                     
                     if action_plan['confidence'] > 0.6:
-                        await self.action_queue.put(('execute_action', action_plan))
+                        await self.action_queue.put(('execute_action', action_plan), PLANNED)
                 else:
                     log_to_file("PLANNER", "Skipping planning (low interest)")
             
@@ -488,6 +843,32 @@ class DiscordAIBot(commands.Bot):
                     await asyncio.sleep(300) # Wait 5 minutes before retrying
 
     
+    async def retention_loop(self):
+        if db_manager.archive_after_days <= 0:
+            return
+        log_to_file("RETENTION", f"Archiving rows older than {db_manager.archive_after_days} days every {db_manager.archive_interval_hours}h")
+        while True:
+            try:
+                moved = await db_manager.run_retention()
+                log_to_file("RETENTION", f"Archived rows: {moved}")
+            except Exception as e:
+                print(f"Retention error: {e}")
+                log_to_file("ERROR", f"Retention error: {e}")
+            await asyncio.sleep(db_manager.archive_interval_hours * 3600)
+    
+    async def analytics_snapshot_loop(self):
+        if self.analytics_snapshot_interval <= 0:
+            return
+        log_to_file("SNAPSHOT", f"Refreshing {snapshot.snapshot_path()} every {self.analytics_snapshot_interval:g} min")
+        while True:
+            try:
+                path, seconds, size = await snapshot.take_snapshot(db_manager.database_url)
+                log_to_file("SNAPSHOT", f"Wrote {path} ({size} bytes) in {seconds:.2f}s")
+            except Exception as e:
+                print(f"Snapshot error: {e}")
+                log_to_file("ERROR", f"Snapshot error: {e}")
+            await asyncio.sleep(self.analytics_snapshot_interval * 60)
+    
     async def process_action_queue(self):
         log_to_file("QUEUE", "Starting action queue processor")
         while True:
@@ -496,7 +877,7 @@ class DiscordAIBot(commands.Bot):
                 log_to_file("QUEUE", f"Processing action: {action_type}")
                 
                 if action_type == 'handle_message':
-                    await self.handle_ai_response(data)
+                    await self._run_reply(data)
                 elif action_type == 'execute_action':
                     await self.execute_action(data)
             
@@ -504,65 +885,119 @@ class DiscordAIBot(commands.Bot):
                 print(f"Action processing error: {e}")
                 log_to_file("ERROR", f"Action processing error: {e}")
     
+    def _is_urgent(self, message):
+        return isinstance(message.channel, discord.DMChannel) or self.user.mentioned_in(message)
+
+    async def _run_reply(self, message):
+        """
+        Runs handle_ai_response as its own task, registered in replies_in_flight so that
+        newer messages, a deletion or a focus change can cancel it, along with any sleep
+        or LLM request it is waiting on.
+        """
+        channel_id = message.channel.id
+        urgent = self._is_urgent(message)
+        if not urgent and channel_id != self.current_focus_channel_id:
+            # Focus moved on while this ambient message was queued
+            metrics.replies_cancelled.inc(reason='unfocused')
+            tracer.get(message.id).finish('unfocused')
+            return
+        reply = {
+            'message': message, 'urgent': urgent, 'newer': 0, 'sending': False, 'reason': None,
+            'task': asyncio.ensure_future(self.handle_ai_response(message))
+        }
+        self.replies_in_flight[channel_id] = reply
+        try:
+            await asyncio.wait([reply['task']])
+        finally:
+            if not reply['task'].done():
+                reply['task'].cancel()
+            if self.replies_in_flight.get(channel_id) is reply:
+                del self.replies_in_flight[channel_id]
+        if not reply['task'].cancelled() and reply['task'].exception():
+            log_to_file("ERROR", f"Reply task error: {reply['task'].exception()}")
+
+    def _cancel_reply(self, channel_id, reason):
+        """Cancels the reply being prepared in `channel_id` unless it is already being sent."""
+        reply = self.replies_in_flight.get(channel_id)
+        if reply is None or reply['sending'] or reply['reason'] or reply['task'].done():
+            return False
+        reply['reason'] = reason
+        reply['task'].cancel()
+        metrics.replies_cancelled.inc(reason=reason)
+        log_to_file("REPLY_CANCEL", f"Cancelled reply to {reply['message'].id} in {channel_id} ({reason})")
+        return True
+
+    async def _supersede_reply(self, reply, reason, message):
+        """
+        Cancels `reply` because of the newer `message`. If the reply was to a mention or DM
+        and `message` is not one, the original goes back through the burst so that whatever
+        answers the newer messages keeps its urgency instead of facing a random decision.
+        """
+        channel_id = reply['message'].channel.id
+        if not self._cancel_reply(channel_id, reason) or not reply['urgent'] or self._is_urgent(message):
+            return
+        log_to_file("REPLY_CANCEL", f"Carrying urgency of {reply['message'].id} over to the newer messages")
+        if self.burst_window > 0:
+            self._buffer_burst(reply['message'])
+        else:
+            await self._process_burst([reply['message']])
+
+    def _cancel_unfocused_replies(self):
+        for channel_id, reply in list(self.replies_in_flight.items()):
+            if not reply['urgent'] and channel_id != self.current_focus_channel_id:
+                self._cancel_reply(channel_id, 'unfocused')
+
     async def handle_ai_response(self, message):
+        trace = tracer.get(message.id)
+        trace.activate()
+        trace.close('queue_wait')
+        status = 'skipped'
+        last_send = self.last_send_times.get(message.channel.id)
         try:
-            should_respond = await self.decide_to_respond(message)
+            async with trace.span('decide_to_respond'):
+                should_respond = await self.decide_to_respond(message)
             log_to_file("RESPONSE_DECISION", f"Should respond to {message.id}? {should_respond}")
             
             if should_respond:
-                user_id_str = str(message.author.id)
-                conversation_context = list(self.conversation_history.get(user_id_str, []))[-5:]
-                recent_channel_texts = [m['content'] for m in self.recent_messages if m.get('channel') == message.channel.id][-10:]
-                language = await self._detect_language_llm([message.content] + recent_channel_texts)
-                
                 if not self._human_cadence_ok(message.channel.id):
                     log_to_file("CADENCE_SKIP", f"Skip reply cadence in {message.channel.id}")
+                    status = 'cadence_skip'
                     return
                 
-                await self._simulate_human_delay(len(message.content))
-                
-                # Mark as read (removed self-bot .ack())
-                try:
-                    pass
-                except:
-                    pass
-
+                # The human-plausible time to start typing is fixed now and the reply is
+                # prepared meanwhile, so LLM latency hides inside the delay instead of adding to it
+                typing_from = datetime.now() + timedelta(seconds=self._human_delay(len(message.content)))
+                prepared = asyncio.ensure_future(self._prepare_reply(message, trace))
                 try:
-                    log_to_file("LLM_GEN", "Generating response...")
-                    ai_ctx = self._build_ai_context(message, language)
+                    async with trace.span('human_delay', kind=SLEEP):
+                        await self._sleep_until(typing_from, unless=prepared)
+                    if prepared.done() and prepared.result()[1]:
+                        status = prepared.result()[1]
+                        return
                     
                     async with message.channel.typing():
-                        response = await llm_client.generate_response(message.content, ai_ctx)
-                except Exception as llm_error:
-                    print(f"LLM Generation Error: {llm_error}")
-                    await db_manager.save_log('ERROR', f'LLM Generation error: {str(llm_error)}')
-                    return
-
-                if not response:
-                    print("Empty response from LLM")
-                    return
-                
-                try:
-                    response = await llm_client.rewrite_safe_text(response, language)
-                except Exception as mod_err:
-                    log_to_file("MODERATE", f"Rewrite failed: {mod_err}")
-
-                is_safe, reason = self.safety_filter.is_safe(response)
-                if not is_safe:
-                    log_to_file("SAFETY_BLOCK", f"Blocked response: {reason}")
-                    print(f"Safety Block: {reason}")
-                    return
-
-                log_to_file("RESPONSE", f"Generated: {response}")
-                print(f"Response generated: {response[:50]}...")
-                
-                typing_time = len(response) / random.uniform(5.0, 9.0)
-                if typing_time > 0.5:
-                     async with message.channel.typing():
-                        await asyncio.sleep(typing_time)
+                        if not prepared.done():
+                            async with trace.span('reply_wait', kind=WAIT):
+                                await prepared
+                        response, failure = prepared.result()
+                        if failure:
+                            status = failure
+                            return
+                        typing_time = len(response) / random.uniform(5.0, 9.0)
+                        async with trace.span('typing', kind=SLEEP):
+                            await self._sleep_until(typing_from + timedelta(seconds=typing_time))
+                finally:
+                    if not prepared.done():
+                        prepared.cancel()
 
+                reply = self.replies_in_flight.get(message.channel.id)
+                if reply is not None and reply['message'] is message:
+                    # Past this point the reply is sent and recorded even if the conversation moves on
+                    reply['sending'] = True
                 try:
-                    await message.reply(response)
+                    async with trace.span('reply'):
+                        sent = await message.reply(response)
+                        self.context_loader.note(message_data(sent))
                     ch_name = message.channel.name if hasattr(message.channel, 'name') else 'DM'
                     log_to_file("RESPONSE", f"Replied to {message.author.name} in {ch_name}: {response}")
                 except discord.Forbidden:
@@ -571,39 +1006,107 @@ class DiscordAIBot(commands.Bot):
                     print(f"HTTP error replying to message: {http_err}")
                 
                 try:
-                    await db_manager.save_bot_response(
-                        discord_message_id=message.id,
-                        channel_id=message.channel.id,
-                        content=response,
-                        action_type='REPLY',
-                        server_id=message.guild.id if message.guild else None,
-                        is_dm=isinstance(message.channel, discord.DMChannel)
-                    )
-                    
-                    user = await db_manager.get_or_create_user(
-                        message.author.id,
-                        message.author.name,
-                        message.author.display_name,
-                        message.guild.id if message.guild else None,
-                        message.guild.name if message.guild else None
-                    )
-                    
-                    await db_manager.save_interaction(
-                        user_id=user.id,
-                        interaction_type='RESPONSE',
-                        content=f'Replied to: {message.content[:50]}...',
-                        channel_id=message.channel.id,
-                        server_id=message.guild.id if message.guild else None
-                    )
+                    async with trace.span('record_reply'):
+                        await db_manager.record_reply(
+                            discord_message_id=message.id,
+                            channel_id=message.channel.id,
+                            content=response,
+                            author_id=message.author.id,
+                            author_name=message.author.name,
+                            author_display_name=message.author.display_name,
+                            server_id=message.guild.id if message.guild else None,
+                            server_name=message.guild.name if message.guild else None,
+                            is_dm=isinstance(message.channel, discord.DMChannel),
+                            interaction_content=f'Replied to: {message.content[:50]}...'
+                        )
                 except Exception as db_err:
                     print(f"Database error after reply: {db_err}")
                 
                 self.last_action = 'REPLY'
+                status = 'replied'
         
+        except asyncio.CancelledError:
+            reply = self.replies_in_flight.get(message.channel.id)
+            status = reply['reason'] if reply is not None and reply['reason'] else 'cancelled'
+            if reply is None or not reply['sending']:
+                # Nothing was sent, so the reply that replaces this one is not held back by cadence
+                if last_send is None:
+                    self.last_send_times.pop(message.channel.id, None)
+                else:
+                    self.last_send_times[message.channel.id] = last_send
+            raise
         except Exception as e:
+            status = 'error'
             print(f"AI response general error: {e}")
             await db_manager.save_log('ERROR', f'AI response general error: {str(e)}')
+        finally:
+            trace.finish(status)
     
+    async def _prepare_reply(self, message, trace):
+        """
+        Language detection, generation, rewrite and safety check for a reply.
+        Returns (response, None), or (None, status) when there is nothing to send.
+        """
+        recent_channel_texts = [m['content'] for m in self.recent_messages if m.get('channel') == message.channel.id][-10:]
+        async with trace.span('detect_language'):
+            language = await self._detect_language_llm([message.content] + recent_channel_texts, message.channel.id)
+
+        try:
+            log_to_file("LLM_GEN", "Generating response...")
+            if self.summaries:
+                async with trace.span('load_summaries'):
+                    await self._load_summaries([('channel', message.channel.id), ('user', message.author.id)])
+            async with trace.span('build_ai_context'):
+                ai_ctx = self._build_ai_context(message, language)
+            if self.context_search_limit:
+                async with trace.span('search_history'):
+                    ai_ctx['related_history'] = await self._related_history(message)
+            
+            async with trace.span('generate_response'):
+                response = await llm_client.generate_response(message.content, ai_ctx)
+        except Exception as llm_error:
+            print(f"LLM Generation Error: {llm_error}")
+            await db_manager.save_log('ERROR', f'LLM Generation error: {str(llm_error)}')
+            return None, 'llm_error'
+
+        if not response:
+            print("Empty response from LLM")
+            return None, 'empty_response'
+        
+        try:
+            async with trace.span('rewrite_safe_text'):
+                response = await llm_client.rewrite_safe_text(response, language)
+        except Exception as mod_err:
+            log_to_file("MODERATE", f"Rewrite failed: {mod_err}")
+
+        with trace.span('is_safe'):
+            is_safe, reason = self.safety_filter.is_safe(response)
+        if not is_safe:
+            log_to_file("SAFETY_BLOCK", f"Blocked response: {reason}")
+            print(f"Safety Block: {reason}")
+            return None, 'safety_block'
+
+        log_to_file("RESPONSE", f"Generated: {response}")
+        print(f"Response generated: {response[:50]}...")
+        return response, None
+
+    async def _sleep_until(self, deadline, unless=None):
+        """Sleeps until `deadline`; with `unless`, wakes early if that _prepare_reply task finds nothing to send."""
+        remaining = (deadline - datetime.now()).total_seconds()
+        if remaining <= 0:
+            return
+        if unless is None or unless.done():
+            await asyncio.sleep(remaining)
+            return
+        sleeper = asyncio.ensure_future(asyncio.sleep(remaining))
+        try:
+            await asyncio.wait([sleeper, unless], return_when=asyncio.FIRST_COMPLETED)
+            if unless.done() and (unless.cancelled() or unless.exception() or unless.result()[1]):
+                return
+            await sleeper
+        finally:
+            sleeper.cancel()
+
     async def decide_to_respond(self, message) -> bool:
         if isinstance(message.channel, discord.DMChannel):
             return True
@@ -617,7 +1120,7 @@ class DiscordAIBot(commands.Bot):
         
         return False
     
-    async def _simulate_human_delay(self, content_length: int):
+    def _human_delay(self, content_length: int) -> float:
         base_delay = random.uniform(0.5, 2.0)
         reading_time = content_length / random.uniform(15.0, 25.0)
         total_delay = base_delay + reading_time
@@ -625,7 +1128,7 @@ class DiscordAIBot(commands.Bot):
         total_delay = min(total_delay, 10.0)
         
         log_to_file("DELAY", f"Simulating human delay: {total_delay:.2f}s")
-        await asyncio.sleep(total_delay)
+        return total_delay
 
     async def execute_action(self, action_plan: Dict):
         try:
@@ -645,13 +1148,13 @@ class DiscordAIBot(commands.Bot):
                         guild = self.get_guild(self.current_focus_guild_id)
                         if not target_channel or str(target_channel) == "0":
                             if guild:
-                                for channel in guild.text_channels:
-                                    if channel.permissions_for(guild.me).send_messages:
-                                        target_channel = channel.id
-                                        break
+                                channel = self.channel_index.pick(guild)
+                                if channel:
+                                    target_channel = channel.id
                         
                         if target_channel:
                             self.current_focus_channel_id = int(target_channel)
+                            self._cancel_unfocused_replies()
                             
                         self.interest_level = 0.8
                         self.last_stimulus_time = datetime.now()
@@ -700,11 +1203,11 @@ class DiscordAIBot(commands.Bot):
                     'context': 'general chat',
                     'server_name': channel.guild.name if hasattr(channel, 'guild') else '',
                     'suggested_topic': 'casual conversation',
-                    'language': await self._detect_language_llm([m['content'] for m in self.recent_messages if m.get('channel') == channel.id][-10:])
+                    'language': await self._detect_language_llm([m['content'] for m in self.recent_messages if m.get('channel') == channel.id][-10:], channel.id)
                 }
                 message_content = await llm_client.generate_proactive_message(context)
             else:
-                target_lang = await self._detect_language_llm([m['content'] for m in self.recent_messages if m.get('channel') == channel.id][-10:])
+                target_lang = await self._detect_language_llm([m['content'] for m in self.recent_messages if m.get('channel') == channel.id][-10:], channel.id)
                 if target_lang == 'english':
                     if any(ch in message_content for ch in ['à','è','é','ì','ò','ù']) or ' che ' in message_content.lower():
                         context = {
@@ -739,12 +1242,13 @@ class DiscordAIBot(commands.Bot):
                 async with channel.typing():
                     await asyncio.sleep(typing_time)
             
-            await channel.send(message_content)
+            sent = await channel.send(message_content)
+            self.context_loader.note(message_data(sent))
             log_to_file("RESPONSE", f"Sent message in {channel.name}: {message_content}")
             
             await db_manager.save_bot_response(
-                discord_message_id=f'sent_{datetime.now().timestamp()}',
-                channel_id=channel_id,
+                discord_message_id=sent.id,
+                channel_id=channel.id,
                 content=message_content,
                 action_type='SEND',
                 server_id=channel.guild.id if hasattr(channel, 'guild') else None
@@ -801,11 +1305,11 @@ class DiscordAIBot(commands.Bot):
                  async with user.typing():
                     await asyncio.sleep(typing_time)
 
-            await user.send(message_content)
+            sent = await user.send(message_content)
             
             await db_manager.save_bot_response(
-                discord_message_id=f'dm_{datetime.now().timestamp()}',
-                channel_id='DM',
+                discord_message_id=sent.id,
+                channel_id=sent.channel.id,
                 content=message_content,
                 action_type='DM_SEND',
                 is_dm=True
@@ -826,25 +1330,7 @@ class DiscordAIBot(commands.Bot):
             if not channel:
                 return
             
-            async for message in channel.history(limit=20):
-                if message.author == self.user:
-                    continue
-                
-                msg_data = {
-                    'id': message.id,
-                    'author': message.author.id,
-                    'author_name': message.author.name,
-                    'content': message.content,
-                    'channel': message.channel.id,
-                    'channel_name': message.channel.name,
-                    'guild': message.guild.id if message.guild else None,
-                    'guild_name': message.guild.name if message.guild else None,
-                    'is_dm': isinstance(message.channel, discord.DMChannel),
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                if msg_data not in self.recent_messages:
-                    self.recent_messages.append(msg_data)
+            self._merge_into_recent(await self.context_loader.recent(channel, 20, exclude_author=self.user.id))
             
             await db_manager.save_log('READ_MESSAGES', f'Read messages from {channel.name}')
         
@@ -863,10 +1349,19 @@ class DiscordAIBot(commands.Bot):
             'dm_messages': message_stats[1],
             'bot_responses': message_stats[2],
             'servers': len(self.guilds),
-            'active_channels': len(self.active_channels)
+            'active_channels': len(self.active_channels),
+            'replies_cancelled': {dict(key)['reason']: n for key, n in metrics.replies_cancelled.values.items()},
+            'llm_calls_cancelled': {dict(key)['call_type']: n for key, n in metrics.llm_calls_cancelled.values.items()},
+            'loop_offenders': self.loop_monitor.top_offenders()
         }
     
     async def close(self):
+        if self.summaries:
+            await self.summaries.close()
+        await self.save_state()
+        tracer.flush()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
         await db_manager.close()
         await super().close()
 
@@ -879,7 +1374,18 @@ def main():
         log_to_file("FATAL", "DISCORD_BOT_TOKEN missing")
         return
     
-    bot = DiscordAIBot()
+    shard_count = int(os.getenv('SHARD_COUNT', '1') or 1)
+    shard_id = os.getenv('SHARD_ID')
+    if shard_count > 1 and shard_id is None:
+        import sharding
+        sharding.main(shard_count)
+        return
+    
+    if shard_id is not None:
+        bot = DiscordAIBot(shard_id=int(shard_id), shard_count=shard_count)
+        log_to_file("STARTUP", f"Running as shard {shard_id}/{shard_count}")
+    else:
+        bot = DiscordAIBot()
     
     try:
         log_to_file("STARTUP", "Attempting to login with token...")
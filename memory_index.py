@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import os
+import re
+import zlib
+
+from dotenv import load_dotenv
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+load_dotenv(override=True)
+
+_WORD_RE = re.compile(r'\w+')
+
+class HashingEmbedder:
+    """
+    Signed hashed bag of words and character trigrams, L2-normalised. There is no model to
+    load, vectors are stable across processes (crc32, not Python's salted hash), and texts
+    that share words or word pieces (typos, plurals) land close together.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def features(self, text):
+        for word in _WORD_RE.findall(text.lower()):
+            yield word
+            padded = f' {word} '
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3]
+
+    def embed(self, text):
+        hashes = np.fromiter(
+            (zlib.crc32(f.encode('utf-8')) for f in self.features(text or '')), dtype=np.uint32
+        )
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if hashes.size:
+            signs = np.where(hashes >> 31, 1.0, -1.0).astype(np.float32)
+            np.add.at(vector, hashes % self.dim, signs)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+        return vector
+
+class VectorStore:
+    """
+    One scope's vectors as an append-only float32 file read through np.memmap, with the
+    message ids (int64) in a sidecar file. Vectors are written before ids and the row
+    count comes from the ids file, so a reader never sees an id without its vector; a
+    torn append is trimmed on open.
+    """
+
+    def __init__(self, path, dim):
+        self.vectors_path = path + '.f32'
+        self.ids_path = path + '.ids'
+        self.dim = dim
+        self._mapping = None
+        self._trim()
+
+    def _trim(self):
+        row_bytes = self.dim * 4
+        vectors = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        ids = os.path.getsize(self.ids_path) if os.path.exists(self.ids_path) else 0
+        if vectors % row_bytes:
+            raise RuntimeError(f"{self.vectors_path} does not hold {self.dim}-dimensional vectors (MEMORY_DIM changed?)")
+        count = min(vectors // row_bytes, ids // 8)
+        for path, size in ((self.vectors_path, count * row_bytes), (self.ids_path, count * 8)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+
+    def __len__(self):
+        return os.path.getsize(self.ids_path) // 8 if os.path.exists(self.ids_path) else 0
+
+    def append(self, ids, vectors):
+        with open(self.vectors_path, 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.ids_path, 'ab') as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+
+    def _map(self):
+        # Searches run in worker threads: swap the whole (count, vectors, ids) tuple at once
+        count = len(self)
+        mapping = self._mapping
+        if mapping is None or mapping[0] != count:
+            mapping = self._mapping = (
+                count,
+                np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(count, self.dim)),
+                np.memmap(self.ids_path, dtype=np.int64, mode='r', shape=(count,))
+            )
+        return mapping[1], mapping[2]
+
+    def search(self, query, k, block=262144):
+        """Top `k` (message id, cosine score) pairs, scanning the map `block` rows at a time."""
+        if not len(self) or k <= 0:
+            return []
+        matrix, ids = self._map()
+        scores, rows = [], []
+        for start in range(0, len(matrix), block):
+            block_scores = matrix[start:start + block] @ query
+            take = min(k, len(block_scores))
+            top = np.argpartition(-block_scores, take - 1)[:take]
+            scores.append(block_scores[top])
+            rows.append(top + start)
+        scores = np.concatenate(scores)
+        rows = np.concatenate(rows)
+        order = np.argsort(-scores)[:k]
+        return [(int(ids[rows[i]]), float(scores[i])) for i in order]
+
+class VectorMemory:
+    """
+    Long-term memory of stored messages: one VectorStore per guild (and per DM channel)
+    under `directory`. Each shard only writes the scopes of its own guilds, so the
+    files are never appended to by two processes.
+    """
+
+    def __init__(self, directory, dim=256):
+        if np is None:
+            raise RuntimeError("MEMORY_DIR requires numpy (pip install numpy)")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.embedder = HashingEmbedder(dim)
+        self.stores = {}
+
+    @staticmethod
+    def scope(guild_id, channel_id):
+        return f'guild_{guild_id}' if guild_id else f'dm_{channel_id}'
+
+    def store(self, scope):
+        store = self.stores.get(scope)
+        if store is None:
+            store = self.stores[scope] = VectorStore(os.path.join(self.directory, scope), self.embedder.dim)
+        return store
+
+    def add(self, scope, message_id, text):
+        if text and text.strip():
+            self.store(scope).append([message_id], self.embedder.embed(text)[None, :])
+
+    def search(self, scope, text, k):
+        query = self.embedder.embed(text)
+        if not query.any():
+            return []
+        return self.store(scope).search(query, k)
+
+    async def rebuild(self, batch_size=5000, log=print):
+        """Re-embeds every stored message, replacing existing files. Returns vectors written."""
+        from sqlalchemy import select
+        from database import db_manager, Message
+
+        for name in os.listdir(self.directory):
+            if name.endswith(('.f32', '.ids')):
+                os.remove(os.path.join(self.directory, name))
+        self.stores.clear()
+        written = 0
+        last_id = 0
+        while True:
+            async with db_manager.read_session() as session:
+                rows = (await session.execute(
+                    select(Message.id, Message.server_id, Message.channel_id, Message.content)
+                    .where(Message.id > last_id).order_by(Message.id).limit(batch_size)
+                )).all()
+            if not rows:
+                break
+            by_scope = {}
+            for row_id, server_id, channel_id, content in rows:
+                if content and content.strip():
+                    by_scope.setdefault(self.scope(server_id, channel_id), []).append((row_id, content))
+            for scope, items in by_scope.items():
+                vectors = np.stack([self.embedder.embed(content) for _, content in items])
+                self.store(scope).append([row_id for row_id, _ in items], vectors)
+                written += len(items)
+            last_id = rows[-1][0]
+            log(f"  embedded {written} messages (up to id {last_id})")
+        return written
+
+async def run(directory, dim, batch_size):
+    from database import db_manager
+
+    await db_manager.initialize()
+    try:
+        written = await VectorMemory(directory, dim).rebuild(batch_size)
+        print(f"Done: {written} vectors in {directory}")
+    finally:
+        await db_manager.close()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Rebuild the long-term memory vectors from the messages table")
+    parser.add_argument('--dir', default=os.getenv('MEMORY_DIR') or 'memory')
+    parser.add_argument('--dim', type=int, default=int(os.getenv('MEMORY_DIM', '256')))
+    parser.add_argument('--batch-size', type=int, default=5000)
+    return parser
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    asyncio.run(run(args.dir, args.dim, args.batch_size))
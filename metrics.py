@@ -0,0 +1,359 @@
+import asyncio
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_str(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_label_str(key)} {value}")
+        return lines
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['counts'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self.series.items():
+            for bound, count in zip(self.buckets, series['counts']):
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {series['count']}")
+            lines.append(f"{self.name}_sum{_label_str(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_label_str(key)} {series['count']}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+class RateWindow:
+    """Events per second over a sliding window of one-second slots."""
+
+    def __init__(self, window_secs=60):
+        self.window_secs = window_secs
+        self.slots = deque()
+
+    def mark(self, amount=1):
+        now = int(time.monotonic())
+        if self.slots and self.slots[-1][0] == now:
+            self.slots[-1][1] += amount
+        else:
+            self.slots.append([now, amount])
+        self._trim(now)
+
+    def rate(self):
+        self._trim(int(time.monotonic()))
+        return sum(count for _, count in self.slots) / self.window_secs
+
+    def _trim(self, now):
+        while self.slots and self.slots[0][0] <= now - self.window_secs:
+            self.slots.popleft()
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn):
+        """`fn` is called before every scrape to refresh gauges that are computed on demand."""
+        self.collectors.append(fn)
+
+    def render(self):
+        for fn in self.collectors:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+messages_ingested = registry.counter('bot_messages_ingested_total', 'Messages received by on_message')
+messages_rate = RateWindow(60)
+messages_per_second = registry.gauge('bot_messages_ingested_per_second', 'Messages received per second over the last minute')
+queue_depth = registry.gauge('bot_action_queue_depth', 'Items waiting in the action queue by priority')
+queue_age = registry.histogram('bot_action_queue_age_seconds', 'Time items spent in the action queue before being served, by priority')
+queue_discarded = registry.counter('bot_action_queue_discarded_total', 'Action queue items not served, by reason (expired/dropped/merged/deleted)')
+burst_size = registry.histogram('bot_message_burst_size', 'Messages coalesced into one reply decision per channel burst', (1, 2, 3, 5, 8, 13, 21))
+llm_calls_saved = registry.counter('bot_llm_calls_saved_total', 'LLM calls avoided by batching, by call type')
+llm_calls_cancelled = registry.counter('bot_llm_calls_cancelled_total', 'LLM requests aborted in flight because their reply was cancelled, by call type')
+replies_cancelled = registry.counter('bot_replies_cancelled_total', 'Replies abandoned before sending, by reason (superseded/stale/deleted/unfocused)')
+llm_batch_size = registry.histogram('bot_llm_batch_size', 'Texts classified per batched LLM call, by call type', (1, 2, 4, 8, 16, 32))
+llm_latency = registry.histogram('bot_llm_request_seconds', 'LLM request latency by call type')
+llm_errors = registry.counter('bot_llm_errors_total', 'Failed LLM requests by call type')
+cache_requests = registry.counter('bot_cache_requests_total', 'Cache lookups by cache and result (hit/miss)')
+cache_hit_ratio = registry.gauge('bot_cache_hit_ratio', 'Cache hit ratio by cache')
+history_calls = registry.counter('bot_discord_history_calls_total', 'channel.history REST calls made by the context loader')
+db_write_latency = registry.histogram('bot_db_write_seconds', 'Latency of DatabaseManager writes (session commit included) by operation')
+db_write_batch = registry.histogram('bot_db_write_batch_size', 'Writes group-committed together by the SQLite writer', (1, 2, 4, 8, 16, 32, 64, 128, 256))
+loop_lag = registry.gauge('bot_event_loop_lag_seconds', 'Delay of the last event loop lag probe')
+loop_lag_seconds = registry.histogram('bot_event_loop_lag_probe_seconds', 'Distribution of event loop lag probe delays', LAG_BUCKETS)
+loop_stalls = registry.counter('bot_event_loop_stalls_total', 'Times the event loop was blocked longer than the slow-callback threshold')
+slow_callbacks = registry.counter('bot_slow_callbacks_total', 'Callbacks reported by asyncio debug mode as slower than the threshold')
+
+def record_cache(cache, hit):
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+def _refresh_derived():
+    messages_per_second.set(round(messages_rate.rate(), 3))
+    caches = {dict(key)['cache'] for key in cache_requests.values}
+    for cache in caches:
+        hits = cache_requests.get(cache=cache, result='hit')
+        total = hits + cache_requests.get(cache=cache, result='miss')
+        cache_hit_ratio.set(hits / total if total else 0.0, cache=cache)
+
+registry.add_collector(_refresh_derived)
+
+def timed(histogram, **labels):
+    """Decorator for coroutines: observes each call's duration in `histogram`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _blocking_location(frames):
+    """Innermost frame that belongs to this project, falling back to the innermost frame."""
+    for frame in reversed(frames):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(_PROJECT_DIR) and 'site-packages' not in path:
+            return f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+    frame = frames[-1]
+    return f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+
+_CORO_RE = re.compile(r'coro=<(\S+?)\(\) running at ([^>]+)>')
+
+def _callback_key(handle_repr):
+    """Collapses a handle/task repr to "coro() at file:line" so repeats aggregate."""
+    match = _CORO_RE.search(handle_repr)
+    if match:
+        return f"{match.group(1)}() at {os.path.basename(match.group(2))}"
+    return handle_repr[:120]
+
+class _SlowCallbackHandler(logging.Handler):
+    """Picks up asyncio debug mode's "Executing <Handle ...> took N seconds" warnings."""
+
+    def __init__(self, monitor):
+        super().__init__(logging.WARNING)
+        self.monitor = monitor
+
+    def emit(self, record):
+        if record.msg.startswith('Executing') and len(record.args or ()) == 2:
+            self.monitor._record(self.monitor.callbacks, _callback_key(str(record.args[0])), float(record.args[1]))
+            slow_callbacks.inc()
+
+class LoopMonitor:
+    """
+    Samples event loop lag and finds the code that blocks the loop.
+
+    `run()` probes the loop every `interval` seconds and feeds the lag gauge and histogram.
+    A watchdog thread checks the probe's heartbeat: if the loop has not come back more than
+    `threshold` seconds after it should have, it captures the loop thread's stack, so the
+    blocking synchronous code is named without asyncio debug mode. With `debug=True` the loop
+    also runs in asyncio debug mode, whose slow-callback warnings are aggregated per callback.
+    The top offenders are logged every `report_interval` seconds.
+    """
+
+    def __init__(self, threshold=0.1, interval=0.25, report_interval=300, top_n=5, debug=False, log=print):
+        self.threshold = threshold
+        self.interval = interval
+        self.report_interval = report_interval
+        self.top_n = top_n
+        self.debug = debug
+        self.log = log
+        self.offenders = {}
+        self.callbacks = {}
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._captured = None
+        self._loop_thread = None
+        self._stop = threading.Event()
+
+    def _record(self, table, key, duration, stack=None):
+        with self._lock:
+            entry = table.get(key)
+            if entry is None:
+                entry = table[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'stack': stack}
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            return entry['count'] == 1
+
+    def _watchdog(self):
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            if heartbeat is None or heartbeat == self._captured:
+                continue
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            frames = traceback.extract_stack(frame)
+            location = _blocking_location(frames)
+            self._captured = heartbeat
+            loop_stalls.inc()
+            stack = ''.join(traceback.format_list(frames[-8:]))
+            if self._record(self.offenders, location, blocked, stack):
+                self.log(f"Event loop blocked for >{blocked:.3f}s at {location}\n{stack}")
+
+    def top_offenders(self):
+        with self._lock:
+            stalls = sorted(self.offenders.items(), key=lambda kv: kv[1]['total'], reverse=True)[:self.top_n]
+            slow = sorted(self.callbacks.items(), key=lambda kv: kv[1]['total'], reverse=True)[:self.top_n]
+        return [
+            {'kind': kind, 'where': key, 'count': e['count'], 'total_s': round(e['total'], 3), 'max_s': round(e['max'], 3)}
+            for kind, items in (('stall', stalls), ('slow_callback', slow)) for key, e in items
+        ]
+
+    def report(self):
+        offenders = self.top_offenders()
+        if not offenders:
+            return
+        lines = [f"Top event loop offenders (threshold {self.threshold * 1000:.0f}ms):"]
+        for o in offenders:
+            lines.append(f"  [{o['kind']}] {o['where']}: {o['count']}x, total {o['total_s']}s, max {o['max_s']}s")
+        self.log('\n'.join(lines))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        handler = None
+        if self.debug:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+            handler = _SlowCallbackHandler(self)
+            logging.getLogger('asyncio').addHandler(handler)
+        if self.threshold > 0:
+            threading.Thread(target=self._watchdog, name='loop-watchdog', daemon=True).start()
+        last_report = loop.time()
+        try:
+            while True:
+                start = loop.time()
+                self._heartbeat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - start - self.interval)
+                loop_lag.set(round(lag, 6))
+                loop_lag_seconds.observe(lag)
+                if loop.time() - last_report >= self.report_interval:
+                    self.report()
+                    last_report = loop.time()
+        finally:
+            self._stop.set()
+            if handler:
+                logging.getLogger('asyncio').removeHandler(handler)
+
+async def start_metrics_server(host, port, stats_provider=None):
+    """
+    Serves /metrics (Prometheus text format) and, if `stats_provider` is given, /stats (JSON).
+    Returns the aiohttp runner so the caller can clean it up on shutdown.
+    """
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def handle_stats(request):
+        return web.json_response(await stats_provider())
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    if stats_provider:
+        app.router.add_get('/stats', handle_stats)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
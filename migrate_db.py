@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import MetaData, select, insert, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import Base, Guild, Channel, is_legacy_schema, snowflake
+
+# Parents before children so foreign keys hold on databases that enforce them
+TABLE_ORDER = (
+    'users', 'messages', 'bot_responses', 'interactions', 'social_test_logs',
+    'stats_counters', 'stats_hourly', 'user_stats', 'archive_catalog', 'bot_state'
+)
+SNOWFLAKE_COLUMNS = ('discord_id', 'discord_message_id', 'channel_id', 'server_id')
+
+class Dimensions:
+    """Guild and channel names collected from legacy rows; later rows (higher ids) win."""
+
+    def __init__(self):
+        self.guilds = {}
+        self.channels = {}
+
+    def note(self, row):
+        guild_id = snowflake(row.get('server_id'))
+        if guild_id and row.get('server_name'):
+            self.guilds[guild_id] = row['server_name']
+        channel_id = snowflake(row.get('channel_id'))
+        if channel_id and row.get('channel_name'):
+            self.channels[channel_id] = (row['channel_name'], guild_id)
+
+def convert_row(table_name, row, dims):
+    """Maps one legacy row to the current schema, recording its names in `dims`."""
+    row = dict(row)
+    dims.note(row)
+    for column in SNOWFLAKE_COLUMNS:
+        if column in row:
+            row[column] = snowflake(row[column])
+    if table_name == 'stats_hourly':
+        row['server_id'] = row['server_id'] or 0
+    elif table_name == 'bot_responses' and row['discord_message_id'] is None:
+        # 'sent_<ts>' / 'dm_<ts>' placeholders from before sends stored the real message id
+        row['discord_message_id'] = -row['id']
+    return row
+
+def _sqlite_path(url):
+    if url.startswith('sqlite') and ':///' in url:
+        return url.split(':///', 1)[1]
+    return None
+
+def _engine(url):
+    return create_async_engine(url, echo=False, poolclass=NullPool)
+
+async def copy_database(source_url, target_url, batch_size=5000, dims=None, log=print, full_schema=True):
+    """
+    Streams every table of a legacy database into a new one with the current schema,
+    `batch_size` rows per read and per committed insert. Returns {table_name: rows_copied}
+    and the Dimensions seen, or (None, dims) if the source is not a legacy database.
+    With full_schema=False (archive files) only the tables the source has are created.
+    """
+    dims = dims or Dimensions()
+    source = _engine(source_url)
+    target = _engine(target_url)
+    try:
+        async with source.connect() as conn:
+            if not await conn.run_sync(is_legacy_schema):
+                return None, dims
+            legacy = MetaData()
+            # Archive files hold messages without the users table their foreign keys name
+            await conn.run_sync(lambda sync_conn: legacy.reflect(sync_conn, resolve_fks=False))
+
+        async with target.begin() as conn:
+            if target.dialect.name == 'sqlite':
+                await conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            tables = None if full_schema else [Base.metadata.tables[n] for n in TABLE_ORDER if n in legacy.tables]
+            await conn.run_sync(lambda sync_conn: Base.metadata.create_all(sync_conn, tables=tables))
+
+        copied = {}
+        for name in TABLE_ORDER:
+            if name not in legacy.tables:
+                continue
+            source_table = legacy.tables[name]
+            target_table = Base.metadata.tables[name]
+            columns = set(target_table.c.keys())
+            copied[name] = 0
+            started = time.perf_counter()
+            async with source.connect() as conn:
+                query = select(source_table).order_by(*source_table.primary_key.columns)
+                result = await conn.stream(query.execution_options(yield_per=batch_size))
+                async for chunk in result.partitions(batch_size):
+                    rows = []
+                    for row in chunk:
+                        converted = convert_row(name, row._mapping, dims)
+                        rows.append({k: v for k, v in converted.items() if k in columns})
+                    async with target.begin() as out:
+                        await out.execute(insert(target_table), rows)
+                    copied[name] += len(rows)
+            log(f"  {name}: {copied[name]} rows ({time.perf_counter() - started:.1f}s)")
+
+        if target.dialect.name == 'postgresql':
+            # Rows kept their ids, so move each serial sequence past them
+            async with target.begin() as conn:
+                for name in copied:
+                    table = Base.metadata.tables[name]
+                    if 'id' in table.c and table.c.id.autoincrement is not False:
+                        await conn.execute(text(
+                            f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE(MAX(id), 1)) FROM {name}"
+                        ))
+        return copied, dims
+    finally:
+        await source.dispose()
+        await target.dispose()
+
+async def write_dimensions(url, dims, overwrite=True):
+    """Stores collected names in the guilds/channels tables; with overwrite=False existing names are kept."""
+    engine = _engine(url)
+    now = datetime.utcnow()
+    try:
+        async with engine.begin() as conn:
+            for model, values in (
+                (Guild, [{'id': gid, 'name': name, 'updated_at': now} for gid, name in dims.guilds.items()]),
+                (Channel, [{'id': cid, 'name': name, 'guild_id': gid, 'updated_at': now}
+                           for cid, (name, gid) in dims.channels.items()])
+            ):
+                if not values:
+                    continue
+                if engine.dialect.name == 'postgresql':
+                    from sqlalchemy.dialects.postgresql import insert as dialect_insert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert as dialect_insert
+                stmt = dialect_insert(model.__table__)
+                if overwrite:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=['id'], set_={c: stmt.excluded[c] for c in values[0] if c != 'id'}
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=['id'])
+                for offset in range(0, len(values), 5000):
+                    await conn.execute(stmt, values[offset:offset + 5000])
+    finally:
+        await engine.dispose()
+
+async def _archive_paths(url):
+    engine = _engine(url)
+    try:
+        async with engine.connect() as conn:
+            rows = await conn.execute(text("SELECT DISTINCT path FROM archive_catalog"))
+            return [row[0] for row in rows]
+    except Exception:
+        return []
+    finally:
+        await engine.dispose()
+
+async def migrate_sqlite_in_place(path, batch_size=5000, dims=None, log=print, full_schema=True):
+    """
+    Converts a SQLite file by copying it to `<path>.migrating` and swapping the copy in;
+    the original is kept as `<path>.pre-migration`. Returns (copied, dims, size_before, size_after).
+    """
+    tmp = path + '.migrating'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    copied, dims = await copy_database(
+        f'sqlite+aiosqlite:///{path}', f'sqlite+aiosqlite:///{tmp}', batch_size, dims, log, full_schema
+    )
+    if copied is None:
+        return None, dims, None, None
+    size_before, size_after = os.path.getsize(path), os.path.getsize(tmp)
+    os.replace(path, path + '.pre-migration')
+    os.replace(tmp, path)
+    return copied, dims, size_before, size_after
+
+def _fmt_size(size):
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+async def run(source_url, target_url=None, batch_size=5000):
+    path = _sqlite_path(source_url)
+    if target_url is None and path is None:
+        raise SystemExit("In-place migration is only supported for SQLite; pass --target for other databases")
+
+    print(f"Migrating {source_url}")
+    if target_url is None:
+        archives = await _archive_paths(source_url)
+        copied, dims, before, after = await migrate_sqlite_in_place(path, batch_size)
+        if copied is None:
+            print("Already on the current schema, nothing to do.")
+            return
+        print(f"Size: {_fmt_size(before)} -> {_fmt_size(after)} ({(after - before) / before:+.1%}); "
+              f"original kept at {path}.pre-migration")
+        await write_dimensions(source_url, dims)
+
+        for archive in archives:
+            if not os.path.exists(archive):
+                continue
+            print(f"Migrating archive {archive}")
+            archive_dims = Dimensions()
+            copied, archive_dims, before, after = await migrate_sqlite_in_place(
+                archive, batch_size, archive_dims, full_schema=False
+            )
+            if copied is None:
+                continue
+            print(f"Size: {_fmt_size(before)} -> {_fmt_size(after)}")
+            # Names of archived rows go to the live DB, without replacing newer ones
+            await write_dimensions(source_url, archive_dims, overwrite=False)
+    else:
+        copied, dims = await copy_database(source_url, target_url, batch_size)
+        if copied is None:
+            print("Already on the current schema, nothing to do.")
+            return
+        await write_dimensions(target_url, dims)
+        source_path, target_path = path, _sqlite_path(target_url)
+        if source_path and target_path:
+            before, after = os.path.getsize(source_path), os.path.getsize(target_path)
+            print(f"Size: {_fmt_size(before)} -> {_fmt_size(after)} ({(after - before) / before:+.1%})")
+    print(f"Done: {len(dims.guilds)} guilds, {len(dims.channels)} channels")
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Convert a database from string snowflake IDs to integer IDs with guild/channel dimension tables"
+    )
+    parser.add_argument('--source', default=os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///discord_bot.db'),
+                        help="Database to convert (default: DATABASE_URL)")
+    parser.add_argument('--target', help="Write the converted copy here instead of replacing a SQLite source in place")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    return parser
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    asyncio.run(run(args.source, args.target, args.batch_size))
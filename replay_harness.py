@@ -0,0 +1,693 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+import time
+from datetime import datetime
+
+# The bot modules build their LLM client at import time; make sure that works without real keys.
+os.environ.setdefault('LLM_PROVIDER', 'glm')
+os.environ.setdefault('GLM_API_KEY', 'replay')
+
+import discord
+import httpx
+
+import discord_bot
+import metrics
+from database import db_manager
+from LLM_Client import llm_client
+from sharding import shard_for_guild
+
+# ---------------------------------------------------------------------------
+# Virtual time: the bot module sees a clock that runs 1/scale times faster than
+# the wall clock, so human-delay sleeps, cadence checks and interest decay keep
+# their relative behaviour while the run finishes in a fraction of the time.
+# ---------------------------------------------------------------------------
+
+class VirtualClock:
+    def __init__(self, scale):
+        self.scale = scale
+        self.real_start = time.monotonic()
+        self.virtual_start = datetime.now()
+
+    def elapsed(self):
+        return (time.monotonic() - self.real_start) / self.scale if self.scale else 0.0
+
+    def now(self):
+        from datetime import timedelta
+        return self.virtual_start + timedelta(seconds=self.elapsed())
+
+class _AsyncioShim:
+    def __init__(self, clock):
+        self._clock = clock
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    async def sleep(self, delay, result=None):
+        return await asyncio.sleep(max(0.0, delay) * self._clock.scale, result)
+
+def _make_virtual_datetime(clock):
+    class VirtualDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock.now()
+    return VirtualDatetime
+
+# ---------------------------------------------------------------------------
+# Fake discord objects
+# ---------------------------------------------------------------------------
+
+class _Permissions:
+    read_messages = True
+    send_messages = True
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+# IDs for messages the bot sends; offset by pid so shard processes don't collide in the shared DB
+_sent_message_ids = itertools.count(2 * 10**15 + os.getpid() * 10**6)
+
+class FakeUser:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = False
+        self.sent = []
+
+    def mentioned_in(self, message):
+        return self in message.mentions
+
+    def typing(self):
+        return _Typing()
+
+    async def send(self, content):
+        self.sent.append(content)
+        return FakeMessage(next(_sent_message_ids), None, content, FakeDMChannel(self.id * 7, self, None), None)
+
+    def __str__(self):
+        return self.name
+
+class FakeGuild:
+    def __init__(self, guild_id, name, me):
+        self.id = guild_id
+        self.name = name
+        self.me = me
+        self.text_channels = []
+
+class FakeTextChannel:
+    def __init__(self, channel_id, name, guild, stats):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.messages = []
+        self.stats = stats
+
+    def permissions_for(self, member):
+        return _Permissions()
+
+    def typing(self):
+        return _Typing()
+
+    @property
+    def last_message_id(self):
+        return self.messages[-1].id if self.messages else None
+
+    async def history(self, limit=100, after=None):
+        self.stats['history_calls'] += 1
+        messages = [m for m in self.messages if after is None or m.id > after.id]
+        for message in reversed(messages[-limit:]):
+            yield message
+
+    async def send(self, content):
+        self.stats['sends'] += 1
+        return FakeMessage(next(_sent_message_ids), self.guild.me, content, self, self.guild)
+
+    def __str__(self):
+        return self.name
+
+class FakeDMChannel(discord.DMChannel):
+    def __init__(self, channel_id, recipient, stats):
+        self.id = channel_id
+        self.recipients = [recipient]
+        self.me = None
+        self.messages = []
+        self.stats = stats
+
+    def typing(self):
+        return _Typing()
+
+    @property
+    def last_message_id(self):
+        return self.messages[-1].id if self.messages else None
+
+    async def history(self, limit=100, after=None):
+        self.stats['history_calls'] += 1
+        messages = [m for m in self.messages if after is None or m.id > after.id]
+        for message in reversed(messages[-limit:]):
+            yield message
+
+    async def send(self, content):
+        self.stats['sends'] += 1
+        return FakeMessage(next(_sent_message_ids), None, content, self, None)
+
+class FakeMessage:
+    def __init__(self, message_id, author, content, channel, guild, mentions=None, stats=None):
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.guild = guild
+        self.mentions = mentions or []
+        self.stats = stats
+
+    async def reply(self, content):
+        if self.stats is not None:
+            self.stats['replies'] += 1
+            self.stats['reply_latency'].append(self.stats['clock'].elapsed() - self.received_at)
+
+    async def delete(self):
+        pass
+
+class ReplayBot(discord_bot.DiscordAIBot):
+    def __init__(self, world):
+        super().__init__()
+        self.world = world
+        self.in_flight = 0
+
+    @property
+    def user(self):
+        return self.world.bot_user
+
+    @property
+    def guilds(self):
+        return list(self.world.guilds.values())
+
+    def get_guild(self, guild_id):
+        return self.world.guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        return self.world.channels.get(channel_id)
+
+    def get_user(self, user_id):
+        return self.world.users.get(user_id)
+
+    async def change_presence(self, **kwargs):
+        pass
+
+    async def _process_burst(self, messages):
+        self.in_flight += 1
+        try:
+            await super()._process_burst(messages)
+        finally:
+            self.in_flight -= 1
+
+    async def handle_ai_response(self, message):
+        self.in_flight += 1
+        try:
+            await super().handle_ai_response(message)
+        finally:
+            self.in_flight -= 1
+
+    async def execute_action(self, action_plan):
+        self.in_flight += 1
+        try:
+            await super().execute_action(action_plan)
+        finally:
+            self.in_flight -= 1
+
+class World:
+    def __init__(self, clock):
+        self.bot_user = FakeUser(1, 'replay_bot')
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+        self.stats = {
+            'replies': 0, 'sends': 0, 'history_calls': 0,
+            'reply_latency': [], 'clock': clock
+        }
+        self._next_message_id = 10**15
+
+    def user(self, user_id, name=None):
+        if user_id not in self.users:
+            self.users[user_id] = FakeUser(user_id, name or f'user{user_id}')
+        return self.users[user_id]
+
+    def guild(self, guild_id):
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = FakeGuild(guild_id, f'guild{guild_id}', self.bot_user)
+        return self.guilds[guild_id]
+
+    def channel(self, channel_id, guild_id=None, name=None, dm_user=None):
+        if channel_id not in self.channels:
+            if guild_id is None:
+                self.channels[channel_id] = FakeDMChannel(channel_id, dm_user, self.stats)
+            else:
+                guild = self.guild(guild_id)
+                channel = FakeTextChannel(channel_id, name or f'channel{channel_id}', guild, self.stats)
+                guild.text_channels.append(channel)
+                self.channels[channel_id] = channel
+        return self.channels[channel_id]
+
+    def message(self, event):
+        author = self.user(event['author'], event.get('author_name'))
+        guild = None if event.get('dm') else self.guild(event['guild'])
+        channel = self.channel(event['channel'], None if event.get('dm') else event['guild'],
+                               event.get('channel_name'), author)
+        message_id = event.get('id')
+        if message_id is None:
+            self._next_message_id += 1
+            message_id = self._next_message_id
+        mentions = [self.bot_user] if event.get('mention') else []
+        message = FakeMessage(message_id, author, event['content'], channel, guild, mentions, self.stats)
+        channel.messages.append(message)
+        return message
+
+# ---------------------------------------------------------------------------
+# Message traces
+# ---------------------------------------------------------------------------
+
+SYNTHETIC_LINES = [
+    "anyone tried the new update?", "lol that's wild", "can someone help me with my config",
+    "this code doesn't work and I have no idea why", "gm everyone", "what are you all playing tonight",
+    "is the api down for anyone else?", "check this out https://example.com/post", "nah I disagree tbh",
+    "how do you set up the workflow for that", "haha same", "any recommendations for a good keyboard?"
+]
+
+def synthetic_trace(count, rate, guilds=2, channels=4, users=50, dm_ratio=0.05, mention_ratio=0.05, seed=1234):
+    rng = random.Random(seed)
+    offset = 0.0
+    events = []
+    for _ in range(count):
+        offset += rng.expovariate(rate)
+        # Snowflake-shaped so shard_for_guild spreads guilds across shards
+        guild = (rng.randrange(guilds) + 100) << 22
+        channel = guild * 1000 + rng.randrange(channels)
+        author = rng.randrange(users) + 10_000
+        dm = rng.random() < dm_ratio
+        events.append({
+            'offset': offset,
+            'guild': None if dm else guild,
+            'channel': author * 7 if dm else channel,
+            'author': author,
+            'content': rng.choice(SYNTHETIC_LINES),
+            'dm': dm,
+            'mention': (not dm) and rng.random() < mention_ratio
+        })
+    return events
+
+def load_trace(path):
+    """
+    Reads a JSONL trace. Accepts the harness format (offset/guild/channel/author/content)
+    or rows of `data_export.py --tables messages --format jsonl`, whose authors are taken
+    from `discord_id` rather than the internal `user_id`.
+    """
+    events = []
+    first_ts = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if 'offset' not in row:
+                ts = datetime.fromisoformat(row['timestamp'])
+                first_ts = first_ts or ts
+                row = {
+                    'offset': (ts - first_ts).total_seconds(),
+                    'guild': int(row['server_id']) if row.get('server_id') else None,
+                    'channel': int(row['channel_id']),
+                    'channel_name': row.get('channel_name'),
+                    'author': int(row['discord_id']),
+                    'content': row['content'],
+                    'dm': bool(row.get('is_dm')),
+                    'id': int(row['discord_message_id']) if str(row.get('discord_message_id', '')).isdigit() else None
+                }
+            events.append(row)
+    events.sort(key=lambda e: e['offset'])
+    return events
+
+# ---------------------------------------------------------------------------
+# Stub OpenAI-compatible LLM server
+# ---------------------------------------------------------------------------
+
+class StubLLMServer:
+    def __init__(self, latency_ms=300.0, latency_sigma=0.5, error_rate=0.0, suspicion_rate=0.02, seed=1234):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.suspicion_rate = suspicion_rate
+        self.rng = random.Random(seed)
+        self.calls = {}
+        self.prompt_chars = {}
+        self.errors = 0
+        self.runner = None
+        self.url = None
+
+    @staticmethod
+    def classify(messages):
+        system = messages[0]['content'] if messages else ''
+        if 'numbered messages' in system:
+            return 'suspicion_batch'
+        if 'social engineering expert' in system:
+            return 'suspicion'
+        if 'Detect the language' in system:
+            return 'detect_language'
+        if 'You plan actions' in system:
+            return 'plan'
+        if 'Rewrite the following message' in system:
+            return 'rewrite'
+        if 'running summary' in system:
+            return 'summary'
+        if 'Generate a natural message' in (messages[-1]['content'] if messages else ''):
+            return 'proactive_message'
+        return 'generate_response'
+
+    def _answer(self, call_type, messages):
+        if call_type == 'suspicion':
+            return 'TRUE' if self.rng.random() < self.suspicion_rate else 'FALSE'
+        if call_type == 'suspicion_batch':
+            count = len(messages[-1]['content'].splitlines())
+            return json.dumps([self.rng.random() < self.suspicion_rate for _ in range(count)])
+        if call_type == 'detect_language':
+            return 'english'
+        if call_type == 'rewrite':
+            return messages[-1]['content']
+        if call_type == 'summary':
+            return 'people are comparing the new build, a few hit the same crash after updating'
+        if call_type == 'plan':
+            focus = re.search(r'Focus: (\d+)', messages[-1]['content'])
+            action = self.rng.choice(['wait', 'wait', 'chat', 'send'])
+            return json.dumps({
+                'action': action,
+                'target_channel': focus.group(1) if focus else None,
+                'message': 'yeah that update broke my setup too',
+                'reason': 'replay',
+                'confidence': 0.8
+            })
+        return 'lol yeah, did you try the new build? it fixed that for me'
+
+    async def start(self, host='127.0.0.1', port=0):
+        from aiohttp import web
+
+        async def handle(request):
+            body = await request.json()
+            call_type = self.classify(body.get('messages', []))
+            self.calls[call_type] = self.calls.get(call_type, 0) + 1
+            self.prompt_chars[call_type] = self.prompt_chars.get(call_type, 0) + sum(
+                len(m.get('content') or '') for m in body.get('messages', [])
+            )
+            await asyncio.sleep(self.rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000.0)
+            if self.rng.random() < self.error_rate:
+                self.errors += 1
+                return web.json_response({'error': 'stub failure'}, status=500)
+            content = self._answer(call_type, body.get('messages', []))
+            return web.json_response({'choices': [{'message': {'role': 'assistant', 'content': content}}]})
+
+        app = web.Application()
+        app.router.add_post('/chat/completions', handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+def _point_llm_client_at(url):
+    llm_client.provider = 'glm'
+    llm_client.base_url = url
+    llm_client.api_key = 'replay'
+    llm_client.model = 'replay-stub'
+    llm_client.summary_model = None
+    llm_client.http_client = httpx.AsyncClient(timeout=60.0)
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def _db_write_counts():
+    return {dict(key).get('op'): series['count'] for key, series in metrics.db_write_latency.series.items()}
+
+def _remove_sqlite_file(database_url):
+    if database_url.startswith('sqlite') and ':///' in database_url:
+        path = database_url.split(':///', 1)[1]
+        for suffix in ('', '-wal', '-shm'):
+            if path and os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+async def run_replay(events, time_scale=0.01, database_url='sqlite+aiosqlite:///replay.db',
+                     llm_latency_ms=300.0, llm_error_rate=0.0, suspicion_rate=0.02,
+                     sample_interval=0.1, drain_timeout=120.0, with_planner=True, seed=1234,
+                     reset_database=True):
+    random.seed(seed)
+    clock = VirtualClock(time_scale)
+    discord_bot.asyncio = _AsyncioShim(clock)
+    discord_bot.datetime = _make_virtual_datetime(clock)
+
+    if reset_database:
+        _remove_sqlite_file(database_url)
+    await db_manager.reconfigure(database_url)
+
+    stub = StubLLMServer(llm_latency_ms, error_rate=llm_error_rate, suspicion_rate=suspicion_rate, seed=seed)
+    _point_llm_client_at(await stub.start())
+    writes_before = _db_write_counts()
+
+    world = World(clock)
+    bot = ReplayBot(world)
+    bot.action_queue.clock = clock.elapsed
+    bot.context_loader.fetcher.min_interval *= time_scale
+    discarded_before = dict(metrics.queue_discarded.values)
+    saved_before = dict(metrics.llm_calls_saved.values)
+    cancelled_before = dict(metrics.replies_cancelled.values)
+    llm_cancelled_before = dict(metrics.llm_calls_cancelled.values)
+    await db_manager.initialize()
+    for event in events:
+        if not event.get('dm'):
+            world.channel(event['channel'], event['guild'], event.get('channel_name'))
+    if events:
+        first = next((e for e in events if not e.get('dm')), None)
+        if first:
+            bot.current_focus_guild_id = first['guild']
+            bot.current_focus_channel_id = first['channel']
+            bot.interest_level = 0.8
+
+    background = [asyncio.create_task(bot.process_action_queue())]
+    if with_planner:
+        background.append(asyncio.create_task(bot.action_planner()))
+
+    queue_samples = []
+    async def sample_queue():
+        while True:
+            queue_samples.append((round(clock.elapsed(), 2), bot.action_queue.qsize()))
+            await asyncio.sleep(sample_interval)
+    background.append(asyncio.create_task(sample_queue()))
+
+    real_start = time.monotonic()
+    handlers = []
+    for event in events:
+        delay = event['offset'] * time_scale - (time.monotonic() - real_start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        message = world.message(event)
+        message.received_at = clock.elapsed()
+        handlers.append(asyncio.create_task(bot.on_message(message)))
+    ingest_seconds = time.monotonic() - real_start
+
+    if handlers:
+        await asyncio.gather(*handlers)
+    deadline = time.monotonic() + drain_timeout
+    while (bot.action_queue.qsize() or bot.in_flight or bot.bursts) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    total_seconds = time.monotonic() - real_start
+
+    # Bare excepts around LLM calls can swallow a cancellation, so keep cancelling until done
+    pending = set(background)
+    while pending:
+        for task in pending:
+            task.cancel()
+        _, pending = await asyncio.wait(pending, timeout=0.5)
+    if bot.summaries:
+        await bot.summaries.close()
+    await stub.stop()
+    await llm_client.http_client.aclose()
+    await db_manager.close()
+
+    writes = {op: count - writes_before.get(op, 0) for op, count in _db_write_counts().items()}
+    n = len(events) or 1
+    llm_total = sum(stub.calls.values())
+    depths = [depth for _, depth in queue_samples]
+    latencies = world.stats['reply_latency']
+    return {
+        'messages': len(events),
+        'replies': world.stats['replies'],
+        'sends': world.stats['sends'],
+        'history_calls': world.stats['history_calls'],
+        'real_seconds': round(total_seconds, 3),
+        'virtual_seconds': round(clock.elapsed(), 1),
+        'time_scale': time_scale,
+        'ingest_throughput_msgs_per_sec': round(len(events) / ingest_seconds, 2) if ingest_seconds else None,
+        'end_to_end_msgs_per_sec': round(len(events) / total_seconds, 2) if total_seconds else None,
+        'llm_calls': llm_total,
+        'llm_calls_per_message': round(llm_total / n, 3),
+        'llm_calls_by_type': stub.calls,
+        'llm_prompt_chars_by_type': stub.prompt_chars,
+        'llm_calls_saved': {
+            dict(key)['call_type']: count - saved_before.get(key, 0)
+            for key, count in metrics.llm_calls_saved.values.items()
+        },
+        'llm_errors': stub.errors,
+        'db_writes': sum(writes.values()),
+        'db_writes_per_message': round(sum(writes.values()) / n, 3),
+        'db_writes_by_op': writes,
+        'reply_latency_virtual_secs': {
+            'p50': round(_percentile(latencies, 0.5), 2),
+            'p95': round(_percentile(latencies, 0.95), 2),
+            'max': round(max(latencies), 2) if latencies else 0.0
+        },
+        'queue_depth': {
+            'max': max(depths) if depths else 0,
+            'mean': round(sum(depths) / len(depths), 2) if depths else 0,
+            'samples': queue_samples
+        },
+        'queue_discarded': {
+            dict(key)['reason']: count - discarded_before.get(key, 0)
+            for key, count in metrics.queue_discarded.values.items()
+        },
+        'replies_cancelled': {
+            dict(key)['reason']: count - cancelled_before.get(key, 0)
+            for key, count in metrics.replies_cancelled.values.items()
+        },
+        'llm_calls_cancelled': {
+            dict(key)['call_type']: count - llm_cancelled_before.get(key, 0)
+            for key, count in metrics.llm_calls_cancelled.values.items()
+        }
+    }
+
+def _replay_shard(job):
+    shard_id, events, kwargs = job
+    report = asyncio.run(run_replay(events, reset_database=False, **kwargs))
+    report['shard'] = shard_id
+    return report
+
+async def _prepare_shared_database(database_url):
+    _remove_sqlite_file(database_url)
+    await db_manager.reconfigure(database_url)
+    await db_manager.initialize()
+    await db_manager.close()
+
+def _merge_reports(reports):
+    merged = {'shards': len(reports), 'per_shard': reports}
+    for key in ('messages', 'replies', 'sends', 'history_calls', 'llm_calls', 'llm_errors', 'db_writes'):
+        merged[key] = sum(r[key] for r in reports)
+    for key in ('llm_calls_by_type', 'llm_prompt_chars_by_type', 'llm_calls_saved', 'db_writes_by_op', 'queue_discarded',
+                'replies_cancelled', 'llm_calls_cancelled'):
+        totals = {}
+        for r in reports:
+            for name, count in r[key].items():
+                totals[name] = totals.get(name, 0) + count
+        merged[key] = totals
+    # Shards run side by side, so wall time is the slowest one
+    merged['real_seconds'] = max(r['real_seconds'] for r in reports)
+    merged['end_to_end_msgs_per_sec'] = round(merged['messages'] / merged['real_seconds'], 2) if merged['real_seconds'] else None
+    n = merged['messages'] or 1
+    merged['llm_calls_per_message'] = round(merged['llm_calls'] / n, 3)
+    merged['db_writes_per_message'] = round(merged['db_writes'] / n, 3)
+    merged['reply_latency_virtual_secs'] = {'max': max(r['reply_latency_virtual_secs']['max'] for r in reports)}
+    merged['queue_depth'] = {'max': max(r['queue_depth']['max'] for r in reports)}
+    return merged
+
+def run_sharded_replay(events, shards, database_url='sqlite+aiosqlite:///replay.db', **kwargs):
+    """
+    Splits the trace the way Discord routes a guild's events (see sharding.shard_for_guild) and
+    replays each part in its own process, all writing to one shared database like the
+    supervisor's workers do. Returns a combined report with the per-shard ones under 'per_shard'.
+    """
+    os.environ.setdefault('DB_JOURNAL_MODE', 'WAL')
+    asyncio.run(_prepare_shared_database(database_url))
+    parts = {i: [] for i in range(shards)}
+    for index, event in enumerate(events, 1):
+        if event.get('id') is None:
+            # Number messages across the whole trace, as one World would, so shards don't collide
+            event = dict(event, id=10**15 + index)
+        parts[shard_for_guild(None if event.get('dm') else event['guild'], shards)].append(event)
+    kwargs['database_url'] = database_url
+    jobs = [(i, part, kwargs) for i, part in parts.items()]
+    with multiprocessing.get_context('spawn').Pool(shards) as pool:
+        reports = pool.map(_replay_shard, jobs)
+    return _merge_reports(reports)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Replay a message trace through DiscordAIBot without Discord or a real LLM")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--trace', help="JSONL trace (harness format or data_export messages JSONL)")
+    source.add_argument('--synthetic', type=int, default=200, help="Number of synthetic messages (default 200)")
+    parser.add_argument('--rate', type=float, default=2.0, help="Synthetic messages per virtual second")
+    parser.add_argument('--guilds', type=int, default=2)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--dm-ratio', type=float, default=0.05)
+    parser.add_argument('--mention-ratio', type=float, default=0.05)
+    parser.add_argument('--time-scale', type=float, default=0.01,
+                        help="Real seconds per virtual second (0 skips every sleep)")
+    parser.add_argument('--llm-latency-ms', type=float, default=300.0, help="Median stub LLM latency")
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--suspicion-rate', type=float, default=0.02)
+    parser.add_argument('--no-planner', action='store_true')
+    parser.add_argument('--database-url', default='sqlite+aiosqlite:///replay.db')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Replay the trace split across this many shard processes on one database")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--no-samples', action='store_true', help="Omit queue depth samples from the report")
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    if args.trace:
+        events = load_trace(args.trace)
+    else:
+        events = synthetic_trace(args.synthetic, args.rate, guilds=args.guilds, channels=args.channels,
+                                 users=args.users, dm_ratio=args.dm_ratio, mention_ratio=args.mention_ratio,
+                                 seed=args.seed)
+    options = {
+        'time_scale': args.time_scale, 'database_url': args.database_url,
+        'llm_latency_ms': args.llm_latency_ms, 'llm_error_rate': args.llm_error_rate,
+        'suspicion_rate': args.suspicion_rate, 'with_planner': not args.no_planner, 'seed': args.seed
+    }
+    if args.shards > 1:
+        report = run_sharded_replay(events, args.shards, **options)
+        shard_reports = report['per_shard']
+    else:
+        report = asyncio.run(run_replay(events, **options))
+        shard_reports = [report]
+    if args.no_samples:
+        for shard_report in shard_reports:
+            shard_report['queue_depth'].pop('samples')
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?( .*)$')
+
+def shard_for_guild(guild_id, shard_count):
+    """Discord's routing rule: which shard receives a guild's events (DMs always go to shard 0)."""
+    if guild_id is None:
+        return 0
+    return (int(guild_id) >> 22) % shard_count
+
+def label_samples(text, **labels):
+    """Adds `labels` to every sample of a Prometheus text exposition; HELP/TYPE lines pass through."""
+    extra = ','.join(f'{k}="{v}"' for k, v in labels.items())
+    out = []
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line)
+        if not line or line.startswith('#') or not match:
+            out.append(line)
+            continue
+        name, existing, rest = match.groups()
+        inner = existing[1:-1] + ',' + extra if existing else extra
+        out.append(f"{name}{{{inner}}}{rest}")
+    return out
+
+def merge_expositions(texts_by_shard):
+    """
+    One exposition from several shards, samples labelled by shard. Each metric's samples stay
+    together under a single HELP/TYPE header, as the text format requires.
+    """
+    families = {}
+    for shard_id, text in sorted(texts_by_shard.items()):
+        family = None
+        for line in label_samples(text, shard=shard_id):
+            if not line:
+                continue
+            if line.startswith('#'):
+                parts = line.split(None, 3)
+                family = families.setdefault(parts[2] if len(parts) > 2 else '', {'meta': [], 'samples': []})
+                if line not in family['meta']:
+                    family['meta'].append(line)
+            else:
+                if family is None:
+                    family = families.setdefault('', {'meta': [], 'samples': []})
+                family['samples'].append(line)
+    lines = []
+    for family in families.values():
+        lines += family['meta'] + family['samples']
+    return '\n'.join(lines) + '\n'
+
+class ShardProcess:
+    def __init__(self, shard_id, shard_count, metrics_port=0):
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.metrics_port = metrics_port
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+
+    def env(self):
+        env = dict(os.environ)
+        env['SHARD_ID'] = str(self.shard_id)
+        env['SHARD_COUNT'] = str(self.shard_count)
+        env.setdefault('DB_JOURNAL_MODE', 'WAL')
+        return env
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discord_bot.py')],
+            env=self.env()
+        )
+        self.started_at = time.monotonic()
+
+class Supervisor:
+    """
+    Runs one DiscordAIBot process per shard and restarts any that exit, with exponential
+    backoff that resets once a shard has stayed up for `stable_after` seconds. If METRICS_PORT
+    is set, shard N serves its own metrics on METRICS_PORT + 1 + N (the bot applies that offset
+    itself when SHARD_ID is set), and the supervisor serves all of them on METRICS_PORT with a
+    `shard` label. TRACE_FILE likewise gets a `.shardN` suffix per worker.
+    """
+
+    def __init__(self, shard_count, metrics_host='127.0.0.1', metrics_port=0,
+                 max_backoff=300.0, stable_after=600.0):
+        self.shard_count = shard_count
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.shards = [
+            ShardProcess(i, shard_count, metrics_port + 1 + i if metrics_port else 0)
+            for i in range(shard_count)
+        ]
+        self.stopping = False
+        self.runner = None
+
+    async def prepare_database(self):
+        # Create tables and backfill rollups once, before shards race to do it
+        os.environ.setdefault('DB_JOURNAL_MODE', 'WAL')
+        from database import db_manager
+        await db_manager.initialize()
+        await db_manager.close()
+
+    async def scrape(self):
+        import aiohttp
+
+        texts = {}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            for shard in self.shards:
+                try:
+                    async with session.get(f"http://{self.metrics_host}:{shard.metrics_port}/metrics") as resp:
+                        texts[shard.shard_id] = await resp.text()
+                except Exception as e:
+                    print(f"Metrics scrape failed for shard {shard.shard_id}: {e}")
+        return texts
+
+    async def start_metrics_server(self):
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            text = merge_expositions(await self.scrape())
+            lines = [
+                "# HELP bot_shard_restarts_total Times the supervisor restarted a shard",
+                "# TYPE bot_shard_restarts_total counter"
+            ]
+            lines += [f'bot_shard_restarts_total{{shard="{s.shard_id}"}} {s.restarts}' for s in self.shards]
+            return web.Response(text=text + '\n'.join(lines) + '\n', content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle_metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.metrics_host, self.metrics_port).start()
+
+    async def watch(self, shard):
+        backoff = 1.0
+        while not self.stopping:
+            shard.start()
+            print(f"Shard {shard.shard_id}/{self.shard_count} started (pid {shard.process.pid})")
+            code = await asyncio.to_thread(shard.process.wait)
+            if self.stopping:
+                return
+            uptime = time.monotonic() - shard.started_at
+            if uptime >= self.stable_after:
+                backoff = 1.0
+            print(f"Shard {shard.shard_id} exited with code {code} after {uptime:.0f}s; restarting in {backoff:.0f}s")
+            shard.restarts += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def stop(self):
+        self.stopping = True
+        for shard in self.shards:
+            if shard.process and shard.process.poll() is None:
+                shard.process.terminate()
+
+    async def run(self):
+        await self.prepare_database()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                pass
+        if self.metrics_port:
+            await self.start_metrics_server()
+            print(f"Aggregated shard metrics on {self.metrics_host}:{self.metrics_port}/metrics")
+        try:
+            await asyncio.gather(*(self.watch(shard) for shard in self.shards))
+        finally:
+            self.stop()
+            if self.runner:
+                await self.runner.cleanup()
+
+def main(shard_count=None):
+    if shard_count is None:
+        shard_count = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv('SHARD_COUNT', '1') or 1)
+    supervisor = Supervisor(
+        shard_count,
+        metrics_host=os.getenv('METRICS_HOST', '127.0.0.1'),
+        metrics_port=int(os.getenv('METRICS_PORT', '0') or 0)
+    )
+    asyncio.run(supervisor.run())
+
+if __name__ == '__main__':
+    main()
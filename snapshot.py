@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+DEFAULT_SNAPSHOT_PATH = 'analytics_snapshot.db'
+
+def snapshot_path():
+    return os.getenv('ANALYTICS_SNAPSHOT_PATH') or DEFAULT_SNAPSHOT_PATH
+
+def _sqlite_path(url):
+    if url.startswith('sqlite') and ':///' in url and ':memory:' not in url:
+        return url.split(':///', 1)[1]
+    return None
+
+def backup_sqlite(source_path, target_path, busy_timeout=30.0):
+    """
+    Copies a live SQLite file with the online backup API, in one step so the copy is a
+    single consistent read transaction. In WAL mode that read never blocks the bot's
+    writers. The copy is written next to the target and swapped in, so readers of the
+    previous snapshot are never left with a half-written file.
+    """
+    tmp = target_path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True, timeout=busy_timeout)
+    try:
+        target = sqlite3.connect(tmp)
+        try:
+            source.backup(target)
+            # The header is copied too; a private read-only copy has no use for WAL files
+            target.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            target.close()
+    finally:
+        source.close()
+    os.replace(tmp, target_path)
+
+async def take_snapshot(database_url=None, path=None):
+    """Refreshes the analytics snapshot of a SQLite database. Returns (path, seconds, bytes)."""
+    database_url = database_url or os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///discord_bot.db')
+    source = _sqlite_path(database_url)
+    if source is None:
+        raise ValueError(
+            "Snapshots are only taken of SQLite databases; point ANALYTICS_DATABASE_URL at a read replica instead"
+        )
+    path = path or snapshot_path()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    started = time.perf_counter()
+    await asyncio.to_thread(backup_sqlite, source, path, float(os.getenv('DB_BUSY_TIMEOUT', '30')))
+    return path, time.perf_counter() - started, os.path.getsize(path)
+
+def analytics_url(live=False):
+    """
+    Where analytics reads go: ANALYTICS_DATABASE_URL (e.g. a Postgres replica) if set,
+    else the snapshot file if one has been taken, else None for the live database.
+    """
+    if live:
+        return None
+    url = os.getenv('ANALYTICS_DATABASE_URL')
+    if url:
+        return url
+    path = snapshot_path()
+    if os.path.exists(path):
+        return f'sqlite+aiosqlite:///{path}'
+    return None
+
+async def use_analytics_source(db_manager, live=False, refresh=False):
+    """
+    Points `db_manager` at the analytics copy instead of the live database. The copy is
+    never initialized (that would write to it); the live database is, as before.
+    Returns the URL now in use.
+    """
+    if refresh and not live and not os.getenv('ANALYTICS_DATABASE_URL'):
+        path, seconds, size = await take_snapshot(db_manager.database_url)
+        print(f"Snapshot refreshed: {path} ({size / 1024 / 1024:.1f} MiB in {seconds:.1f}s)", file=sys.stderr)
+    url = analytics_url(live)
+    if url is None:
+        await db_manager.initialize()
+        return db_manager.database_url
+    await db_manager.reconfigure(url)
+    path = _sqlite_path(url)
+    if path:
+        taken = datetime.fromtimestamp(os.path.getmtime(path))
+        age = (datetime.now() - taken).total_seconds() / 60
+        print(f"Reading snapshot {path} taken {taken:%Y-%m-%d %H:%M} ({age:.0f} min ago); --live reads the bot's database",
+              file=sys.stderr)
+    return url
+
+def add_source_arguments(parser):
+    parser.add_argument('--live', action='store_true',
+                        help="Query the bot's database directly instead of the analytics snapshot")
+    parser.add_argument('--refresh-snapshot', action='store_true',
+                        help="Take a fresh snapshot before querying")
+
+async def run(every=None):
+    while True:
+        path, seconds, size = await take_snapshot()
+        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] Snapshot written to {path} "
+              f"({size / 1024 / 1024:.1f} MiB in {seconds:.1f}s)")
+        if not every:
+            return
+        await asyncio.sleep(every * 60)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Write a consistent read-only copy of the SQLite database for stats_viewer and exports"
+    )
+    parser.add_argument('--every', type=float, help="Keep running and refresh every N minutes")
+    return parser
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    asyncio.run(run(args.every))
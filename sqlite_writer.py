@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import metrics
+
+_STOP = object()
+
+def writer_engine(database_url, busy_timeout=30.0):
+    """
+    One long-lived connection (aiosqlite runs it on its own thread) that takes the write
+    lock up front with BEGIN IMMEDIATE. pysqlite's own transaction handling is switched off
+    so SAVEPOINTs work, as the SQLAlchemy SQLite docs describe.
+    """
+    engine = create_async_engine(
+        database_url, echo=False, poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0,
+        connect_args={'timeout': busy_timeout}
+    )
+
+    @event.listens_for(engine.sync_engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, 'begin')
+    def _begin(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    return engine
+
+def reader_engine(database_url, pool_size=4):
+    """A small pool of read-only connections; with WAL they never wait for the writer."""
+    path = database_url.split(':///', 1)[1]
+    return create_async_engine(
+        f"sqlite+aiosqlite:///file:{path}?mode=ro&uri=true", echo=False,
+        poolclass=AsyncAdaptedQueuePool, pool_size=pool_size, max_overflow=0
+    )
+
+class SQLiteWriter:
+    """
+    Serializes every DatabaseManager write through one connection and group-commits them.
+
+    `submit(fn)` queues `fn(session)`; the writer task runs each queued unit inside its own
+    SAVEPOINT (so one failing unit doesn't undo the others), commits everything that was
+    pending in a single transaction, and only then resolves each caller's future. Writes
+    therefore never race each other for the SQLite lock, and a burst costs one fsync
+    instead of one per write. Callbacks a unit appends to `session.info['on_commit']` run
+    once its writes are committed, and are dropped if they are rolled back.
+    """
+
+    def __init__(self, engine, max_batch=200):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        self.queue = None
+        self.task = None
+        self.lock = asyncio.Lock()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self.run())
+
+    async def submit(self, fn):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fn, future))
+        return await future
+
+    async def run(self):
+        async with self.session_factory() as session:
+            while True:
+                batch = [await self.queue.get()]
+                while len(batch) < self.max_batch and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                stop = any(item is _STOP for item in batch)
+                batch = [item for item in batch if item is not _STOP]
+                if batch:
+                    async with self.lock:
+                        await self._commit_batch(session, batch)
+                if stop:
+                    return
+
+    async def _commit_batch(self, session, batch):
+        results = []
+        for fn, future in batch:
+            if future.cancelled():
+                continue
+            session.info['on_commit'] = []
+            try:
+                async with session.begin_nested():
+                    value = await fn(session)
+                results.append((future, value, None, session.info['on_commit']))
+            except Exception as e:
+                results.append((future, None, e, []))
+        try:
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            results = [(future, None, e, []) for future, _, _, _ in results]
+        # Returned objects stay usable (expire_on_commit=False) but the identity map must not grow forever
+        session.expunge_all()
+        metrics.db_write_batch.observe(len(results))
+
+        for future, value, error, callbacks in results:
+            for callback in callbacks:
+                callback()
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+    @contextlib.asynccontextmanager
+    async def paused(self):
+        """Holds off group commits (submitted writes keep queueing) while maintenance such as VACUUM uses its own connection."""
+        async with self.lock:
+            yield
+
+    async def close(self):
+        """Commits whatever is still queued, then stops the writer task."""
+        if self.task is not None and not self.task.done():
+            self.queue.put_nowait(_STOP)
+            await self.task
+        self.task = None
+        await self.engine.dispose()
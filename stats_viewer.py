@@ -1,157 +1,249 @@
+import argparse
 import asyncio
-from datetime import datetime, timedelta
+import json
+from datetime import datetime
 from database import db_manager
-from sqlalchemy import select, func, desc
-from database import User, Message, BotResponse, SocialTestLog
+from sqlalchemy import select, desc
+from database import SocialTestLog, ARCHIVED_MODELS
+from data_export import run_export, add_export_arguments, EXPORT_TABLES, FORMATS
+from snapshot import use_analytics_source, add_source_arguments
+
+async def collect_stats():
+    user_stats = await db_manager.get_user_stats()
+    message_stats = await db_manager.get_message_stats()
+    recent_messages, recent_responses = await db_manager.get_recent_activity(hours=24)
+    return {
+        'total_users': user_stats[0],
+        'suspicious_users': user_stats[1],
+        'total_suspicions': user_stats[2],
+        'total_messages': message_stats[0],
+        'dm_messages': message_stats[1],
+        'bot_responses': message_stats[2],
+        'messages_24h': recent_messages,
+        'responses_24h': recent_responses
+    }
+
+async def collect_top_users(limit=5):
+    return [
+        {'username': row.username, 'server_name': row.server_name, 'messages': row.msg_count}
+        for row in await db_manager.get_top_users(limit=limit)
+    ]
+
+async def collect_logs(log_type=None, limit=10):
+    async with db_manager.async_session() as session:
+        query = select(SocialTestLog).order_by(desc(SocialTestLog.timestamp)).limit(limit)
+        if log_type:
+            query = query.where(SocialTestLog.log_type == log_type)
+        result = await session.execute(query)
+        return [
+            {'timestamp': log.timestamp.isoformat(), 'log_type': log.log_type, 'content': log.content}
+            for log in result.scalars()
+        ]
+
+async def collect_search(query, guild=None, channel=None, since=None, limit=20, any_term=False):
+    rows = await db_manager.search_messages(query, guild, channel, since, limit, any_term)
+    return [
+        {
+            'timestamp': message.timestamp.isoformat() if message.timestamp else None,
+            'where': f"{guild_name or 'DM'} #{channel_name or message.channel_id}",
+            'author': username,
+            'content': message.content
+        }
+        for message, author_id, username, channel_name, guild_name in rows
+    ]
 
 async def show_stats():
     print("\n" + "="*60)
     print("DISCORD AI BOT STATS")
     print("="*60 + "\n")
     
-    user_stats = await db_manager.get_user_stats()
-    message_stats = await db_manager.get_message_stats()
+    stats = await collect_stats()
     
     print("GENERAL STATS")
     print("-" * 40)
-    print(f"Total users: {user_stats[0]}")
-    print(f"Suspicious users: {user_stats[1]}")
-    print(f"Total suspicions: {user_stats[2]}")
-    print(f"Messages received: {message_stats[0]}")
-    print(f"DM messages: {message_stats[1]}")
-    print(f"Bot responses: {message_stats[2]}")
-    
-    print("\nRECENT ACTIVITY (LAST 24H)")
-    print("-" * 40)
+    print(f"Total users: {stats['total_users']}")
+    print(f"Suspicious users: {stats['suspicious_users']}")
+    print(f"Total suspicions: {stats['total_suspicions']}")
+    print(f"Messages received: {stats['total_messages']}")
+    print(f"DM messages: {stats['dm_messages']}")
+    print(f"Bot responses: {stats['bot_responses']}")
     
-    async with db_manager.async_session() as session:
-        yesterday = datetime.now() - timedelta(hours=24)
-        
-        result = await session.execute(
-            select(func.count(Message.id)).where(Message.timestamp >= yesterday)
-        )
-        recent_messages = result.scalar()
-        
-        result = await session.execute(
-            select(func.count(BotResponse.id)).where(BotResponse.timestamp >= yesterday)
-        )
-        recent_responses = result.scalar()
-        
-        print(f"Messages received: {recent_messages}")
-        print(f"Responses sent: {recent_responses}")
+    print("\nRECENT ACTIVITY (LAST 24-25H, HOURLY BUCKETS)")
+    print("-" * 40)
+    print(f"Messages received: {stats['messages_24h']}")
+    print(f"Responses sent: {stats['responses_24h']}")
     
     print("\nTOP 5 USERS BY INTERACTIONS")
     print("-" * 40)
     
-    async with db_manager.async_session() as session:
-        result = await session.execute(
-            select(
-                User.username,
-                User.server_name,
-                func.count(Message.id).label('msg_count')
-            )
-            .join(Message, User.id == Message.user_id)
-            .group_by(User.id)
-            .order_by(desc('msg_count'))
-            .limit(5)
-        )
-        
-        for row in result:
-            print(f"{row.username} - {row.msg_count} messages ({row.server_name})")
+    for row in await collect_top_users(limit=5):
+        print(f"{row['username']} - {row['messages']} messages ({row['server_name']})")
     
     print("\nLATEST 10 SUSPICIONS")
     print("-" * 40)
     
-    async with db_manager.async_session() as session:
-        result = await session.execute(
-            select(SocialTestLog)
-            .where(SocialTestLog.log_type == 'SUSPICION')
-            .order_by(desc(SocialTestLog.timestamp))
-            .limit(10)
-        )
-        
-        for log in result.scalars():
-            print(f"[{log.timestamp.strftime('%Y-%m-%d %H:%M')}] {log.content}")
+    for log in await collect_logs('SUSPICION', limit=10):
+        print(f"[{log['timestamp'][:16].replace('T', ' ')}] {log['content']}")
     
     print("\nLATEST 10 LOGS")
     print("-" * 40)
     
-    async with db_manager.async_session() as session:
-        result = await session.execute(
-            select(SocialTestLog)
-            .order_by(desc(SocialTestLog.timestamp))
-            .limit(10)
-        )
-        
-        for log in result.scalars():
-            print(f"[{log.timestamp.strftime('%Y-%m-%d %H:%M')}] {log.log_type}: {log.content[:80]}...")
+    for log in await collect_logs(limit=10):
+        print(f"[{log['timestamp'][:16].replace('T', ' ')}] {log['log_type']}: {log['content'][:80]}...")
     
     print("\n" + "="*60 + "\n")
 
-async def export_data(filename="discord_bot_export.txt"):
-    print(f"\nExporting data to {filename}...")
+async def export_data(output_dir="export", fmt="csv"):
+    print(f"\nExporting data to {output_dir}/ ({fmt})...")
+    await run_export(list(EXPORT_TABLES), output_dir, fmt)
+    print(f"Export completed")
+
+async def browse_archive(table_name="messages", since=None, until=None, limit=20):
+    catalog = await db_manager.get_archive_catalog(table_name)
+    if not catalog:
+        print("\nNo archived data.")
+        return
     
-    async with db_manager.async_session() as session:
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write("="*60 + "\n")
-            f.write("DISCORD AI BOT DATA EXPORT\n")
-            f.write(f"Exported at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write("="*60 + "\n\n")
-            
-            f.write("USERS\n")
-            f.write("-" * 40 + "\n")
-            result = await session.execute(select(User))
-            for user in result.scalars():
-                f.write(f"ID: {user.discord_id} | Username: {user.username} | ")
-                f.write(f"Server: {user.server_name} | Suspicious: {user.is_suspicious} | ")
-                f.write(f"Suspicion count: {user.suspicion_count}\n")
-            
-            f.write("\nRECEIVED MESSAGES\n")
-            f.write("-" * 40 + "\n")
-            result = await session.execute(select(Message).limit(50))
-            for msg in result.scalars():
-                f.write(f"[{msg.timestamp.strftime('%Y-%m-%d %H:%M')}] ")
-                f.write(f"#{msg.channel_name} | {msg.content[:100]}...\n")
-            
-            f.write("\nBOT RESPONSES\n")
-            f.write("-" * 40 + "\n")
-            result = await session.execute(select(BotResponse).limit(50))
-            for resp in result.scalars():
-                f.write(f"[{resp.timestamp.strftime('%Y-%m-%d %H:%M')}] ")
-                f.write(f"Type: {resp.action_type} | {resp.content[:100]}...\n")
-            
-            f.write("\nSUSPICION LOGS\n")
-            f.write("-" * 40 + "\n")
-            result = await session.execute(
-                select(SocialTestLog)
-                .where(SocialTestLog.log_type == 'SUSPICION')
-            )
-            for log in result.scalars():
-                f.write(f"[{log.timestamp.strftime('%Y-%m-%d %H:%M')}] {log.content}\n")
+    print(f"\nARCHIVED {table_name.upper()}")
+    print("-" * 40)
+    for entry in catalog:
+        print(f"{entry.period}: {entry.row_count} rows ({entry.path})")
     
-    print(f"Export completed")
+    print(f"\nFIRST {limit} ROWS IN RANGE")
+    print("-" * 40)
+    async for row in db_manager.query_archive(table_name, since, until, limit=limit):
+        content = (row.content or '')[:80]
+        print(f"[{row.timestamp.strftime('%Y-%m-%d %H:%M')}] {content}")
+
+async def collect_archive(table_name="messages", since=None, until=None, limit=20):
+    catalog = await db_manager.get_archive_catalog(table_name)
+    rows = []
+    async for row in db_manager.query_archive(table_name, since, until, limit=limit):
+        rows.append({k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row._mapping.items()})
+    return {
+        'catalog': [
+            {'period': e.period, 'rows': e.row_count, 'path': e.path} for e in catalog
+        ],
+        'rows': rows
+    }
+
+def _print_result(data, as_json):
+    if as_json:
+        print(json.dumps(data, indent=2, ensure_ascii=False))
+        return
+    if isinstance(data, dict):
+        for key, value in data.items():
+            print(f"{key}: {value}")
+    else:
+        for item in data:
+            print(" | ".join(f"{k}: {v}" for k, v in item.items()))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Discord AI bot stats viewer. Run without a command for the interactive menu.")
+    add_source_arguments(parser)
+    sub = parser.add_subparsers(dest='command')
+    
+    p = sub.add_parser('stats', help="General counters and last 24-25h activity (hourly buckets)")
+    p.add_argument('--json', action='store_true')
+    
+    p = sub.add_parser('top-users', help="Most active users")
+    p.add_argument('--limit', type=int, default=5)
+    p.add_argument('--json', action='store_true')
+    
+    p = sub.add_parser('logs', help="Latest social test logs")
+    p.add_argument('--type', dest='log_type', help="e.g. SUSPICION, ERROR, ROAMING")
+    p.add_argument('--limit', type=int, default=10)
+    p.add_argument('--json', action='store_true')
+    
+    p = sub.add_parser('search', help="Full-text search over stored messages, best match first")
+    p.add_argument('query', nargs='+')
+    p.add_argument('--guild', help="Only this server ID")
+    p.add_argument('--channel', help="Only this channel ID")
+    p.add_argument('--since', type=datetime.fromisoformat)
+    p.add_argument('--any', dest='any_term', action='store_true', help="Match any word instead of all of them")
+    p.add_argument('--limit', type=int, default=20)
+    p.add_argument('--json', action='store_true')
+    
+    p = sub.add_parser('archive', help="Archive catalog and archived rows in a time range")
+    p.add_argument('--table', choices=list(ARCHIVED_MODELS), default='messages')
+    p.add_argument('--since', type=datetime.fromisoformat)
+    p.add_argument('--until', type=datetime.fromisoformat)
+    p.add_argument('--limit', type=int, default=20)
+    p.add_argument('--json', action='store_true')
+    
+    p = sub.add_parser('export', help="Stream tables to CSV/JSONL/Parquet")
+    add_export_arguments(p)
+    
+    return parser
+
+async def run_command(args):
+    await use_analytics_source(db_manager, args.live, args.refresh_snapshot)
+    try:
+        if args.command == 'stats':
+            _print_result(await collect_stats(), args.json)
+        elif args.command == 'top-users':
+            _print_result(await collect_top_users(args.limit), args.json)
+        elif args.command == 'logs':
+            _print_result(await collect_logs(args.log_type, args.limit), args.json)
+        elif args.command == 'search':
+            _print_result(await collect_search(
+                ' '.join(args.query), args.guild, args.channel, args.since, args.limit, args.any_term
+            ), args.json)
+        elif args.command == 'archive':
+            data = await collect_archive(args.table, args.since, args.until, args.limit)
+            if args.json:
+                _print_result(data, True)
+            else:
+                _print_result(data['catalog'], False)
+                _print_result(data['rows'], False)
+        elif args.command == 'export':
+            await run_export(
+                args.tables, args.output_dir, args.fmt, args.since, args.until, args.guild,
+                args.incremental, args.state_file, args.chunk_size
+            )
+    finally:
+        await db_manager.close()
 
-async def main():
-    await db_manager.initialize()
+async def main(live=False, refresh_snapshot=False):
+    await use_analytics_source(db_manager, live, refresh_snapshot)
     
     while True:
         print("\nDISCORD AI BOT STATS VIEWER")
         print("="*50)
         print("1. Show general stats")
         print("2. Export data to file")
-        print("3. Exit")
+        print("3. Browse archived messages")
+        print("4. Search messages")
+        print("5. Exit")
         print("="*50)
         
-        choice = input("\nChoose an option (1-3): ").strip()
+        choice = input("\nChoose an option (1-5): ").strip()
         
         if choice == '1':
             await show_stats()
         elif choice == '2':
-            filename = input("File name (press Enter for default): ").strip()
-            if not filename:
-                filename = "discord_bot_export.txt"
-            await export_data(filename)
+            output_dir = input("Output directory (press Enter for default): ").strip() or "export"
+            fmt = input("Format csv/jsonl/parquet (press Enter for csv): ").strip().lower() or "csv"
+            if fmt not in FORMATS:
+                print("Invalid format!")
+                continue
+            await export_data(output_dir, fmt)
         elif choice == '3':
+            raw_since = input("From date YYYY-MM-DD (press Enter for all): ").strip()
+            raw_until = input("To date YYYY-MM-DD (press Enter for all): ").strip()
+            try:
+                since = datetime.fromisoformat(raw_since) if raw_since else None
+                until = datetime.fromisoformat(raw_until) if raw_until else None
+            except ValueError:
+                print("Invalid date!")
+                continue
+            await browse_archive("messages", since, until)
+        elif choice == '4':
+            query = input("Words to search for: ").strip()
+            if query:
+                for row in await collect_search(query):
+                    print(f"[{(row['timestamp'] or '')[:16].replace('T', ' ')}] {row['where']} {row['author']}: {row['content'][:120]}")
+        elif choice == '5':
             print("Goodbye!")
             break
         else:
@@ -160,4 +252,8 @@ async def main():
     await db_manager.close()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    args = build_parser().parse_args()
+    if args.command:
+        asyncio.run(run_command(args))
+    else:
+        asyncio.run(main(args.live, args.refresh_snapshot))
@@ -0,0 +1,120 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+
+from database import db_manager
+
+class RollingSummaries:
+    """
+    Compact rolling summaries of each channel and of each user, so prompts carry a short
+    digest plus the last few lines instead of ever more raw history.
+
+    `note()` only queues a message line. Once `every` new lines have piled up for a key,
+    a background task folds them into that key's previous summary with one
+    `summarize(previous, lines, scope)` call and stores the result in the database.
+    A key never has two updates in flight and at most `concurrency` run at once, so
+    summaries cost one short LLM call per `every` messages, off the reply path.
+    Stored summaries are loaded the first time a key is asked for.
+    """
+
+    def __init__(self, summarize, every=20, concurrency=1, retry_after=60.0, log=print):
+        self.summarize = summarize
+        self.every = every
+        self.retry_after = retry_after
+        self.log = log
+        self.summaries = {}
+        self.counts = {}
+        self.pending = {}
+        self.tasks = {}
+        self.failed_at = {}
+        self._seq = itertools.count()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @staticmethod
+    def keys(data):
+        return [('channel', data['channel']), ('user', data['author'])]
+
+    def note(self, data):
+        line = f"{data.get('author_name') or data['author']}: {(data.get('content') or '')[:300]}"
+        if data.get('channel_name') and data['channel_name'] != 'DM':
+            user_line = f"[#{data['channel_name']}] {line}"
+        else:
+            user_line = line
+        for key, text in zip(self.keys(data), (line, user_line)):
+            pending = self.pending.get(key)
+            if pending is None:
+                # If updates keep failing, only the newest lines are kept
+                pending = self.pending[key] = deque(maxlen=self.every * 4)
+            # Arrival order, not message id: messages can be delivered out of id order
+            pending.append((next(self._seq), data['id'], text))
+            self._maybe_update(key)
+
+    def _maybe_update(self, key):
+        if key in self.tasks or len(self.pending.get(key, ())) < self.every:
+            return
+        if time.monotonic() - self.failed_at.get(key, float('-inf')) < self.retry_after:
+            return
+        self.tasks[key] = asyncio.create_task(self._update(key))
+
+    async def _update(self, key):
+        scope, scope_id = key
+        try:
+            async with self._semaphore:
+                await self.load([key])
+                batch = list(self.pending[key])
+                summary = await self.summarize(self.summaries.get(key, ''), [text for _, _, text in batch], scope)
+                if not summary:
+                    raise ValueError("empty summary")
+                last_seq, last_id, _ = batch[-1]
+                count = self.counts.get(key, 0) + len(batch)
+                await db_manager.save_summary(scope, scope_id, summary, count, last_id)
+            self.summaries[key] = summary
+            self.counts[key] = count
+            self.failed_at.pop(key, None)
+            # Lines that arrived during the call stay queued for the next update
+            pending = self.pending[key]
+            while pending and pending[0][0] <= last_seq:
+                pending.popleft()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed_at[key] = time.monotonic()
+            self.log(f"Summary update failed for {scope} {scope_id}: {e}")
+        finally:
+            self.tasks.pop(key, None)
+        self._maybe_update(key)
+
+    async def load(self, keys):
+        """Fetches the stored summaries of keys not seen yet."""
+        missing = [key for key in keys if key not in self.summaries]
+        if not missing:
+            return
+        rows = await db_manager.get_summaries(missing)
+        for key in missing:
+            row = rows.get(key)
+            # Another update may have finished while we were reading
+            if key not in self.summaries:
+                self.summaries[key] = row.summary if row else ''
+                self.counts[key] = row.message_count if row else 0
+
+    def get(self, key):
+        return self.summaries.get(key, '')
+
+    def pending_state(self):
+        """Lines not summarized yet, for the bot's state snapshot."""
+        return {f'{scope}:{scope_id}': list(lines) for (scope, scope_id), lines in self.pending.items() if lines}
+
+    def restore_pending(self, state):
+        for name, lines in (state or {}).items():
+            scope, scope_id = name.split(':', 1)
+            self.pending[(scope, int(scope_id))] = deque(
+                ((next(self._seq), message_id, text) for _, message_id, text in lines), maxlen=self.every * 4
+            )
+
+    async def close(self):
+        """Cancels updates still in flight; their lines stay pending."""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,40 @@
+import asyncio
+
+from action_queue import ActionQueue, AMBIENT, URGENT
+
+
+def test_ambient_message_does_not_replace_queued_mention():
+    discarded = []
+    queue = ActionQueue(on_discard=lambda item, reason: discarded.append((item, reason)))
+    mention = ('handle_message', 'mention')
+    ambient = ('handle_message', 'ambient')
+
+    queue.put_nowait(mention, priority=URGENT, merge_key=1)
+    queue.put_nowait(ambient, priority=AMBIENT, merge_key=1)
+
+    assert queue.qsize() == 1
+    assert queue.depth_by_priority() == {'urgent': 1, 'ambient': 0, 'planned': 0}
+    assert asyncio.run(queue.get()) == mention
+    assert discarded == [(ambient, 'merged')]
+
+
+def test_newer_message_replaces_queued_one_of_same_priority():
+    discarded = []
+    queue = ActionQueue(on_discard=lambda item, reason: discarded.append((item, reason)))
+
+    queue.put_nowait('first', priority=AMBIENT, merge_key=1)
+    queue.put_nowait('second', priority=AMBIENT, merge_key=1)
+
+    assert asyncio.run(queue.get()) == 'second'
+    assert discarded == [('first', 'merged')]
+
+
+def test_mention_upgrades_queued_ambient_message():
+    queue = ActionQueue()
+
+    queue.put_nowait('other', priority=AMBIENT, merge_key=2)
+    queue.put_nowait('ambient', priority=AMBIENT, merge_key=1)
+    queue.put_nowait('mention', priority=URGENT, merge_key=1)
+
+    assert queue.qsize() == 2
+    assert asyncio.run(queue.get()) == 'mention'
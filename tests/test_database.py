@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select, func
+
+from database import db_manager, User, Message, BotResponse, Interaction, StatsCounter
+
+TASKS = 200
+HOT_USERS = 5
+
+
+async def _hammer(path):
+    await db_manager.reconfigure(f'sqlite+aiosqlite:///{path}')
+    await db_manager.initialize()
+    used_writer = db_manager.writer is not None
+    authors = [20_000 + i % HOT_USERS for i in range(TASKS)]
+    messages = TASKS // 2
+
+    async def writer(i):
+        uid = authors[i]
+        msg_id = 7_000_000 + i % messages
+        if i % 3 == 0:
+            await db_manager.get_or_create_user(uid, f'user{uid}', None, 100, 'test')
+        await db_manager.save_message(uid, f'user{uid}', None, msg_id, 1000, 'general', 'hi', 100, 'test')
+        await db_manager.record_reply(msg_id, 1000, 'lol', uid, f'user{uid}', server_id=100, server_name='test')
+
+    try:
+        await asyncio.gather(*(writer(i) for i in range(TASKS)))
+        async with db_manager.read_session() as session:
+            rows = {
+                model: await session.scalar(select(func.count()).select_from(model))
+                for model in (User, Message, BotResponse, Interaction)
+            }
+            counters = dict((await session.execute(select(StatsCounter.name, StatsCounter.value))).all())
+    finally:
+        await db_manager.close()
+    return used_writer, rows, counters
+
+
+@pytest.mark.parametrize('sqlite_writer', [False, True], ids=['per-session', 'single-writer'])
+def test_concurrent_writes_on_hot_users_count_each_row_once(tmp_path, monkeypatch, sqlite_writer):
+    monkeypatch.setattr(db_manager, 'sqlite_writer', sqlite_writer)
+
+    used_writer, rows, counters = asyncio.run(_hammer(tmp_path / 'contention.db'))
+
+    assert used_writer == sqlite_writer
+    assert rows == {User: HOT_USERS, Message: TASKS // 2, BotResponse: TASKS // 2, Interaction: TASKS}
+    assert counters['users'] == HOT_USERS
+    assert counters['messages'] == TASKS // 2
+    assert counters['bot_responses'] == TASKS // 2
+
+
+def test_save_message_reports_replayed_messages(tmp_path):
+    async def save_twice():
+        await db_manager.reconfigure(f"sqlite+aiosqlite:///{tmp_path / 'replay.db'}")
+        await db_manager.initialize()
+        try:
+            first = await db_manager.save_message(1, 'user1', None, 42, 1000, 'general', 'hi', 100, 'test')
+            again = await db_manager.save_message(1, 'user1', None, 42, 1000, 'general', 'hi', 100, 'test')
+        finally:
+            await db_manager.close()
+        return first, again
+
+    (first, created), (again, created_again) = asyncio.run(save_twice())
+
+    assert created and not created_again
+    assert again.id == first.id
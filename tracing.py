@@ -0,0 +1,400 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# Span kinds: 'work' is real processing, 'sleep' is an intentional human-like delay,
+# 'wait' is time spent queued behind other work.
+WORK, SLEEP, WAIT = 'work', 'sleep', 'wait'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    __slots__ = ('span_id', 'parent_id', 'name', 'kind', 'start', 'end', 'attrs')
+
+    def __init__(self, name, parent_id=None, kind=WORK, attrs=None):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.monotonic_ns()
+        self.end = None
+        self.attrs = attrs or {}
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.monotonic_ns()
+
+class _SpanContext:
+    def __init__(self, trace, name, kind, attrs):
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is None or parent not in self.trace.spans:
+            parent = self.trace.root
+        self.span = self.trace._add(Span(self.name, parent.span_id, self.kind, self.attrs))
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.finish()
+        if exc_type is not None:
+            self.span.attrs['error'] = exc_type.__name__
+        _current_span.reset(self.token)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+class Trace:
+    def __init__(self, tracer, key, name, attrs=None):
+        self.tracer = tracer
+        self.key = key
+        self.trace_id = uuid.uuid4().hex
+        self.wall_start_ns = time.time_ns()
+        self.root = Span(name, attrs=attrs)
+        self.spans = {self.root: None}
+        self.open_spans = {}
+
+    def _add(self, span):
+        self.spans[span] = None
+        return span
+
+    def span(self, name, kind=WORK, **attrs):
+        """Context manager (sync or async) timing one stage under the current span."""
+        return _SpanContext(self, name, kind, attrs)
+
+    def open(self, name, kind=WORK, **attrs):
+        """Starts a span that is closed later from another task, e.g. a queue wait."""
+        self.open_spans[name] = self._add(Span(name, self.root.span_id, kind, attrs))
+
+    def close(self, name):
+        span = self.open_spans.pop(name, None)
+        if span:
+            span.finish()
+
+    def activate(self):
+        """Makes this trace's root the parent for spans opened in the current task."""
+        _current_span.set(self.root)
+
+    def finish(self, status='ok'):
+        self.tracer.finish(self.key, status)
+
+    def to_dict(self, status):
+        origin = self.root.start
+        return {
+            'trace_id': self.trace_id,
+            'key': str(self.key),
+            'name': self.root.name,
+            'status': status,
+            'start_unix_ns': self.wall_start_ns,
+            'spans': [
+                {
+                    'span_id': s.span_id,
+                    'parent_id': s.parent_id,
+                    'name': s.name,
+                    'kind': s.kind,
+                    'start_ms': round((s.start - origin) / 1e6, 3),
+                    'duration_ms': round(((s.end or s.start) - s.start) / 1e6, 3),
+                    'attrs': {k: str(v) for k, v in s.attrs.items()}
+                }
+                for s in self.spans
+            ]
+        }
+
+class _NullTrace:
+    def span(self, name, kind=WORK, **attrs):
+        return _NULL_CONTEXT
+
+    def open(self, name, kind=WORK, **attrs):
+        pass
+
+    def close(self, name):
+        pass
+
+    def activate(self):
+        pass
+
+    def finish(self, status='ok'):
+        pass
+
+class _NullContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+NULL_TRACE = _NullTrace()
+
+class FileExporter:
+    def __init__(self, path, batch_size=20):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def export(self, trace_dict):
+        self.buffer.append(trace_dict)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        lines = ''.join(json.dumps(t, ensure_ascii=False) + '\n' for t in self.buffer)
+        self.buffer = []
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        except Exception as e:
+            print(f"Failed to write traces to {self.path}: {e}")
+
+class OtlpExporter:
+    """Posts batches to an OTLP/HTTP JSON endpoint (e.g. http://localhost:4318/v1/traces)."""
+
+    def __init__(self, endpoint, service_name='discord_bot', batch_size=20):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def export(self, trace_dict):
+        self.buffer.append(trace_dict)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        payload = to_otlp(self.buffer, self.service_name)
+        self.buffer = []
+        try:
+            asyncio.get_running_loop().create_task(self._post(payload))
+        except RuntimeError:
+            pass
+
+    async def _post(self, payload):
+        import aiohttp
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(self.endpoint, json=payload, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                    if resp.status >= 300:
+                        print(f"OTLP export failed ({resp.status})")
+        except Exception as e:
+            print(f"OTLP export error: {e}")
+
+def to_otlp(traces, service_name='discord_bot'):
+    spans = []
+    for t in traces:
+        for s in t['spans']:
+            start = t['start_unix_ns'] + int(s['start_ms'] * 1e6)
+            attrs = dict(s['attrs'], kind=s['kind'])
+            if s['parent_id'] is None:
+                attrs.update(key=t['key'], status=t['status'])
+            spans.append({
+                'traceId': t['trace_id'],
+                'spanId': s['span_id'],
+                'parentSpanId': s['parent_id'] or '',
+                'name': s['name'],
+                'startTimeUnixNano': str(start),
+                'endTimeUnixNano': str(start + int(s['duration_ms'] * 1e6)),
+                'attributes': [{'key': k, 'value': {'stringValue': str(v)}} for k, v in attrs.items()]
+            })
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': spans}]
+        }]
+    }
+
+class Tracer:
+    def __init__(self, max_active=1000):
+        self.exporters = []
+        self.max_active = max_active
+        self.active = OrderedDict()
+        path = os.getenv('TRACE_FILE')
+        if path and os.getenv('SHARD_ID'):
+            root, ext = os.path.splitext(path)
+            path = f"{root}.shard{os.getenv('SHARD_ID')}{ext}"
+        if path:
+            self.exporters.append(FileExporter(path))
+        endpoint = os.getenv('TRACE_OTLP_ENDPOINT')
+        if endpoint:
+            self.exporters.append(OtlpExporter(endpoint))
+
+    @property
+    def enabled(self):
+        return bool(self.exporters)
+
+    def start(self, key, name, **attrs):
+        if not self.enabled:
+            return NULL_TRACE
+        trace = Trace(self, key, name, attrs)
+        self.active[key] = trace
+        while len(self.active) > self.max_active:
+            old_key = next(iter(self.active))
+            self.finish(old_key, 'evicted')
+        trace.activate()
+        return trace
+
+    def get(self, key):
+        return self.active.get(key, NULL_TRACE)
+
+    def finish(self, key, status='ok'):
+        trace = self.active.pop(key, None)
+        if trace is None:
+            return
+        for span in list(trace.open_spans):
+            trace.close(span)
+        trace.root.finish()
+        data = trace.to_dict(status)
+        for exporter in self.exporters:
+            exporter.export(data)
+
+    def flush(self):
+        for exporter in self.exporters:
+            exporter.flush()
+
+tracer = Tracer()
+
+def _iter_traces(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if 'resourceSpans' in data:
+                yield from _from_otlp(data)
+            else:
+                yield data
+
+def _from_otlp(payload):
+    by_trace = {}
+    for rs in payload.get('resourceSpans', []):
+        for ss in rs.get('scopeSpans', []):
+            for s in ss.get('spans', []):
+                attrs = {a['key']: a['value'].get('stringValue') for a in s.get('attributes', [])}
+                start, end = int(s['startTimeUnixNano']), int(s['endTimeUnixNano'])
+                by_trace.setdefault(s['traceId'], []).append({
+                    'span_id': s['spanId'],
+                    'name': s['name'],
+                    'parent_id': s.get('parentSpanId') or None,
+                    'kind': attrs.get('kind', WORK),
+                    'duration_ms': (end - start) / 1e6
+                })
+    for trace_id, spans in by_trace.items():
+        yield {'trace_id': trace_id, 'spans': spans}
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+def summarize(paths):
+    """Returns {stage: {kind, count, p50, p95, p99}} in ms, plus per-trace work/sleep/wait totals."""
+    stages = {}
+    totals = {WORK: [], SLEEP: [], WAIT: [], 'total': []}
+    for path in paths:
+        for t in _iter_traces(path):
+            per_kind = {WORK: 0.0, SLEEP: 0.0, WAIT: 0.0}
+            roots = {s.get('span_id') for s in t['spans'] if s['parent_id'] is None}
+            for s in t['spans']:
+                if s['parent_id'] is None:
+                    totals['total'].append(s['duration_ms'])
+                    continue
+                entry = stages.setdefault(s['name'], {'kind': s['kind'], 'values': []})
+                entry['values'].append(s['duration_ms'])
+                # Only top-level stages count towards the per-message split, nested spans are already inside them
+                if s['kind'] in per_kind and s['parent_id'] in roots:
+                    per_kind[s['kind']] += s['duration_ms']
+            for kind, value in per_kind.items():
+                totals[kind].append(value)
+
+    def _stats(values):
+        values = sorted(values)
+        return {
+            'count': len(values),
+            'p50': round(_percentile(values, 0.50), 2),
+            'p95': round(_percentile(values, 0.95), 2),
+            'p99': round(_percentile(values, 0.99), 2)
+        }
+
+    report = {name: dict(kind=e['kind'], **_stats(e['values'])) for name, e in stages.items()}
+    report['[per message] ' + WORK] = dict(kind=WORK, **_stats(totals[WORK]))
+    report['[per message] ' + SLEEP] = dict(kind=SLEEP, **_stats(totals[SLEEP]))
+    report['[per message] ' + WAIT] = dict(kind=WAIT, **_stats(totals[WAIT]))
+    report['[per message] total'] = dict(kind='', **_stats(totals['total']))
+    return report
+
+def print_report(report):
+    print(f"{'STAGE':<36} {'KIND':<6} {'COUNT':>7} {'P50 ms':>10} {'P95 ms':>10} {'P99 ms':>10}")
+    print("-" * 84)
+    for name, r in sorted(report.items(), key=lambda item: (item[0].startswith('['), -item[1]['p95'])):
+        print(f"{name:<36} {r['kind']:<6} {r['count']:>7} {r['p50']:>10} {r['p95']:>10} {r['p99']:>10}")
+
+async def run_collector(host, port, output):
+    """Minimal OTLP/HTTP JSON collector: appends every POST to /v1/traces as one line of `output`."""
+    from aiohttp import web
+
+    async def handle(request):
+        payload = await request.json()
+        with open(output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(payload) + '\n')
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post('/v1/traces', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Collecting traces on http://{host}:{port}/v1/traces into {output}")
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Reply pipeline traces: latency report and local OTLP collector")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('report', help="p50/p95/p99 per stage from trace files")
+    p.add_argument('paths', nargs='+')
+    p.add_argument('--json', action='store_true')
+
+    p = sub.add_parser('collector', help="Run a local OTLP/HTTP JSON collector stub")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=4318)
+    p.add_argument('--output', default='otlp_traces.jsonl')
+
+    args = parser.parse_args()
+    if args.command == 'report':
+        report = summarize(args.paths)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+    elif args.command == 'collector':
+        asyncio.run(run_collector(args.host, args.port, args.output))
+
+if __name__ == '__main__':
+    main()